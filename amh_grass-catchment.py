@@ -4,15 +4,31 @@ from qgis.core import QgsProcessingMultiStepFeedback
 from qgis.core import QgsProcessingParameterCrs
 from qgis.core import QgsProcessingParameterRasterLayer
 from qgis.core import QgsProcessingParameterNumber
+from qgis.core import QgsProcessingParameterBoolean
 from qgis.core import QgsProcessingParameterVectorLayer
 from qgis.core import QgsProcessingParameterVectorDestination
 from qgis.core import QgsProcessingParameterFolderDestination
 from qgis.core import QgsProcessingParameterFeatureSink
+from qgis.core import QgsProcessingParameterEnum
 from qgis.core import QgsExpression
 from qgis.core import QgsProcessingUtils
+from qgis.core import QgsPointXY
 import processing
 import os
+import sys
 import glob
+import tempfile
+
+# helper modules live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pour_point_snap import snap_outfalls, summary, SNAPPED
+from delineation_backends import get_backend
+from resource_tuning import ResourcePlan
+import raster_output
+import polygonize
+
+# 'backend' parameter options -> delineation_backends names
+BACKENDS = ['grass', 'wbt', 'numpy']
 
 
 class grass_catchment(QgsProcessingAlgorithm):
@@ -25,6 +41,9 @@ class grass_catchment(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterVectorLayer('outfall', 'Outfall', types=[QgsProcessing.TypeVectorPoint], defaultValue=None))
         self.addParameter(QgsProcessingParameterVectorLayer('land_cover', 'Land Cover', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None))
         self.addParameter(QgsProcessingParameterVectorLayer('soil_type', 'Soil Type', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None))
+        self.addParameter(QgsProcessingParameterNumber('memory_mb', 'Memory budget (MB)', type=QgsProcessingParameterNumber.Integer, minValue=64, defaultValue=300))
+        self.addParameter(QgsProcessingParameterBoolean('snap_by_accumulation', 'Snap outfall to the highest flow accumulation', defaultValue=False))
+        self.addParameter(QgsProcessingParameterEnum('backend', 'Delineation backend', options=['GRASS', 'WhiteboxTools', 'NumPy (in-process)'], defaultValue=0))
         # Outputs
         self.addParameter(QgsProcessingParameterVectorDestination('Streams', 'Streams', optional=True, type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterVectorDestination('Basin', 'Basin', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
@@ -38,6 +57,10 @@ class grass_catchment(QgsProcessingAlgorithm):
         results = {}
         outputs = {}
 
+        # thread counts and memory for the GDAL and GRASS steps, sized to the DEM
+        dem_layer = self.parameterAsRasterLayer(parameters, 'dem', context)
+        plan = ResourcePlan(dem_layer.width(), dem_layer.height(), budget_mb=self.parameterAsInt(parameters, 'memory_mb', context))
+
         # reproject_dem
         alg_params = {
             'DATA_TYPE': 0,  
@@ -45,7 +68,7 @@ class grass_catchment(QgsProcessingAlgorithm):
             'INPUT': parameters['dem'],
             'MULTITHREADING': False,
             'NODATA': None,
-            'OPTIONS': None,
+            'OPTIONS': raster_output.processing_options('elevation'),
             'RESAMPLING': 0, 
             'SOURCE_CRS': None,
             'TARGET_CRS': parameters['crs'],
@@ -54,6 +77,7 @@ class grass_catchment(QgsProcessingAlgorithm):
             'TARGET_RESOLUTION': None,
             'OUTPUT': 'TEMPORARY_OUTPUT'
         }
+        alg_params = plan.warp(alg_params)  # threads and warp memory from the DEM size
         outputs['Reproject_dem'] = processing.run('gdal:warpreproject', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
         # Reproject Land Cover Layer
@@ -98,186 +122,33 @@ class grass_catchment(QgsProcessingAlgorithm):
         feedback.setCurrentStep(4)
         if feedback.isCanceled():
             return {}
-        
-        # grass: fill sinks
-        alg_params = {
-            '-f': False,
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'format': 0,  # grass
-            'input': outputs['Reproject_dem']['OUTPUT'],
-            'areas': 'TEMPORARY_OUTPUT',
-            'direction': 'TEMPORARY_OUTPUT',
-            'output': 'TEMPORARY_OUTPUT'
-        }
-        outputs['FillSinks'] = processing.run('grass:r.fill.dir', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(5)
-        if feedback.isCanceled():
-            return {}
-
-        # grass: r.watershed for streams
-        alg_params = {
-            '-4': False,
-            '-a': False,
-            '-b': False,
-            '-m': False,
-            '-s': False,
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'blocking': None,
-            'convergence': 5,
-            'depression': None,
-            'disturbed_land': None,
-            'elevation': outputs['FillSinks']['output'],
-            'flow': None,
-            'max_slope_length': None,
-            'memory': 300,
-            'threshold': parameters['minimum_area'],
-            'basin': 'TEMPORARY_OUTPUT',
-            'drainage': 'TEMPORARY_OUTPUT',
-            'stream': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Streams'] = processing.run('grass:r.watershed', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(6)
-        if feedback.isCanceled():
-            return {}
 
-        # grass: r.to.vect 
-        # convert subbasins rasters to vectors
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Streams']['basin'],
-            'type': 2,  # area
-            'output': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Subbasins'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(7)
-        if feedback.isCanceled():
+        # fill, flow direction, streams, basin and subbasins rasters: this script's
+        # own GRASS steps, or another backend of delineation_backends.py
+        backend_name = BACKENDS[self.parameterAsEnum(parameters, 'backend', context)]
+        if backend_name == 'grass':
+            delineated = self._grass_delineation(parameters, outputs, plan, context, feedback)
+        else:
+            delineated = self._backend_delineation(backend_name, parameters, outputs, context, feedback)
+        if delineated is None:
             return {}
+        subbasins_raster, basin_raster = delineated
 
-        # grass: r.thin
-        # thin stream rasters before converting to vector
-        # for smoother corners
-        alg_params = {
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'input': outputs['Streams']['stream'],
-            'iterations': 999,
-            'output': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Thin_streams'] = processing.run('grass:r.thin', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(8)
-        if feedback.isCanceled():
-            return {}
-
-        # grass: r.to.vect
-        # convert thinned stream rasters to vector
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Thin_streams']['output'],
-            'type': 0,  # line
-            'output': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Stream_vector'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(9)
-        if feedback.isCanceled():
-            return {}
-        
-        # snap the reprojected outfall
-        # to the nearest stream vector
-        alg_params = {
-            'BEHAVIOR': 1,  # Prefer closest point, insert extra vertices where required
-            'INPUT': outputs['reprojected_outfall']['OUTPUT'],
-            'REFERENCE_LAYER': outputs['Stream_vector']['output'],
-            'TOLERANCE': 200,
-            'OUTPUT': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Snapped'] = processing.run('native:snapgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(10)
-        if feedback.isCanceled():
-            return {}
-
-        # get the x,y coordinates of the snapped outfall
-        # this is in preparation for delineating watershed
-        # using the grass: r.water.outlet command
-        pt_layer = QgsProcessingUtils.mapLayerFromString(outputs['Snapped']['OUTPUT'], context)
-        pt = pt_layer.getGeometry(1).asPoint()
-
-        feedback.setCurrentStep(11)
-        if feedback.isCanceled():
-            return {}
-
-        # grass: r.water.outlet
-        # delineate the watershed
-        alg_params = {
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'coordinates': f'{pt.x()}, {pt.y()}',
-            'input': outputs['Streams']['drainage'],
-            'output': 'TEMPORARY_OUTPUT'
-        }
-        outputs['Basin'] = processing.run('grass:r.water.outlet', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # convert subbasins rasters to vectors, one dissolved polygon per subbasin (polygonize.py)
+        outputs['Subbasins'] = polygonize.run_step({
+            'input': subbasins_raster,
+            'output': QgsProcessingUtils.generateTempFilename('subbasins.gpkg')
+        }, feedback)
 
         feedback.setCurrentStep(12)
         if feedback.isCanceled():
             return {}
 
-        # grass: r.to.vect
         # convert basin raster to vector
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Basin']['output'],
-            'type': 2,  # area
-            'output': parameters['Basin']
-        }
-        outputs['Basin_vectorized'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['Basin_vectorized'] = polygonize.run_step({
+            'input': basin_raster,
+            'output': QgsProcessingUtils.generateTempFilename('basin.gpkg')
+        }, feedback)
         
         feedback.setCurrentStep(13)
         if feedback.isCanceled():
@@ -298,7 +169,7 @@ class grass_catchment(QgsProcessingAlgorithm):
         # fix basin geometry
         alg_params = {'INPUT': outputs['Basin_vectorized']['output'],
             'METHOD':1,
-            'OUTPUT':'TEMPORARY_OUTPUT'}
+            'OUTPUT': parameters['Basin']}
         outputs['fixed_basins'] = processing.run("native:fixgeometries", alg_params, context = context, feedback=feedback)
         results['Basin'] = outputs['fixed_basins']['OUTPUT']
         
@@ -343,7 +214,7 @@ class grass_catchment(QgsProcessingAlgorithm):
             'MASK': outputs['fixed_basins']['OUTPUT'],
             'MULTITHREADING': False,
             'NODATA': None,
-            'OPTIONS': None,
+            'OPTIONS': raster_output.processing_options('elevation'),
             'SET_RESOLUTION': False,
             'SOURCE_CRS': None,
             'TARGET_CRS': parameters['crs'],
@@ -352,6 +223,7 @@ class grass_catchment(QgsProcessingAlgorithm):
             'Y_RESOLUTION': None,
             'OUTPUT': 'TEMPORARY_OUTPUT'
         }
+        alg_params = plan.warp(alg_params)
         outputs['Clip_dem'] = processing.run('gdal:cliprasterbymasklayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
         
         feedback.setCurrentStep(17)
@@ -382,8 +254,10 @@ class grass_catchment(QgsProcessingAlgorithm):
             'threshold': QgsExpression(' @minimum_area /100').evaluate(),
             'stream_vector': parameters['Streams']
         }
+        alg_params = plan.grass(alg_params)
         outputs['Detailed_streams'] = processing.run('grass:r.stream.extract', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
         results['Streams'] = outputs['Detailed_streams']['stream_vector']
+        feedback.pushInfo('\n'.join(plan.report()))
 
         # This is the start of watershed characterization
         # all child algorithm output shall be stored in the outputs['scs'] variable
@@ -680,6 +554,115 @@ class grass_catchment(QgsProcessingAlgorithm):
             
         return results 
 
+    def _grass_delineation(self, parameters, outputs, plan, context, feedback):
+        # r.fill.dir, r.watershed, outfall snap and r.water.outlet.
+        # Returns the (subbasins, basin) rasters, or None if canceled.
+
+        # grass: fill sinks
+        alg_params = {
+            '-f': False,
+            'GRASS_RASTER_FORMAT_META': None,
+            'GRASS_RASTER_FORMAT_OPT': raster_output.grass_options(),  # float DEM + integer direction/areas: no predictor
+            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
+            'GRASS_REGION_PARAMETER': None,
+            'format': 0,  # grass
+            'input': outputs['Reproject_dem']['OUTPUT'],
+            'areas': 'TEMPORARY_OUTPUT',
+            'direction': 'TEMPORARY_OUTPUT',
+            'output': 'TEMPORARY_OUTPUT'
+        }
+        outputs['FillSinks'] = processing.run('grass:r.fill.dir', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(5)
+        if feedback.isCanceled():
+            return None
+
+        # grass: r.watershed for streams
+        alg_params = {
+            '-4': False,
+            '-a': False,
+            '-b': False,
+            '-m': False,
+            '-s': False,
+            'GRASS_RASTER_FORMAT_META': None,
+            'GRASS_RASTER_FORMAT_OPT': raster_output.grass_options(),  # mixed outputs: no predictor
+            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
+            'GRASS_REGION_PARAMETER': None,
+            'blocking': None,
+            'convergence': 5,
+            'depression': None,
+            'disturbed_land': None,
+            'elevation': outputs['FillSinks']['output'],
+            'flow': None,
+            'max_slope_length': None,
+            'memory': 300,
+            'threshold': parameters['minimum_area'],
+            'accumulation': 'TEMPORARY_OUTPUT',
+            'basin': 'TEMPORARY_OUTPUT',
+            'drainage': 'TEMPORARY_OUTPUT',
+            'stream': 'TEMPORARY_OUTPUT'
+        }
+        alg_params = plan.grass(alg_params)  # memory and -m from the DEM size
+        outputs['Streams'] = processing.run('grass:r.watershed', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(6)
+        if feedback.isCanceled():
+            return None
+
+        # snap the reprojected outfall onto the nearest stream cell
+        # with a KD-tree over the r.watershed stream raster (pour_point_snap.py)
+        outfall = QgsProcessingUtils.mapLayerFromString(outputs['reprojected_outfall']['OUTPUT'], context)
+        points = [fet.geometry().asPoint() for fet in outfall.getFeatures()]
+        snap_by_accumulation = self.parameterAsBool(parameters, 'snap_by_accumulation', context)
+        snapped = snap_outfalls(
+            outputs['Streams']['stream'], [p.x() for p in points], [p.y() for p in points], 200,
+            accumulation_path=outputs['Streams']['accumulation'] if snap_by_accumulation else None
+        )
+        feedback.pushInfo(summary(snapped))
+        if snapped['status'][0] != SNAPPED:
+            feedback.reportError(f"Outfall snap: {snapped['status'][0]} ({snapped['distance'][0]:.2f} m)")
+
+        feedback.setCurrentStep(10)
+        if feedback.isCanceled():
+            return None
+
+        # get the x,y coordinates of the snapped outfall
+        # this is in preparation for delineating watershed
+        # using the grass: r.water.outlet command
+        pt = QgsPointXY(snapped['x'][0], snapped['y'][0])
+
+        feedback.setCurrentStep(11)
+        if feedback.isCanceled():
+            return None
+
+        # grass: r.water.outlet
+        # delineate the watershed
+        alg_params = {
+            'GRASS_RASTER_FORMAT_META': None,
+            'GRASS_RASTER_FORMAT_OPT': raster_output.grass_options('labels'),
+            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
+            'GRASS_REGION_PARAMETER': None,
+            'coordinates': f'{pt.x()}, {pt.y()}',
+            'input': outputs['Streams']['drainage'],
+            'output': 'TEMPORARY_OUTPUT'
+        }
+        outputs['Basin'] = processing.run('grass:r.water.outlet', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        return outputs['Streams']['basin'], outputs['Basin']['output']
+
+    def _backend_delineation(self, backend_name, parameters, outputs, context, feedback):
+        # the same rasters from a delineation_backends backend (see SCHEMA there),
+        # in a work folder of this run. Returns (subbasins, basin).
+        outfall = QgsProcessingUtils.mapLayerFromString(outputs['reprojected_outfall']['OUTPUT'], context)
+        pt = next(outfall.getFeatures()).geometry().asPoint()
+        work_folder = tempfile.mkdtemp(prefix='delineation_', dir=QgsProcessingUtils.tempFolder())
+        backend = get_backend(backend_name, work_folder, context, feedback)
+        delineated = backend.delineate(
+            outputs['Reproject_dem']['OUTPUT'], pt.x(), pt.y(),
+            self.parameterAsDouble(parameters, 'minimum_area', context), snap_dist=200
+        )
+        feedback.pushInfo(f"Outfall snapped to {delineated['outlet'][0]:.2f}, {delineated['outlet'][1]:.2f} ({backend_name})")
+        return delineated['subbasins'], delineated['basin']
+
     def name(self):
         return 'grass_catchment'
 
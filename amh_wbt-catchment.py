@@ -8,6 +8,12 @@ from qgis.core import QgsProcessingParameterVectorLayer
 from qgis.core import QgsProcessingParameterVectorDestination
 from qgis.core import QgsProcessingParameterFolderDestination
 from qgis.core import QgsProcessingParameterFile
+from qgis.core import QgsProcessingParameterBoolean
+from qgis.core import QgsProcessingParameterString
+from qgis.core import QgsProcessingParameterEnum
+from qgis.core import QgsProcessingContext
+from qgis.core import QgsProcessingFeedback
+from qgis.core import QgsProcessingException
 from qgis.core import QgsProcessingParameterFeatureSink
 from qgis.core import QgsExpression
 from qgis.core import QgsProcessingUtils
@@ -17,8 +23,28 @@ from qgis.core import QgsWkbTypes
 from qgis.core import QgsFeature
 import processing
 import os
+import sys
 import glob
+import tempfile
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# helper modules live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from raster_storage import StoragePolicy, raster_nbytes
+from step_cache import StepCache
+import hydro_numpy
+import tiled_accumulation
+from pipeline_dag import PipelineDAG
+from resource_tuning import ResourcePlan, wbt_max_procs
+import raster_output
+import polygonize
+import stream_topology
+import network_routing
+import stream_burning
+from pour_point_snap import snap_outfalls, summary, SNAPPED
+from delineation_backends import get_backend
 
 
 class wbt_catchment(QgsProcessingAlgorithm):
@@ -131,6 +157,152 @@ class wbt_catchment(QgsProcessingAlgorithm):
             }
         return pd.DataFrame(data_runoff_c)
 
+    def _layer_source(self, value, context):
+        # Swap a project layer id for the file behind it
+        if isinstance(value, str) and not os.path.exists(value):
+            layer = QgsProcessingUtils.mapLayerFromString(value, context)
+            if layer is not None:
+                return layer.source()
+        return value
+
+    def _step(self, cache, name, alg_id, alg_params, context, feedback, child=True):
+        # Run a child algorithm through the step cache.
+        # The cache is keyed on layer sources so it can hash their content.
+        key_params = {k: self._layer_source(v, context) for k, v in alg_params.items()}
+        backend = getattr(self, 'backend', 0)
+        if backend == 1 and alg_id in hydro_numpy.NUMPY_STEPS:
+            # same parameters and outputs, computed in-process by hydro_numpy
+            return cache.run(name, 'numpy:' + alg_id, key_params,
+                             lambda: self._finalize(hydro_numpy.run_step(alg_id, key_params), rewrite=False))
+        if backend == 2 and alg_id in tiled_accumulation.TILED_STEPS:
+            # tile by tile within the memory budget; the fill still runs in WBT
+            return cache.run(name, 'tiled:' + alg_id, key_params,
+                             lambda: self._finalize(tiled_accumulation.run_step(alg_id, key_params, self.memory_mb, feedback), rewrite=False))
+        return cache.run(
+            name, alg_id, key_params,
+            lambda: self._finalize(processing.run(alg_id, alg_params, context=context, feedback=feedback, is_child_algorithm=child))
+        )
+
+    def _polygonize(self, cache, name, alg_params, feedback):
+        # In place of wbt:RasterToVectorPolygons: one dissolved polygon per
+        # label, written to a spatially indexed GeoPackage (see polygonize.py)
+        return cache.run(name, 'polygonize', alg_params, lambda: polygonize.run_step(alg_params, feedback))
+
+    def _finalize(self, outputs, rewrite=True):
+        # Rasters kept in the Save Folder follow raster_output: WBT writes
+        # plain GeoTIFFs, so they are rewritten tiled and compressed in the
+        # smallest dtype of their kind; the NumPy steps already write them
+        # that way and only get overviews. Done inside the cached step so the
+        # cache records the final file.
+        folder = getattr(self, 'save_folder', None)
+        if not folder:
+            return outputs
+        for value in outputs.values():
+            if not (isinstance(value, str) and value.lower().endswith('.tif')):
+                continue
+            if os.path.normpath(os.path.dirname(value)) != os.path.normpath(folder):
+                continue
+            kind = raster_output.kind_for_name(value)
+            if kind is None:
+                continue
+            if rewrite:
+                raster_output.finalize(value, kind, overviews=self.build_overviews)
+            elif self.build_overviews:
+                raster_output.build_overviews(value, kind)
+        return outputs
+
+    def _tagged(self, name, tag):
+        # wbt_streams-raster.tif -> wbt_streams-raster_t50000.tif
+        if not tag:
+            return name
+        stem, ext = os.path.splitext(name)
+        return f"{stem}_{tag}{ext}"
+
+    def _threshold_tag(self, threshold):
+        return 't' + f"{threshold:g}".replace('.', 'p').replace('+', '')
+
+    def _parse_thresholds(self, parameters, context):
+        # "20000, 50000,100000" -> [20000.0, 50000.0, 100000.0]
+        text = self.parameterAsString(parameters, 'thresholds', context) or ''
+        try:
+            values = [float(v) for v in text.replace(';', ',').split(',') if v.strip()]
+        except ValueError:
+            raise QgsProcessingException(f"Threshold sweep must be a comma-separated list of numbers, got {text!r}")
+        return sorted(set(values))
+
+    def _run_sweep(self, thresholds, outputs, storage, cache, dem_nbytes, reg_df, context, feedback):
+        # Runs _run_threshold for every threshold in parallel.
+        # Each worker gets its own processing context and feedback; the worker
+        # feedbacks are canceled when the main feedback is, and their mean
+        # progress moves the main feedback through steps 7-31.
+        # Returns the comparison table and the basin summary of each threshold.
+        # The shared inputs must be files: a temporary layer belongs to the
+        # context that made it and can't be resolved from a worker context.
+        not_files = [name for name, result in outputs.items()
+                     for key in ('output', 'OUTPUT')
+                     if isinstance(result, dict) and isinstance(result.get(key), str) and not os.path.isfile(result[key])]
+        if not_files:
+            raise QgsProcessingException(f"Threshold sweep needs file-backed inputs, not: {', '.join(sorted(not_files))}")
+        worker_feedbacks = {}  # threshold: feedback
+
+        def run_one(threshold):
+            worker_context = QgsProcessingContext()
+            worker_context.copyThreadSafeSettings(context)
+            worker_feedback = QgsProcessingFeedback()
+            worker_feedbacks[threshold] = worker_feedback
+            return self._run_threshold(
+                threshold, self._threshold_tag(threshold), outputs, storage, cache, dem_nbytes, reg_df,
+                worker_context, QgsProcessingMultiStepFeedback(31, worker_feedback)
+            )
+
+        position = 7  # main feedback steps, 7 (conditioning done) to 31
+
+        def report_progress(finished):
+            # finished thresholds count in full, running ones by their own progress
+            nonlocal position
+            running = sum(fb.progress() for t, fb in list(worker_feedbacks.items()) if t not in finished)
+            done = (100 * len(finished) + running) / (100 * len(thresholds))
+            position = max(position, 7 + 24 * done)  # never backwards
+            step = min(int(position), 30)
+            feedback.setCurrentStep(step)
+            feedback.setProgress(100 * (position - step))
+
+        summaries = {}
+        finished = set()
+        max_workers = min(len(thresholds), max(1, (os.cpu_count() or 2) // 2))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(run_one, t): t for t in thresholds}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.5)
+                if feedback.isCanceled():
+                    for worker_feedback in list(worker_feedbacks.values()):
+                        worker_feedback.cancel()
+                for future in done:
+                    run = future.result()
+                    finished.add(futures[future])
+                    if run is not None:
+                        summaries[futures[future]] = run[0]
+                        feedback.pushInfo(f"Threshold {futures[future]:g}: {run[0]['subbasin'].nunique()} subbasins "
+                                          f"({len(finished)} of {len(thresholds)} thresholds done)")
+                report_progress(finished)
+
+        # every threshold must have finished unless the run was canceled
+        missing = [t for t in thresholds if t not in summaries]
+        if missing and not feedback.isCanceled():
+            raise QgsProcessingException(f"Threshold sweep did not complete for: {', '.join(f'{t:g}' for t in missing)}")
+
+        # One row per threshold and return period
+        sweep = []
+        for threshold in thresholds:
+            if threshold not in summaries:
+                continue
+            for rp, rp_df in summaries[threshold].groupby('rp'):
+                sweep.append([threshold, rp, rp_df['subbasin'].nunique(), rp_df['area_has'].sum(),
+                              rp_df['discharge'].max(), rp_df['discharge'].sum()])
+        sweep_header = ['threshold', 'rp', 'subbasins', 'area_has', 'max_discharge', 'total_discharge']
+        return pd.DataFrame(sweep, columns=sweep_header), summaries
+
     def initAlgorithm(self, config=None):
         # Inputs
         self.addParameter(QgsProcessingParameterCrs('crs', 'CRS', defaultValue='EPSG:4326'))
@@ -141,6 +313,17 @@ class wbt_catchment(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterVectorLayer('soil_type', 'Soil Type', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None))
         self.addParameter(QgsProcessingParameterFolderDestination('temp_folder', 'Save Folder')) # Destination Temp Folder for WBT ouptuts
         self.addParameter(QgsProcessingParameterFile('reg_csv', 'Regression CSV'))
+        self.addParameter(QgsProcessingParameterBoolean('keep_intermediates', 'Keep intermediate files in Save Folder', defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean('use_cache', 'Reuse unchanged steps from the previous run', defaultValue=True))
+        self.addParameter(QgsProcessingParameterEnum('backend', 'Conditioning backend', options=['WhiteboxTools', 'NumPy (in-process)', 'Tiled NumPy (out of core)', 'GRASS r.watershed'], defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber('memory_mb', 'Memory budget (MB)', type=QgsProcessingParameterNumber.Integer, minValue=64, defaultValue=1024))
+        self.addParameter(QgsProcessingParameterBoolean('snap_by_accumulation', 'Snap outfalls to the highest flow accumulation', defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean('per_outfall', 'Delineate one watershed per outfall', defaultValue=False))
+        self.addParameter(QgsProcessingParameterVectorLayer('burn_lines', 'Channels and culverts to burn into the DEM', types=[QgsProcessing.TypeVectorLine], optional=True, defaultValue=None))
+        self.addParameter(QgsProcessingParameterNumber('burn_depth', 'Burn depth (m)', type=QgsProcessingParameterNumber.Double, minValue=0, defaultValue=2.0))
+        self.addParameter(QgsProcessingParameterEnum('burn_mode', 'Burn mode', options=['Burn (follow the DEM down)', 'Breach (straight grade)'], defaultValue=0))
+        self.addParameter(QgsProcessingParameterBoolean('build_overviews', 'Build overviews for the rasters in Save Folder', defaultValue=False))
+        self.addParameter(QgsProcessingParameterString('thresholds', 'Threshold sweep (comma-separated Minimum Area values)', optional=True, defaultValue=''))
         
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
@@ -148,217 +331,585 @@ class wbt_catchment(QgsProcessingAlgorithm):
         feedback = QgsProcessingMultiStepFeedback(31, model_feedback)
         results = {}
         outputs = {}
-        basin_summary = []
         wbt_file = parameters['temp_folder']
 
-        feedback.setCurrentStep(1)
-        if feedback.isCanceled():
-            return {}
-            
+        # Only the products below are written to the Save Folder.
+        # The other WBT intermediates stay in RAM (or a local scratch folder)
+        # unless the user asks to keep them.
+        # In a threshold sweep each threshold gets its own tagged copy of the products.
+        thresholds = self._parse_thresholds(parameters, context)
+        tags = [self._threshold_tag(t) for t in thresholds] or ['']
+        per_outfall = self.parameterAsBool(parameters, 'per_outfall', context)
+        self.snap_by_accumulation = self.parameterAsBool(parameters, 'snap_by_accumulation', context)
+        self.backend = self.parameterAsEnum(parameters, 'backend', context)
+        self.memory_mb = self.parameterAsInt(parameters, 'memory_mb', context)
+        self.save_folder = wbt_file
+        self.build_overviews = self.parameterAsBool(parameters, 'build_overviews', context)
+        if per_outfall and thresholds:
+            raise QgsProcessingException('Delineate one watershed per outfall cannot be combined with a threshold sweep')
+        use_cache = self.parameterAsBool(parameters, 'use_cache', context)
+        storage = StoragePolicy(
+            wbt_file,
+            keep=['wbt_filledWandandLiu.tif', 'outfall_watersheds.tif', 'outfall_basins.gpkg'] + [
+                self._tagged(name, tag)
+                for tag in tags
+                for name in ['wbt_watershed.tif', 'wbt_stream-vector.shp', 'wbt_vector_basin.shp', 'wbt_vector_subbasins.gpkg']
+            ],
+            keep_all=self.parameterAsBool(parameters, 'keep_intermediates', context)
+        )
+        # The RAM and scratch intermediates are dropped however the run ends
+        # (done, canceled or failed); with the cache on, intermediates on
+        # scratch disk are kept for the next run.
+        try:
+            dem_layer = self.parameterAsRasterLayer(parameters, 'dem', context)
+            dem_nbytes = raster_nbytes(dem_layer)
+
+            # thread counts and memory for the child algorithms, sized to the DEM;
+            # up to two WBT steps run side by side in the conditioning graph
+            plan = ResourcePlan(dem_layer.width(), dem_layer.height(), budget_mb=self.memory_mb, concurrent=2)
+            if self.backend != 0:
+                plan.apply_gdal()
+
+            # Steps whose inputs and parameters are unchanged since the last run
+            # on this Save Folder are skipped (see step_cache.py)
+            cache = StepCache(wbt_file, enabled=use_cache)
+
+            # max_procs covers every WBT step of the run, the graph and the
+            # per-threshold steps alike (see resource_tuning.wbt_max_procs)
+            with wbt_max_procs(plan.wbt_max_procs()) as applied:
+                if not applied:
+                    feedback.pushInfo('WBT max_procs left as it is (whitebox_tools settings.json not writable, or in use by another run)')
+
+                # Steps 1-7 and 17-18 as a dependency graph (see pipeline_dag.py):
+                # the vector reprojections and geometry fixes run next to the DEM chain,
+                # and the D8 pointer and flow accumulation run side by side.
+                dag = self._conditioning_dag(parameters, plan, storage, cache, dem_nbytes, context, feedback)
+                worker_feedbacks = dag.worker_feedbacks
+                ran = dag.run(
+                    feedback,
+                    on_cancel=lambda: [worker_feedback.cancel() for worker_feedback in worker_feedbacks],
+                    on_done=lambda name, result: feedback.setCurrentStep(min(len(dag.timings), 7))
+                )
+                if ran is None:
+                    return {}
+                outputs.update(ran)
+                feedback.pushInfo('\n'.join(dag.report()))
+                feedback.pushInfo('\n'.join(plan.report()))
+
+                # Create a Pandas DataFrame for the user input regression coefficient csv
+                reg_df = pd.read_csv(parameters['reg_csv'])
+
+                if thresholds:
+                    # Threshold sweep: the filled DEM, pointer and accumulation above are reused for every threshold
+                    sweep_df, summaries = self._run_sweep(thresholds, outputs, storage, cache, dem_nbytes, reg_df, context, feedback)
+                    if feedback.isCanceled():
+                        return {}
+                    for threshold, basin_df in summaries.items():
+                        basin_df.to_csv(os.path.join(wbt_file, f"basin_summary_{self._threshold_tag(threshold)}.csv"))
+                    sweep_df.to_csv(os.path.join(wbt_file, 'threshold_sweep.csv'), index=False)
+                    results['Streams'] = os.path.join(wbt_file, self._tagged('wbt_stream-vector.shp', tags[0]))
+                elif per_outfall:
+                    run = self._run_outfalls(parameters['minimum_area'], outputs, storage, cache, dem_nbytes, reg_df, context, feedback)
+                    if run is None:
+                        return {}
+                    outfall_df, outputs = run
+                    results['Streams'] = outputs['wbt_exStreams']['output']
+
+                    feedback.setCurrentStep(31)
+                    if feedback.isCanceled():
+                        return {}
+
+                    outfall_df.to_csv(os.path.join(wbt_file, 'outfall_summary.csv')) # one basin summary per outfall
+                else:
+                    run = self._run_threshold(parameters['minimum_area'], '', outputs, storage, cache, dem_nbytes, reg_df, context, feedback)
+                    if run is None:
+                        return {}
+                    basin_df, outputs = run
+                    results['Streams'] = outputs['wbt_exStreams']['output']
+
+                    feedback.setCurrentStep(31)
+                    if feedback.isCanceled():
+                        return {}
+
+                    basin_df.to_csv(os.path.join(wbt_file, 'basin_summary.csv')) # save the DataFrame as CSV
+
+                # Report where each file was written; the intermediates are dropped below
+                for name, tier, path in storage.log:
+                    feedback.pushInfo(f"{name}: {tier} ({path})")
+
+                if use_cache:
+                    feedback.pushInfo('\n'.join(cache.report()))
+
+                return results
+        finally:
+            storage.cleanup(keep_scratch=use_cache)
+
+    def _conditioning_dag(self, parameters, plan, storage, cache, dem_nbytes, context, feedback):
+        # The steps that don't depend on the Minimum Area, declared with their dependencies.
+        # Node names are the keys the results are stored under in `outputs`.
+        # Each node gets its own processing context and feedback so nodes can run
+        # in parallel; the node feedbacks are kept on dag.worker_feedbacks for cancelling.
+        dag = PipelineDAG()
+        dag.worker_feedbacks = []
+
+        def node(name, alg_id, make_params, child=True):
+            def run(inputs):
+                worker_context = QgsProcessingContext()
+                worker_context.copyThreadSafeSettings(context)
+                worker_feedback = QgsProcessingFeedback()
+                dag.worker_feedbacks.append(worker_feedback)
+                alg_params = make_params(inputs)
+                return self._step(cache, name, alg_id, alg_params, worker_context, worker_feedback, child)
+            return run
+
         # reproject_dem
-        alg_params = {
-            'DATA_TYPE': 0,  
+        reprojected_dem = storage.path('reprojected_dem.tif', dem_nbytes)
+        dag.add('Reproject_dem', node('reproject_dem', 'gdal:warpreproject', lambda inputs: plan.warp({
+            'DATA_TYPE': 0,
             'EXTRA': None,
             'INPUT': parameters['dem'],
             'MULTITHREADING': False,
             'NODATA': None,
-            'OPTIONS': None,
-            'RESAMPLING': 0, 
+            'OPTIONS': storage.gdal_options(reprojected_dem),
+            'RESAMPLING': 0,
             'SOURCE_CRS': None,
             'TARGET_CRS': parameters['crs'],
             'TARGET_EXTENT': None,
             'TARGET_EXTENT_CRS': None,
             'TARGET_RESOLUTION': None,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+            'OUTPUT': reprojected_dem
+        })))
+
+        # Reproject Land Cover, Soil and Outfall Layers
+        for key, step, layer in [('reprojected_lc', 'reproject_lc', 'land_cover'),
+                                 ('reprojected_soil', 'reproject_soil', 'soil_type'),
+                                 ('reprojected_outfall', 'reproject_outfall', 'outfall')]:
+            dag.add(key, node(step, 'native:reprojectlayer', lambda inputs, layer=layer, key=key: {
+                'INPUT': parameters[layer],
+                'TARGET_CRS': parameters['crs'],
+                'CONVERT_CURVED_GEOMETRIES': False,
+                'OUTPUT': storage.path(f'{key}.gpkg')
+            }))
+
+        # Optional stream burning: known channels and culverts are cut into the
+        # reprojected DEM before the fill (see stream_burning.py)
+        dem_node = 'Reproject_dem'
+        if parameters.get('burn_lines'):
+            dag.add('reprojected_burn', node('reproject_burn', 'native:reprojectlayer', lambda inputs: {
+                'INPUT': parameters['burn_lines'],
+                'TARGET_CRS': parameters['crs'],
+                'CONVERT_CURVED_GEOMETRIES': False,
+                'OUTPUT': storage.path('reprojected_burn.gpkg')
+            }))
+
+            def burn(inputs):
+                burn_params = {
+                    'dem': inputs['Reproject_dem']['OUTPUT'],
+                    'lines': self._layer_source(inputs['reprojected_burn']['OUTPUT'], context),
+                    'depth': self.parameterAsDouble(parameters, 'burn_depth', context),
+                    'mode': stream_burning.MODES[self.parameterAsEnum(parameters, 'burn_mode', context)],
+                    'depth_field': 'depth',
+                    'output': storage.path('burned_dem.tif', dem_nbytes)
+                }
+                burned = cache.run('burn_streams', 'stream_burning', burn_params, lambda: stream_burning.run_step(burn_params))
+                return {'OUTPUT': burned['output']}  # stands in for Reproject_dem
+            dag.add('burnedDem', burn, deps=['Reproject_dem', 'reprojected_burn'])
+            dem_node = 'burnedDem'
+
+        # Delineate watershed using WhiteBoxTools
+        # delineating using WhiteBoxTools to solve for the
+        # longest flow path which will be used
+        # later in the watershed characterization
+        # and rational method computation
+        # The watershed and subbasin results shall also be used in the analysis
+        # WBT steps are multi-threaded themselves, so they take two worker slots
+
+        conditioned = {
+            'filled_dem': storage.path('wbt_filledWandandLiu.tif', dem_nbytes),
+            'pointer': storage.path('wbt_d8pointer.tif', dem_nbytes),
+            'accumulation': storage.path('wbt_flowaccum.tif', dem_nbytes),
         }
-        outputs['Reproject_dem'] = processing.run('gdal:warpreproject', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        if self.backend == 3:
+            # GRASS r.fill.dir / r.watershed through delineation_backends, written
+            # in the WBT pointer encoding to the files of the three WBT steps
+            def grass_conditioning(inputs):
+                worker_context = QgsProcessingContext()
+                worker_context.copyThreadSafeSettings(context)
+                worker_feedback = QgsProcessingFeedback()
+                dag.worker_feedbacks.append(worker_feedback)
+                memory_mb, swap = plan.grass_memory()
+                dem = self._layer_source(inputs[dem_node]['OUTPUT'], context)
+                backend = get_backend('grass', tempfile.mkdtemp(prefix='delineation_', dir=QgsProcessingUtils.tempFolder()),
+                                      worker_context, worker_feedback, memory_mb=memory_mb, swap=swap)
+                return cache.run('grass_conditioning', 'grass:conditioning', dict(conditioned, dem=dem, memory_mb=memory_mb),
+                                 lambda: self._finalize(backend.condition(dem, conditioned), rewrite=False),
+                                 output_names=tuple(conditioned))
+            dag.add('grassConditioning', grass_conditioning, deps=[dem_node], slots=2)
+            for key, product in [('filledWangLiu', 'filled_dem'), ('d8Pointer', 'pointer'), ('d8FlowAccum', 'accumulation')]:
+                dag.add(key, lambda inputs, product=product: {'output': inputs['grassConditioning'][product]},
+                        deps=['grassConditioning'])
+        else:
+            # WBT Filled Dem
+            dag.add('filledWangLiu', node('fill_depressions', 'wbt:FillDepressionsWangAndLiu', lambda inputs: {
+                'dem': inputs[dem_node]['OUTPUT'],
+                'fix_flats': True,
+                'flat_increment': None,
+                'output': conditioned['filled_dem']
+            }), deps=[dem_node], slots=2)
+
+            # WBT D8 Pointer
+            dag.add('d8Pointer', node('d8_pointer', 'wbt:D8Pointer', lambda inputs: {
+                'dem': inputs['filledWangLiu']['output'],
+                'esri_pntr': False,
+                'output': conditioned['pointer']
+            }), deps=['filledWangLiu'], slots=2)
+
+            # WBT D8 Flow Accumulation
+            # the in-process backends accumulate the d8Pointer output instead of
+            # deriving the pointer from the DEM a second time
+            from_pointer = self.backend in (1, 2)
+            accum_source = 'd8Pointer' if from_pointer else 'filledWangLiu'
+            dag.add('d8FlowAccum', node('d8_flow_accum', 'wbt:D8FlowAccumulation', lambda inputs: {
+                'input': inputs[accum_source]['output'],
+                'out_type': 0,
+                'log': False,
+                'clip': False,
+                'pntr': from_pointer,
+                'esri_pntr': False,
+                'output': conditioned['accumulation']
+            }), deps=[accum_source], slots=2)
+
+        # fix land and soil
+        # written to files: a temporary layer would live in the node's own
+        # context and couldn't be found by the characterization later
+        for key, source in [('fixed_lc', 'reprojected_lc'), ('fixed_soil', 'reprojected_soil')]:
+            dag.add(key, node(key, 'native:fixgeometries', lambda inputs, source=source, key=key: {
+                'INPUT': inputs[source]['OUTPUT'],
+                'METHOD': 0,
+                'OUTPUT': storage.path(f'{key}.gpkg')
+            }), deps=[source])
+
+        return dag
+
+    def _run_threshold(self, threshold, tag, outputs, storage, cache, dem_nbytes, reg_df, context, feedback):
+        # Runs everything that depends on the Minimum Area: stream extraction,
+        # watershed and subbasin delineation, characterization and the rational method.
+        # `outputs` must hold the reprojected inputs, the fixed land cover / soil,
+        # and the filled DEM, D8 pointer and flow accumulation.
+        # Returns (basin_df, outputs), or None if the run was canceled.
+        outputs = dict(outputs)
+        basin_summary = []
 
-        # Reproject Land Cover Layer
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
+        if not self._delineate_streams(threshold, tag, outputs, storage, cache, dem_nbytes, context, feedback):
+            return None
 
+        # WBT Delineate Watershed
+        feedback.setCurrentStep(11)
+        if feedback.isCanceled():
+            return None
+        
         alg_params = {
-            'INPUT':parameters['land_cover'],
-            'TARGET_CRS':parameters['crs'],
-            'CONVERT_CURVED_GEOMETRIES':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
+            'd8_pntr':outputs['d8Pointer']['output'],
+            'pour_pts': outputs['jenson_snapped']['output'],
+            'esri_pntr':False,
+            'output':storage.path(self._tagged('wbt_watershed.tif', tag), dem_nbytes)
         }
-        outputs['reprojected_lc'] = processing.run('native:reprojectlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['wbt_watershed'] = self._step(cache, self._tagged('watershed', tag), "wbt:Watershed", alg_params, context, feedback, child=False)
 
-        # Reproject Soil Layer
-        feedback.setCurrentStep(3)
+        # Convert raster watershed to vector polygon
+        feedback.setCurrentStep(12)
         if feedback.isCanceled():
-            return {}
+            return None
+        alg_params = {
+            'input':outputs['wbt_watershed']['output'],
+            'output':storage.path(self._tagged('wbt_vector_basin.shp', tag))  # shapefile: read by wbt:ClipRasterToPolygon
+        }
+        outputs['wbt_vector_basin'] = self._polygonize(cache, self._tagged('basin_to_vector', tag), alg_params, feedback)
+                
+        # Delineate the subbasins
+        feedback.setCurrentStep(13)
+        if feedback.isCanceled():
+            return None
 
         alg_params = {
-            'INPUT':parameters['soil_type'],
-            'TARGET_CRS':parameters['crs'],
-            'CONVERT_CURVED_GEOMETRIES':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
+            'd8_pntr':outputs['d8Pointer']['output'],
+            'streams':outputs['wbt_streams']['output'],
+            'esri_pntr':False,
+            'output':storage.path(self._tagged('subbasins.tif', tag), dem_nbytes)
         }
-        outputs['reprojected_soil'] = processing.run('native:reprojectlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['wbt_subbasins'] = self._step(cache, self._tagged('subbasins', tag), "wbt:Subbasins", alg_params, context, feedback, child=False)
 
-        # Reproject Outfall Layer
-        feedback.setCurrentStep(4)
+        # Clipped the raster subbasins to the vectorized WBT watershed
+        feedback.setCurrentStep(14)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
-            'INPUT':parameters['outfall'],
-            'TARGET_CRS':parameters['crs'],
-            'CONVERT_CURVED_GEOMETRIES':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
+            'input': outputs['wbt_subbasins']['output'],
+            'polygons':outputs['wbt_vector_basin']['output'],
+            'maintain_dimensions':True,
+            'output':storage.path(self._tagged('wbt_clipped_subbasins.tif', tag), dem_nbytes)
         }
-        outputs['reprojected_outfall'] = processing.run('native:reprojectlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-                
-        # Delineate watershed using WhiteBoxTools
-        # delineating using WhiteBoxTools to solve for the 
-        # longest flow path which will be used  
-        # later in the watershed characterization
-        # and rational method computation
-        # The watershed and subbasin results shall also be used in the analysis
+        outputs['wbt_clipped_subbasins'] = self._step(cache, self._tagged('clip_subbasins', tag), "wbt:ClipRasterToPolygon", alg_params, context, feedback, child=False)
 
-        # WBT Filled Dem
-        feedback.setCurrentStep(5)
+        # How the subbasins connect downstream, with stream order and cumulative
+        # area, saved once for the later stages (see stream_topology.py)
+        topology_params = {
+            'pointer': outputs['d8Pointer']['output'],
+            'streams': outputs['wbt_streams']['output'],
+            'subbasins': outputs['wbt_clipped_subbasins']['output'],
+            'output': os.path.join(storage.save_folder, self._tagged('stream_topology.csv', tag))
+        }
+        outputs['stream_topology'] = cache.run(self._tagged('stream_topology', tag), 'stream_topology', topology_params,
+                                               lambda: stream_topology.run_step(topology_params))
+
+        # Convert clipped raster subbasins to vector polygon
+        feedback.setCurrentStep(15)
         if feedback.isCanceled():
-            return {}
-        
+            return None
         alg_params = {
-            'dem': outputs['Reproject_dem']['OUTPUT'],
-            'fix_flats':True,
-            'flat_increment':None,
-            'output':os.path.join(wbt_file, 'wbt_filledWandandLiu.tif')
+            'input':outputs['wbt_clipped_subbasins']['output'],
+            'output':storage.path(self._tagged('wbt_vector_subbasins.gpkg', tag))
         }
-        outputs['filledWangLiu'] = processing.run("wbt:FillDepressionsWangAndLiu", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['wbt_vector_subbasins'] = self._polygonize(cache, self._tagged('subbasins_to_vector', tag), alg_params, feedback)
+               
+        # keyed by the subbasin label (VALUE), which is also its link id in stream_topology.csv
+        scs_df = self._characterize(outputs['wbt_vector_subbasins']['output'], 'VALUE', outputs, reg_df, context, feedback)
+        if scs_df is None:
+            return None
 
-        # WBT D8 Pointer
-        feedback.setCurrentStep(6)
+        feedback.setCurrentStep(29)
         if feedback.isCanceled():
-            return {}
+            return None
         
-        alg_params = {
-            'dem':outputs['filledWangLiu']['output'],
-            'esri_pntr':False,
-            'output': os.path.join(wbt_file, 'wbt_d8pointer.tif')
-        }
-        outputs['d8Pointer'] = processing.run("wbt:D8Pointer", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # Create geometry for WhiteBoxTools
+        wbt_subbasin = QgsVectorLayer(outputs['wbt_vector_subbasins']['output'], "wbt_subbasin", 'ogr')
+        wbt_dem = QgsRasterLayer(outputs['wbt_watershed']['output'], 'wbt_dem')
+        wbt_filled_dem = QgsRasterLayer(outputs['filledWangLiu']['output'], 'wbt_filled_dem')
+        
+        # Get geometry type of wbt_subbasin and display as a string
+        geometry_type_str = QgsWkbTypes.displayString(wbt_subbasin.wkbType())
+        
+        feedback.setCurrentStep(30)
+        if feedback.isCanceled():
+            return None
+        
+        # scratch files reused by every subbasin in the loop below
+        temp_raster = storage.path(self._tagged('tempRaster.tif', tag), dem_nbytes)
+        temp_vector = storage.path(self._tagged('tempVector.shp', tag))
 
-        # WBT D8 Flow Accumulation
-        feedback.setCurrentStep(7)
+        # create a vector geometry for each feature in wbt_subbasin layer
+        for fet in wbt_subbasin.getFeatures(): 
+            # create a temporary vector layer
+            vl = QgsVectorLayer(f"{geometry_type_str}?crs={wbt_subbasin.crs().authid()}", 'temp', 'memory') 
+            pr = vl.dataProvider()
+            pr.addAttributes(wbt_subbasin.fields())
+            vl.updateFields()
+            f = QgsFeature()
+            f.setGeometry(fet.geometry())
+            f.setAttributes(fet.attributes())
+            pr.addFeature(f)
+            vl.updateExtents()
+            
+            # Clip watershed raster to a feature in the subbasins
+            alg_params = {
+                'input':wbt_dem,
+                'polygons':vl,
+                'maintain_dimensions':True,
+                'output': temp_raster
+                }
+            wbt_clip = processing.run("wbt:ClipRasterToPolygon", alg_params, context=context, feedback=feedback)
+
+            # get the subbasin number of the current feature
+            subbasinNumber = fet['VALUE']
+
+            # get the longest flow path and the ave slope of the subbasin
+            longestFlowPath, aveSlope = self._longest_flowpath(wbt_filled_dem, wbt_clip['output'], temp_vector, context, feedback)
+
+            # Get the intersected vector layer
+            filtered_df = scs_df[scs_df['subbasin-key'] == subbasinNumber]
+            basin_summary += self._rational(subbasinNumber, filtered_df, longestFlowPath, aveSlope, reg_df, feedback)
+
+        # Initialize the column header names for the basin summary
+        basin_header = ['subbasin', 'area_has', 'cn', 'n-value', 'retardance-c', 'flowpath', 'slope', 'rp', 'runoff-c', 'tc', 'method', 'intensity','discharge'] # Column names for the Basin summary
+
+        basin_df = pd.DataFrame(basin_summary, columns=basin_header, index=None) # save the list as a DataFrame
+
+        # Peaks at every junction down to the outfall, routed through the subbasin graph
+        topology = stream_topology.StreamTopology.read(outputs['stream_topology']['output'])
+        junction_df = network_routing.route(topology, basin_df, reg_df)
+        junction_df.to_csv(os.path.join(storage.save_folder, self._tagged('junction_summary.csv', tag)), index=False)
+        return basin_df, outputs
+
+    def _run_outfalls(self, threshold, outputs, storage, cache, dem_nbytes, reg_df, context, feedback):
+        # Multi-outfall mode: one watershed per outfall instead of one combined watershed.
+        # All outfalls are snapped in one go, every cell is labeled with its outfall in a
+        # single pass over the D8 pointer, and the labeled areas share one overlay.
+        # A nested outfall's area is added to every outfall downstream of it.
+        # Returns (outfall_df, outputs), or None if the run was canceled.
+        outputs = dict(outputs)
+        if not self._delineate_streams(threshold, '', outputs, storage, cache, dem_nbytes, context, feedback):
+            return None
+
+        # Label each cell with the outfall it drains to
+        feedback.setCurrentStep(11)
+        if feedback.isCanceled():
+            return None
+
+        pointer, geotransform, projection, _ = hydro_numpy.read_raster(outputs['d8Pointer']['output'])
+        snapped = QgsVectorLayer(outputs['jenson_snapped']['output'], 'snapped', 'ogr')
+        points = [fet.geometry().asPoint() for fet in snapped.getFeatures()]
+        rows, cols = hydro_numpy.xy_to_cell([pt.x() for pt in points], [pt.y() for pt in points], geotransform)
+
+        # outfalls are numbered from 1 in feature order
+        ids = np.arange(1, len(points) + 1)
+        inside = (rows >= 0) & (rows < pointer.shape[0]) & (cols >= 0) & (cols < pointer.shape[1])
+        for oid in ids[~inside]:
+            feedback.reportError(f"Outfall {oid} is outside the DEM and was skipped")
+        cells = rows[inside] * pointer.shape[1] + cols[inside]
+        ids = ids[inside]
+
+        # two outfalls snapped to the same cell can't both get an area
+        _, first = np.unique(cells, return_index=True)
+        for oid in np.setdiff1d(ids, ids[first]):
+            feedback.reportError(f"Outfall {oid} snapped onto the same cell as another outfall and was skipped")
+        cells, ids = cells[np.sort(first)], ids[np.sort(first)]
+
+        labels, downstream_outlet = hydro_numpy.label_watersheds(pointer, cells, ids)
+        members = hydro_numpy.nested_outlets(downstream_outlet)
+        outputs['outfall_watersheds'] = self._finalize({'output': hydro_numpy.write_raster(
+            storage.path('outfall_watersheds.tif', dem_nbytes), labels, geotransform, projection, nodata=0, kind='labels'
+        )}, rewrite=False)
+
+        # Convert the labeled areas to polygons
+        feedback.setCurrentStep(12)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
-            'input': outputs['filledWangLiu']['output'],
-            'out_type':0,
-            'log':False,
-            'clip':False,
-            'pntr':False,
-            'esri_pntr':False,
-            'output':os.path.join(wbt_file, 'wbt_flowaccum.tif')
+            'input': outputs['outfall_watersheds']['output'],
+            'output': storage.path('outfall_basins.gpkg')
         }
-        outputs['d8FlowAccum'] = processing.run("wbt:D8FlowAccumulation", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['outfall_basins'] = self._polygonize(cache, 'outfall_basins_to_vector', alg_params, feedback)
+
+        # One overlay for every outfall; rows are keyed by the outfall label (VALUE)
+        scs_df = self._characterize(outputs['outfall_basins']['output'], 'VALUE', outputs, reg_df, context, feedback)
+        if scs_df is None:
+            return None
+
+        feedback.setCurrentStep(29)
+        if feedback.isCanceled():
+            return None
+
+        # Longest flow path of each full watershed.
+        # Outfalls at the same nesting depth never overlap, so each depth
+        # needs only one basins raster and one LongestFlowpath run.
+        depth = {}
+        for oid in ids:
+            d, current = 0, downstream_outlet[int(oid)]
+            while current:
+                d, current = d + 1, downstream_outlet[current]
+            depth[int(oid)] = d
+
+        wbt_filled_dem = QgsRasterLayer(outputs['filledWangLiu']['output'], 'wbt_filled_dem')
+        temp_raster = storage.path('tempRaster.tif', dem_nbytes)
+        temp_vector = storage.path('tempVector.shp')
+        flowpaths = {}
+        for level in sorted(set(depth.values())):
+            if feedback.isCanceled():
+                return None
+            lookup = np.zeros(int(ids.max()) + 1, dtype=np.int32)
+            for oid, d in depth.items():
+                if d == level:
+                    lookup[members[oid]] = oid
+            hydro_numpy.write_raster(temp_raster, lookup[labels], geotransform, projection, nodata=0)
+            flowpaths.update(self._longest_flowpaths(wbt_filled_dem, temp_raster, temp_vector, context, feedback))
+
+        feedback.setCurrentStep(30)
+        if feedback.isCanceled():
+            return None
+
+        outfall_summary = []
+        for oid in ids:
+            oid = int(oid)
+            if oid not in flowpaths:
+                feedback.reportError(f"Outfall {oid} has no upstream area and was skipped")
+                continue
+            filtered_df = scs_df[scs_df['subbasin-key'].isin(members[oid])]
+            for row in self._rational(oid, filtered_df, flowpaths[oid][0], flowpaths[oid][1], reg_df, feedback):
+                outfall_summary.append(row + [downstream_outlet[oid]])
+
+        outfall_header = ['outfall', 'area_has', 'cn', 'n-value', 'retardance-c', 'flowpath', 'slope', 'rp', 'runoff-c', 'tc', 'method', 'intensity', 'discharge', 'downstream_outfall']
+        return pd.DataFrame(outfall_summary, columns=outfall_header, index=None), outputs
+
+    def _delineate_streams(self, threshold, tag, outputs, storage, cache, dem_nbytes, context, feedback):
+        # ExtractStreams -> RasterStreamsToVector -> pour point snapping for one Minimum Area.
+        # Adds the results to `outputs`; returns False if the run was canceled.
 
         # WBT Extract Streams
         feedback.setCurrentStep(8)
         if feedback.isCanceled():
-            return {} 
+            return False
 
         alg_params = {
             'flow_accum':outputs['d8FlowAccum']['output'],
-            'threshold':parameters['minimum_area'],
+            'threshold':threshold,
             'zero_background':False,
-            'output':os.path.join(wbt_file, 'wbt_streams-raster.tif')
+            'output':storage.path(self._tagged('wbt_streams-raster.tif', tag), dem_nbytes)
         }
-        outputs['wbt_streams'] = processing.run("wbt:ExtractStreams", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['wbt_streams'] = self._step(cache, self._tagged('extract_streams', tag), "wbt:ExtractStreams", alg_params, context, feedback)
 
         # WBT Raster Streams to Vector
         feedback.setCurrentStep(9)
         if feedback.isCanceled():
-            return {}
+            return False
         
         alg_params = {
             'streams': outputs['wbt_streams']['output'],
             'd8_pntr':outputs['d8Pointer']['output'],
             'esri_pntr':False,
-            'output':os.path.join(wbt_file, 'wbt_stream-vector.shp')
+            'output':storage.path(self._tagged('wbt_stream-vector.shp', tag))
         }
-        outputs['wbt_exStreams'] = processing.run("wbt:RasterStreamsToVector", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-        results['Streams'] = outputs['wbt_exStreams']['output']
+        outputs['wbt_exStreams'] = self._step(cache, self._tagged('streams_to_vector', tag), "wbt:RasterStreamsToVector", alg_params, context, feedback)
 
         # WBT Snap Pour Points
         feedback.setCurrentStep(10)
         if feedback.isCanceled():
-            return {}
+            return False
         
-        alg_params = {
+        # KD-tree snap of every outfall onto the stream cells (pour_point_snap.py)
+        snap_params = {
             'pour_pts': outputs['reprojected_outfall']['OUTPUT'],
-            'streams':outputs['wbt_streams']['output'],
-            'snap_dist':50,
-            'output':os.path.join(wbt_file, 'wbt_snapped_outfall.shp')
-        }
-        outputs['jenson_snapped'] = processing.run("wbt:JensonSnapPourPoints", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        # WBT Delineate Watershed
-        feedback.setCurrentStep(11)
-        if feedback.isCanceled():
-            return {}
-        
-        alg_params = {
-            'd8_pntr':outputs['d8Pointer']['output'],
-            'pour_pts': outputs['jenson_snapped']['output'],
-            'esri_pntr':False,
-            'output':os.path.join(wbt_file, 'wbt_watershed.tif')
-        }
-        outputs['wbt_watershed'] = processing.run("wbt:Watershed", alg_params, context=context, feedback=feedback)
-
-        # Convert raster watershed to vector polygon
-        feedback.setCurrentStep(12)
-        if feedback.isCanceled():
-            return {}
-        alg_params = {
-            'input':outputs['wbt_watershed']['output'],
-            'output':os.path.join(wbt_file, 'wbt_vector_basin.shp')   
+            'streams': outputs['wbt_streams']['output'],
+            'flow_accum': outputs['d8FlowAccum']['output'] if self.snap_by_accumulation else None,
+            'snap_dist': 50,
+            'output': storage.path(self._tagged('wbt_snapped_outfall.shp', tag)),
+            'report': os.path.join(storage.save_folder, self._tagged('snap_report.csv', tag))
         }
-        outputs['wbt_vector_basin'] = processing.run("wbt:RasterToVectorPolygons",alg_params, context=context, feedback=feedback)
-                
-        # Delineate the subbasins
-        feedback.setCurrentStep(13)
-        if feedback.isCanceled():
-            return {}
 
-        alg_params = {
-            'd8_pntr':outputs['d8Pointer']['output'],
-            'streams':outputs['wbt_streams']['output'],
-            'esri_pntr':False,
-            'output':os.path.join(wbt_file,'subbasins.tif')
-        }
-        outputs['wbt_subbasins'] = processing.run("wbt:Subbasins", alg_params, context=context, feedback=feedback)
+        def snap():
+            outfall = QgsVectorLayer(snap_params['pour_pts'], 'outfall', 'ogr')
+            points = [fet.geometry().asPoint() for fet in outfall.getFeatures()]
+            result = snap_outfalls(
+                snap_params['streams'], [pt.x() for pt in points], [pt.y() for pt in points], snap_params['snap_dist'],
+                accumulation_path=snap_params['flow_accum'], output=snap_params['output'], report=snap_params['report']
+            )
+            feedback.pushInfo(summary(result))
+            for oid in np.flatnonzero(result['status'] != SNAPPED) + 1:
+                feedback.reportError(f"Outfall {oid}: {result['status'][oid - 1]} (see {snap_params['report']})")
+            return {'output': snap_params['output'], 'report': snap_params['report']}
+
+        outputs['jenson_snapped'] = cache.run(self._tagged('snap_pour_points', tag), 'pour_point_snap', snap_params, snap, output_names=('output', 'report'))
+
+        return True
+
+    def _characterize(self, polygons, key_field, outputs, reg_df, context, feedback):
+        # Overlays `polygons` with the fixed land cover and soil layers in `outputs`
+        # and returns one row per overlay piece with the area-weighted CN, n, retardance
+        # and runoff coefficients. The `key_field` of `polygons` ends up in the
+        # `subbasin-key` column. Returns None if the run was canceled.
+        outputs = dict(outputs)
 
-        # Clipped the raster subbasins to the vectorized WBT watershed
-        feedback.setCurrentStep(14)
-        if feedback.isCanceled():
-            return {}
-
-        alg_params = {
-            'input': outputs['wbt_subbasins']['output'],
-            'polygons':outputs['wbt_vector_basin']['output'],
-            'maintain_dimensions':True,
-            'output':os.path.join(wbt_file, 'wbt_clipped_subbasins.tif')
-        }
-        outputs['wbt_clipped_subbasins'] = processing.run("wbt:ClipRasterToPolygon",alg_params, context=context, feedback=feedback)
-
-        # Convert clipped raster subbasins to vector polygon
-        feedback.setCurrentStep(15)
-        if feedback.isCanceled():
-            return {}
-        alg_params = {
-            'input':outputs['wbt_clipped_subbasins']['output'],
-            'output':os.path.join(wbt_file, 'wbt_vector_subbasins.shp')   
-        }
-        outputs['wbt_vector_subbasins'] = processing.run("wbt:RasterToVectorPolygons",alg_params, context=context, feedback=feedback)
-               
         # This is the start of watershed characterization
         # All child algorithm output shall be stored in the outputs['scs'] variable
         # This is because they are all temporary outputs and I see no need to store them in different variables every time.
@@ -368,49 +919,25 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # fix basins
         feedback.setCurrentStep(16)
         if feedback.isCanceled():
-            return {}
+            return None
             
         alg_params = {
-             'INPUT': outputs['wbt_vector_subbasins']['output'], 
+             'INPUT': polygons, 
              'METHOD': 0, 
              'OUTPUT': 'TEMPORARY_OUTPUT'
              }
         outputs['fixed_subbasins'] = processing.run("native:fixgeometries", alg_params, context=context, feedback=feedback, is_child_algorithm=True)      
 
-        # fix land
-        feedback.setCurrentStep(17)
-        if feedback.isCanceled():
-            return {}
-            
-        alg_params = {
-             'INPUT': outputs['reprojected_lc']['OUTPUT'], 
-             'METHOD': 0, 
-             'OUTPUT': 'TEMPORARY_OUTPUT'
-             }
-        outputs['fixed_lc'] = processing.run("native:fixgeometries", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        # fix soil
-        feedback.setCurrentStep(18)
-        if feedback.isCanceled():
-            return {}
-
-        alg_params = {
-             'INPUT': outputs['reprojected_soil']['OUTPUT'], 
-             'METHOD': 0, 
-             'OUTPUT': 'TEMPORARY_OUTPUT'
-        }
-        outputs['fixed_soil'] = processing.run("native:fixgeometries", alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
         #intersect basin - land cover
         feedback.setCurrentStep(19)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['fixed_lc']['OUTPUT'], 
             'OVERLAY': outputs['fixed_subbasins']['OUTPUT'], # This is the clipped subbasins output
             'INPUT_FIELDS':['class_name'], # This retains the class_name field in the land cover
-            'OVERLAY_FIELDS':['fid'], # This retains the `name` field in the basins vector
+            'OVERLAY_FIELDS':[key_field], # This retains the key field of the basins vector
             'OVERLAY_FIELDS_PREFIX':'subbasin-',
             'OUTPUT': 'TEMPORARY_OUTPUT'
         }
@@ -419,7 +946,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         #intersect basin - land - soil
         feedback.setCurrentStep(20)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['fixed_soil']['OUTPUT'], 
@@ -432,7 +959,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # add retardance coefficient
         feedback.setCurrentStep(21)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['scs'],
@@ -464,7 +991,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # add runoff coefficient
         feedback.setCurrentStep(22)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['scs'],
@@ -507,7 +1034,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # assign HSG value
         feedback.setCurrentStep(23)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['scs'],
@@ -532,7 +1059,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         #add Manning's N Field
         feedback.setCurrentStep(24)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT': outputs['scs'],
@@ -564,7 +1091,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # add ret-c#
         feedback.setCurrentStep(25)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT':outputs['scs'],
@@ -588,7 +1115,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # add curve number
         feedback.setCurrentStep(26)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT':outputs['scs'],
@@ -645,7 +1172,7 @@ class wbt_catchment(QgsProcessingAlgorithm):
         # calculate area of each vector
         feedback.setCurrentStep(27)
         if feedback.isCanceled():
-            return {}
+            return None
 
         alg_params = {
             'INPUT':outputs['scs'],
@@ -663,11 +1190,8 @@ class wbt_catchment(QgsProcessingAlgorithm):
 
         feedback.setCurrentStep(28)
         if feedback.isCanceled():
-            return {}
+            return None
                 
-        # Create a Pandas DataFrame for the user input regression coefficient csv
-        reg_df = pd.read_csv(parameters['reg_csv'])
-
         # Call the run-off coefficient Dataframe
         runC_df = self.runoff_df()
         
@@ -704,120 +1228,78 @@ class wbt_catchment(QgsProcessingAlgorithm):
             scs_df[f"runC-{row['rp']}-yr"] = pd.to_numeric(scs_df[f"runC-{row['rp']}-yr"], errors='coerce')
 
             # Compute for the runC x area_has
-            scs_df[f"mult-runC-{row['rp']}-yr"] = scs_df[f"runC-{row['rp']}-yr"] * scs_df['area_has']  
-
-        feedback.setCurrentStep(29)
-        if feedback.isCanceled():
-            return {}
-        
-        # Create geometry for WhiteBoxTools
-        wbt_subbasin = QgsVectorLayer(outputs['wbt_vector_subbasins']['output'], "wbt_subbasin", 'ogr')
-        wbt_dem = QgsRasterLayer(outputs['wbt_watershed']['output'], 'wbt_dem')
-        wbt_filled_dem = QgsRasterLayer(outputs['filledWangLiu']['output'], 'wbt_filled_dem')
-        
-        # Get geometry type of wbt_subbasin and display as a string
-        geometry_type_str = QgsWkbTypes.displayString(wbt_subbasin.wkbType())
-        
-        feedback.setCurrentStep(30)
-        if feedback.isCanceled():
-            return {}
-        
-        # create a vector geometry for each feature in wbt_subbasin layer
-        for fet in wbt_subbasin.getFeatures(): 
-            # create a temporary vector layer
-            vl = QgsVectorLayer(f"{geometry_type_str}?crs={wbt_subbasin.crs().authid()}", 'temp', 'memory') 
-            pr = vl.dataProvider()
-            pr.addAttributes(wbt_subbasin.fields())
-            vl.updateFields()
-            f = QgsFeature()
-            f.setGeometry(fet.geometry())
-            f.setAttributes(fet.attributes())
-            pr.addFeature(f)
-            vl.updateExtents()
-            
-            # --- WHITEBOXTOOLS ---
-            # Clip watershed raster to a feature in the subbasins
-            alg_params = {
-                'input':wbt_dem,
-                'polygons':vl,
-                'maintain_dimensions':True,
-                'output': os.path.join(wbt_file, 'tempRaster.tif')
-                }
-            wbt_clip = processing.run("wbt:ClipRasterToPolygon", alg_params, context=context, feedback=feedback)
-            
-            # calculate for the longest flow path
-            alg_params = {
-                'dem': wbt_filled_dem,
-                'basins': wbt_clip['output'],
-                'output': os.path.join(wbt_file, 'tempVector.shp')
-                }
-            wbt_longestPath = processing.run("wbt:LongestFlowpath", alg_params)
-
-            # Save the longest flow path to a vector layer
-            wbt_longestPath = QgsVectorLayer(wbt_longestPath['output'], 'tempPath', 'ogr')
-            
-            # Get the attributes of the wbt_longestPath
-            wbt_LP_head = [f.name() for f in wbt_longestPath.fields()]
-            wbt_LP = [f.attributes() for f in wbt_longestPath.getFeatures()]
-            
-            # save the longest flow path vector to a pandas DataFrame
-            df_LP = pd.DataFrame(wbt_LP, columns= wbt_LP_head, index=None)
-            
-            # get the subbasin number of the current feature
-            subbasinNumber = fet.attributes()[0]
-
-            # get the longest flow path, its position and the ave slope of the subbasin
-            longestFlowPathPosition = df_LP['LENGTH'].idxmax()
-            longestFlowPath = df_LP.loc[longestFlowPathPosition, 'LENGTH']
-            aveSlope = df_LP.loc[longestFlowPathPosition, 'AVG_SLOPE']
-
-            """
-            INSIDE FILTERED DATAFRAME
-            """
-            # Get the intersected vector layer
-            filtered_df = scs_df[scs_df['subbasin-FID'] == subbasinNumber]
-
-            # get sum of area_has, CN, n_value, ret-c, and run-c
-            scs_area = filtered_df['area_has'].sum()
-            w_cn = filtered_df['mult_CN-area'].sum() / scs_area # weighted
-            w_nValue = filtered_df['mult_n-area'].sum() / scs_area # weighted
-            w_retC = filtered_df['mult_retC-area'].sum() / scs_area # weighted
+            scs_df[f"mult-runC-{row['rp']}-yr"] = scs_df[f"runC-{row['rp']}-yr"] * scs_df['area_has']
+
+        # The overlay prefixes the key field with `subbasin-`
+        key_col = next(col for col in scs_df.columns if col.lower() == f"subbasin-{key_field}".lower())
+        scs_df = scs_df.rename(columns={key_col: 'subbasin-key'})
+        return scs_df
+
+    def _longest_flowpath(self, filled_dem, basins, output, context, feedback):
+        # Longest flow path length and its average slope (%) within `basins`.
+        # Runs in the caller's context and feedback: in a threshold sweep that
+        # is the worker's, so the step is canceled with it.
+        wbt_longestPath = processing.run("wbt:LongestFlowpath", {'dem': filled_dem, 'basins': basins, 'output': output},
+                                         context=context, feedback=feedback)
+
+        # Save the longest flow path to a vector layer
+        wbt_longestPath = QgsVectorLayer(wbt_longestPath['output'], 'tempPath', 'ogr')
+
+        # Get the attributes of the wbt_longestPath
+        wbt_LP_head = [f.name() for f in wbt_longestPath.fields()]
+        wbt_LP = [f.attributes() for f in wbt_longestPath.getFeatures()]
+
+        # save the longest flow path vector to a pandas DataFrame
+        df_LP = pd.DataFrame(wbt_LP, columns= wbt_LP_head, index=None)
+
+        # get the longest flow path, its position and the ave slope
+        longestFlowPathPosition = df_LP['LENGTH'].idxmax()
+        return df_LP.loc[longestFlowPathPosition, 'LENGTH'], df_LP.loc[longestFlowPathPosition, 'AVG_SLOPE']
+
+    def _longest_flowpaths(self, filled_dem, basins, output, context, feedback):
+        # {basin value: (longest flow path length, its average slope (%))}
+        # for a basins raster holding several basins
+        wbt_longestPath = processing.run("wbt:LongestFlowpath", {'dem': filled_dem, 'basins': basins, 'output': output},
+                                         context=context, feedback=feedback)
+        wbt_longestPath = QgsVectorLayer(wbt_longestPath['output'], 'tempPath', 'ogr')
+        df_LP = pd.DataFrame(
+            [f.attributes() for f in wbt_longestPath.getFeatures()],
+            columns=[f.name() for f in wbt_longestPath.fields()]
+        )
+        longest = df_LP.loc[df_LP.groupby('BASIN')['LENGTH'].idxmax()]
+        return {int(row['BASIN']): (row['LENGTH'], row['AVG_SLOPE']) for _, row in longest.iterrows()}
+
+    def _rational(self, basin_id, filtered_df, longestFlowPath, aveSlope, reg_df, feedback):
+        # Rational method for one basin, one row per return period.
+        # `filtered_df` holds the characterization rows of the basin.
+
+        # get sum of area_has, CN, n_value, ret-c, and run-c
+        scs_area = filtered_df['area_has'].sum()
+        w_cn = filtered_df['mult_CN-area'].sum() / scs_area # weighted
+        w_nValue = filtered_df['mult_n-area'].sum() / scs_area # weighted
+        w_retC = filtered_df['mult_retC-area'].sum() / scs_area # weighted
+
+        # --------------- This section computes for the tc for all available methods for each return period --------------- 
+        rows = []
+
+        # Iterate over the regression coefficient csv file for each return period
+        for index, row in reg_df.iterrows():
+            a, d, b = row['a'], row['d'], row['b'] # Assign the A, d, b values
+            c = filtered_df[f"mult-runC-{row['rp']}-yr"].sum() / scs_area # Computes for the weighted runoff coefficient
+            l = longestFlowPath * 3.28084 # Converts the longest flow path to feet [English metric]
+            s = aveSlope / 100.0 # Converts the slope (%) to float (#.##)
+            _threshold = 10e-10 # Sets the threshold. This controls the precision of the computed tc
 
-            
-            # --------------- This section computes for the tc for all available methods for each return period --------------- 
-
-            # Iterate over the regression coefficient csv file for each return period
-            for index, row in reg_df.iterrows():
-                a, d, b = row['a'], row['d'], row['b'] # Assign the A, d, b values
-                c = filtered_df[f"mult-runC-{row['rp']}-yr"].sum() / scs_area # Computes for the weighted runoff coefficient
-                l = longestFlowPath * 3.28084 # Converts the longest flow path to feet [English metric]
-                s = aveSlope / 100.0 # Converts the slope (%) to float (#.##)
-                _threshold = 10e-10 # Sets the threshold. This controls the precision of the computed tc
-
-                tc = self.time_of_conc(a, d, b, w_retC, w_nValue, w_cn, s, scs_area, l, c, _threshold)
-                feedback.pushInfo(f"type: {type(tc)} | tc= {tc}")
-                i = a * (tc[0] + d) ** b # Use only the first element in the time_of_conc method
-                q = 0.278 * c * i * scs_area * 0.01
-
-                # Store all available variables in the subbasin_list
-                subbasin_list = [subbasinNumber, scs_area, w_cn, w_nValue, w_retC, longestFlowPath, aveSlope, row['rp'], c, tc[0], tc[1], i, q]
-
-                # Append subbasin_list to basin_summary
-                basin_summary.append(subbasin_list)
-                
-    
+            tc = self.time_of_conc(a, d, b, w_retC, w_nValue, w_cn, s, scs_area, l, c, _threshold)
+            feedback.pushInfo(f"type: {type(tc)} | tc= {tc}")
+            i = a * (tc[0] + d) ** b # Use only the first element in the time_of_conc method
+            q = 0.278 * c * i * scs_area * 0.01
 
-        feedback.setCurrentStep(31)
-        if feedback.isCanceled():
-            return {}
-                
-        # Initialize the column header names for the basin summary
-        basin_header = ['subbasin', 'area_has', 'cn', 'n-value', 'retardance-c', 'flowpath', 'slope', 'rp', 'runoff-c', 'tc', 'method', 'intensity','discharge'] # Column names for the Basin summary
+            # Store all available variables for this return period
+            rows.append([basin_id, scs_area, w_cn, w_nValue, w_retC, longestFlowPath, aveSlope, row['rp'], c, tc[0], tc[1], i, q])
 
-        basin_df = pd.DataFrame(basin_summary, columns=basin_header, index=None) # save the list as a DataFrame
-        basin_df.to_csv(os.path.join(wbt_file, 'basin_summary.csv')) # save the DataFrame as CSV
+        return rows
 
-        return results
 
     def name(self):
         return 'wbt_catchment'
@@ -851,10 +1333,21 @@ class wbt_catchment(QgsProcessingAlgorithm):
             <li><b>- Soil Type</b>: Vector polygon layer representing soil types (BWSM Soil Type from Geoportal).</li>
             <li><b>- Save Folder</b>: Destination folder for outputs.</li>
             <li><b>- Regression CSV</b>: CSV file containing regression coefficients for different return periods.</li>
+            <li><b>- Reuse unchanged steps</b>: Skip every step whose inputs and parameters match the previous run on the same Save Folder (recorded in step_manifest.json). Run <code>python step_cache.py &lt;Save Folder&gt;</code> for the cache hit rates.</li>
+            <li><b>- Conditioning backend</b>: Run the fill, D8 pointer and D8 flow accumulation steps with WhiteboxTools, or in-process with NumPy (priority-flood fill with a flat increment). The NumPy backend avoids starting a WBT process per step; run hydro_numpy.py on a DEM to compare both. GRASS r.watershed runs the three through delineation_backends.py and rewrites them in the WBT pointer encoding; run delineation_backends.py on a DEM to compare the backends.</li>
+            <li><b>- Memory budget (MB)</b>: Caps the memory of a single step. GDAL warp memory and threads and the WBT thread count are chosen from the DEM size, the CPUs and this budget (see the log). With the Tiled NumPy backend the D8 pointer and flow accumulation are computed one tile at a time from disk, with tiles sized to this budget, so DEMs larger than RAM can be processed. The result is identical to the whole-raster computation; the depression fill still runs in WhiteboxTools.</li>
+            <li><b>- Snap outfalls to the highest flow accumulation</b>: Outfalls are snapped onto the extracted streams within 50 m. By default each goes to the nearest stream cell; when checked it goes to the stream cell with the largest flow accumulation within that distance. Snap distances and ambiguous or failed snaps are written to snap_report.csv.</li>
+            <li><b>- Delineate one watershed per outfall</b>: Treat every point in the Outfall layer as its own outlet (outfalls are numbered from 1 in feature order). Nested outfalls are included in the watershed of every outfall below them. Writes outfall_watersheds.tif, outfall_basins.gpkg and outfall_summary.csv.</li>
+            <li><b>- Threshold sweep</b>: Optional list of Minimum Area values (e.g. 20000, 50000, 100000). The filled DEM, D8 pointer and flow accumulation are computed once, then every threshold is delineated and characterized in parallel. Writes basin_summary_t&lt;threshold&gt;.csv for each threshold and a threshold_sweep.csv comparison table.</li>
+            <li><b>- Channels and culverts to burn</b>: Optional line layer of known channels and culverts that the DEM is too coarse to show. The lines are cut into the DEM before the fill: each runs downhill from its higher end and its cells are lowered by the burn depth (or by a <code>depth</code> field on the line), either following the DEM down (Burn) or along a straight grade to the lowest point on the line (Breach). Writes burned_dem.tif when intermediates are kept.</li>
+            <li><b>- Build overviews</b>: Every raster kept in the Save Folder is written as a tiled GeoTIFF, DEFLATE-compressed with a predictor suited to its type, in the smallest suitable type (uint8 D8 pointer, int32 watershed labels, float32 elevations). When checked, overviews are added so the rasters display quickly at any zoom.</li>
+            <li><b>- Keep intermediate files</b>: Write every WBT intermediate to the Save Folder. When unchecked, intermediates stay in memory or a local scratch folder and are deleted after the run.</li>
         </ul>
         
         <h2>Outputs:</h2>
         <ul>
+            <li><b>Stream Topology</b>: stream_topology.csv with one row per subbasin (its stream link): the subbasin downstream, Strahler and Shreve order, local and cumulative drainage area, channel length and outlet coordinates.</li>
+            <li><b>Junction Summary</b>: junction_summary.csv with the rational method peak at the outlet of every subbasin for each return period, from the cumulative area upstream, its area-weighted runoff coefficient and the longest travel time to the junction (subbasin tc, plus channel travel at 1 m/s along each link below it).</li>
             <li><b>Basin Summary</b>: CSV file summarizing basin characteristics and peak discharges at different return periods using rational method.</li>
         </ul>
         
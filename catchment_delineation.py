@@ -8,8 +8,22 @@ from qgis.core import QgsProcessingParameterVectorLayer
 from qgis.core import QgsProcessingParameterVectorDestination
 from qgis.core import QgsProcessingParameterFeatureSink
 from qgis.core import QgsExpression
+from qgis.core import QgsProcessingParameterEnum
 from qgis.core import QgsProcessingUtils
 import processing
+import os
+import sys
+import tempfile
+
+# helper modules live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from delineation_backends import get_backend
+from resource_tuning import ResourcePlan
+import raster_output
+import polygonize
+
+# 'backend' parameter options -> delineation_backends names
+BACKENDS = ['grass', 'wbt', 'numpy']
 
 
 class Catchment_delineation(QgsProcessingAlgorithm):
@@ -19,6 +33,7 @@ class Catchment_delineation(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterRasterLayer('dem', 'DEM', defaultValue=None))
         self.addParameter(QgsProcessingParameterNumber('minimum_area', 'Minimum Area', type=QgsProcessingParameterNumber.Double, minValue=0, maxValue=10000, defaultValue=50000))
         self.addParameter(QgsProcessingParameterVectorLayer('outfall', 'Outfall', types=[QgsProcessing.TypeVectorPoint], defaultValue=None))
+        self.addParameter(QgsProcessingParameterEnum('backend', 'Delineation backend', options=['GRASS', 'WhiteboxTools', 'NumPy (in-process)'], defaultValue=0))
         self.addParameter(QgsProcessingParameterVectorDestination('Streams', 'Streams', optional=True, type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterVectorDestination('Basin', 'Basin', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterFeatureSink('Subbasins', 'Subbasins', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
@@ -30,6 +45,10 @@ class Catchment_delineation(QgsProcessingAlgorithm):
         results = {}
         outputs = {}
 
+        # thread counts and memory for the GDAL and GRASS steps, sized to the DEM
+        dem_layer = self.parameterAsRasterLayer(parameters, 'dem', context)
+        plan = ResourcePlan(dem_layer.width(), dem_layer.height())
+
         # reproject_dem
         alg_params = {
             'DATA_TYPE': 0,  # Use Input Layer Data Type
@@ -37,7 +56,7 @@ class Catchment_delineation(QgsProcessingAlgorithm):
             'INPUT': parameters['dem'],
             'MULTITHREADING': False,
             'NODATA': None,
-            'OPTIONS': None,
+            'OPTIONS': raster_output.processing_options('elevation'),
             'RESAMPLING': 0,  # Nearest Neighbour
             'SOURCE_CRS': None,
             'TARGET_CRS': parameters['crs'],
@@ -46,124 +65,12 @@ class Catchment_delineation(QgsProcessingAlgorithm):
             'TARGET_RESOLUTION': None,
             'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
         }
+        alg_params = plan.warp(alg_params)
         outputs['Reproject_dem'] = processing.run('gdal:warpreproject', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
         feedback.setCurrentStep(1)
         if feedback.isCanceled():
             return {}
-        
-        # fill sinks
-        alg_params = {
-            '-f': False,
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'format': 0,  # grass
-            'input': outputs['Reproject_dem']['OUTPUT'],
-            'areas': QgsProcessing.TEMPORARY_OUTPUT,
-            'direction': QgsProcessing.TEMPORARY_OUTPUT,
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['FillSinks'] = processing.run('grass:r.fill.dir', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
-
-        # streams
-        alg_params = {
-            '-4': False,
-            '-a': False,
-            '-b': False,
-            '-m': False,
-            '-s': False,
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'blocking': None,
-            'convergence': 5,
-            'depression': None,
-            'disturbed_land': None,
-            'elevation': outputs['FillSinks']['output'],
-            'flow': None,
-            'max_slope_length': None,
-            'memory': 300,
-            'threshold': parameters['minimum_area'],
-            'basin': QgsProcessing.TEMPORARY_OUTPUT,
-            'drainage': QgsProcessing.TEMPORARY_OUTPUT,
-            'stream': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Streams'] = processing.run('grass:r.watershed', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(3)
-        if feedback.isCanceled():
-            return {}
-
-        # subbasins
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Streams']['basin'],
-            'type': 2,  # area
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Subbasins'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(4)
-        if feedback.isCanceled():
-            return {}
-
-        # thin_streams
-        alg_params = {
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'input': outputs['Streams']['stream'],
-            'iterations': 999,
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Thin_streams'] = processing.run('grass:r.thin', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(6)
-        if feedback.isCanceled():
-            return {}
-
-        # stream_vector
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Thin_streams']['output'],
-            'type': 0,  # line
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Stream_vector'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(7)
-        if feedback.isCanceled():
-            return {}
 
         # Reproject Outfall
         alg_params = {
@@ -175,67 +82,45 @@ class Catchment_delineation(QgsProcessingAlgorithm):
         }
         outputs['ReprojectOutfall'] = processing.run('native:reprojectlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-        feedback.setCurrentStep(5)
-        if feedback.isCanceled():
-            return {}
-        
-        # snapped
-        alg_params = {
-            'BEHAVIOR': 1,  # Prefer closest point, insert extra vertices where required
-            'INPUT': outputs['ReprojectOutfall']['OUTPUT'],
-            'REFERENCE_LAYER': outputs['Stream_vector']['output'],
-            'TOLERANCE': 200,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Snapped'] = processing.run('native:snapgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(8)
+        feedback.setCurrentStep(2)
         if feedback.isCanceled():
             return {}
 
-        # get the x,y coordinates of the snapped outfall
-        pt_layer = QgsProcessingUtils.mapLayerFromString(outputs['Snapped']['OUTPUT'], context)
-        pt = pt_layer.getGeometry(1).asPoint()
+        # fill, flow direction, streams, basin and subbasins with the selected backend
+        # every backend writes the same rasters (see delineation_backends.py)
+        pt_layer = QgsProcessingUtils.mapLayerFromString(outputs['ReprojectOutfall']['OUTPUT'], context)
+        pt = next(pt_layer.getFeatures()).geometry().asPoint()
+        backend_name = BACKENDS[self.parameterAsEnum(parameters, 'backend', context)]
+        options = {}
+        if backend_name == 'grass':
+            options['memory_mb'], options['swap'] = plan.grass_memory()
+        # a work folder of its own, so runs side by side don't overwrite each other's rasters
+        work_folder = tempfile.mkdtemp(prefix='delineation_', dir=QgsProcessingUtils.tempFolder())
+        backend = get_backend(backend_name, work_folder, context, feedback, **options)
+        delineated = backend.delineate(
+            outputs['Reproject_dem']['OUTPUT'], pt.x(), pt.y(),
+            self.parameterAsDouble(parameters, 'minimum_area', context), snap_dist=200
+        )
 
-        feedback.setCurrentStep(11)
+        feedback.setCurrentStep(3)
         if feedback.isCanceled():
             return {}
 
-        # basin
-        alg_params = {
-            'GRASS_RASTER_FORMAT_META': None,
-            'GRASS_RASTER_FORMAT_OPT': None,
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'coordinates': f'{pt.x()}, {pt.y()}',
-            'input': outputs['Streams']['drainage'],
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['Basin'] = processing.run('grass:r.water.outlet', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # convert subbasins rasters to vectors, one dissolved polygon per subbasin (polygonize.py)
+        outputs['Subbasins'] = polygonize.run_step({
+            'input': delineated['subbasins'],
+            'output': QgsProcessingUtils.generateTempFilename('subbasins.gpkg')
+        }, feedback)
 
         feedback.setCurrentStep(12)
         if feedback.isCanceled():
             return {}
 
-        # basin_vectorized
-        alg_params = {
-            '-b': False,
-            '-s': True,
-            '-t': False,
-            '-v': False,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': None,
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': None,
-            'column': 'value',
-            'input': outputs['Basin']['output'],
-            'type': 2,  # area
-            'output': parameters['Basin']
-        }
-        outputs['Basin_vectorized'] = processing.run('grass:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # convert basin raster to vector
+        outputs['Basin_vectorized'] = polygonize.run_step({
+            'input': delineated['basin'],
+            'output': QgsProcessingUtils.generateTempFilename('basin.gpkg')
+        }, feedback)
         
         feedback.setCurrentStep(13)
         if feedback.isCanceled():
@@ -255,7 +140,7 @@ class Catchment_delineation(QgsProcessingAlgorithm):
         # fix basin geometry
         alg_params = {'INPUT': outputs['Basin_vectorized']['output'],
             'METHOD':1,
-            'OUTPUT':'TEMPORARY_OUTPUT'}
+            'OUTPUT': parameters['Basin']}
         outputs['fixed_basins'] = processing.run("native:fixgeometries", alg_params, context = context, feedback=feedback)
         results['Basin'] = outputs['fixed_basins']['OUTPUT']
         
@@ -287,7 +172,7 @@ class Catchment_delineation(QgsProcessingAlgorithm):
             'MASK': outputs['fixed_basins']['OUTPUT'],
             'MULTITHREADING': False,
             'NODATA': None,
-            'OPTIONS': None,
+            'OPTIONS': raster_output.processing_options('elevation'),
             'SET_RESOLUTION': False,
             'SOURCE_CRS': None,
             'TARGET_CRS': parameters['crs'],
@@ -296,6 +181,7 @@ class Catchment_delineation(QgsProcessingAlgorithm):
             'Y_RESOLUTION': None,
             'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
         }
+        alg_params = plan.warp(alg_params)
         outputs['Clip_dem'] = processing.run('gdal:cliprasterbymasklayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
         feedback.setCurrentStep(17)
@@ -322,8 +208,10 @@ class Catchment_delineation(QgsProcessingAlgorithm):
             'threshold': QgsExpression(' @minimum_area /100').evaluate(),
             'stream_vector': parameters['Streams']
         }
+        alg_params = plan.grass(alg_params)
         outputs['Detailed_streams'] = processing.run('grass:r.stream.extract', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
         results['Streams'] = outputs['Detailed_streams']['stream_vector']
+        feedback.pushInfo('\n'.join(plan.report()))
         return results
 
     def name(self):
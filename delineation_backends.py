@@ -0,0 +1,462 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import tracemalloc
+import numpy as np
+
+import hydro_numpy
+import raster_output
+from hydro_numpy import POINTER_NODATA, ACCUM_NODATA
+from pour_point_snap import snap_outfalls, write_points, NOT_SNAPPED
+
+
+# Every backend writes the same rasters, on the grid of the input DEM, with
+# the output policy of raster_output (the kind is given by PRODUCT_KINDS):
+#   product        type     content                                   nodata
+SCHEMA = {
+    'filled_dem':   ('float32', 'depression-filled elevation',            'DEM nodata'),
+    'pointer':      ('uint8',   'D8 pointer, WhiteboxTools encoding',     POINTER_NODATA),
+    'accumulation': ('float32', 'flow accumulation in cells (GRASS: MFD)', ACCUM_NODATA),
+    'streams':      ('int32',   'stream link id, 1..',                    0),
+    'basin':        ('int32',   '1 inside the outfall watershed',          0),
+    'subbasins':    ('int32',   'id of the stream link the cell drains to, inside the basin only', 0),
+}
+PRODUCTS = tuple(SCHEMA)
+# the products that don't depend on the stream threshold or the outfall
+CONDITIONING = ('filled_dem', 'pointer', 'accumulation')
+PRODUCT_KINDS = {
+    'filled_dem': 'elevation', 'pointer': 'pointer', 'accumulation': 'accumulation',
+    'streams': 'labels', 'basin': 'labels', 'subbasins': 'labels',
+}
+
+# r.watershed drainage (1..8 counter-clockwise from north-east) to WBT pointer codes
+GRASS_TO_WBT = {1: 1, 2: 128, 3: 64, 4: 32, 5: 16, 6: 8, 7: 4, 8: 2}
+
+
+class DelineationBackend:
+    """
+    Delineates the watershed of one outfall and writes the SCHEMA rasters.
+
+    Subclasses implement `_delineate` and `_condition`, which produce the raw
+    rasters of their tool; `delineate` and `condition` then rewrite them into
+    the shared schema so the products can be swapped or compared regardless
+    of the backend.
+    The WBT and GRASS backends run processing algorithms and need QGIS;
+    the NumPy backend only needs GDAL.
+    """
+    name = None
+
+    def __init__(self, folder, context=None, feedback=None):
+        self.folder = folder
+        self.context = context
+        self.feedback = feedback
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, product):
+        return os.path.join(self.folder, f'{self.name}_{product}.tif')
+
+    def raw_path(self, product):
+        # tool output before it is rewritten into the schema
+        return os.path.join(self.folder, f'{self.name}_raw_{product}.tif')
+
+    def run(self, alg_id, params):
+        import processing
+        if self.context is None:
+            from qgis.core import QgsProcessingContext
+            self.context = QgsProcessingContext()
+        return processing.run(alg_id, params, context=self.context, feedback=self.feedback, is_child_algorithm=True)
+
+    def snap(self, streams, x, y, snap_dist):
+        result = snap_outfalls(streams, [x], [y], snap_dist)
+        if result['status'][0] == NOT_SNAPPED:
+            raise ValueError(f'{self.name}: no stream within {snap_dist} of the outfall')
+        return result['x'][0], result['y'][0]
+
+    def delineate(self, dem, x, y, threshold, snap_dist=50):
+        """
+        Delineate the watershed of the outfall (x, y) on `dem` with streams
+        starting at `threshold` cells. Returns {product: path} for PRODUCTS,
+        plus 'outlet': the snapped (x, y).
+        """
+        raw, outlet = self._delineate(dem, x, y, threshold, snap_dist)
+        products = self._rewrite(raw, PRODUCTS)
+        products['outlet'] = outlet
+        return products
+
+    def condition(self, dem, paths=None):
+        """
+        Only the CONDITIONING products of `dem`: filled DEM, D8 pointer and
+        flow accumulation, for pipelines that extract their own streams.
+        `paths` ({product: path}) overrides where each is written.
+        """
+        return self._rewrite(self._condition(dem), CONDITIONING, paths)
+
+    def _rewrite(self, raw, products, paths=None):
+        # raw tool rasters -> SCHEMA rasters, all on the grid of the pointer
+        paths = paths or {}
+        _, geotransform, projection, _ = hydro_numpy.read_raster(raw['pointer'])
+        written = {}
+        for product in products:
+            array, _, _, nodata = hydro_numpy.read_raster(raw[product])
+            array, nodata = self._normalize(product, array, nodata)
+            if product == 'basin':
+                basin = array
+            if product == 'subbasins':
+                array = np.where(basin > 0, array, 0).astype(np.int32)
+            written[product] = hydro_numpy.write_raster(
+                paths.get(product, self.path(product)), array, geotransform, projection, nodata,
+                kind=PRODUCT_KINDS[product]
+            )
+        return written
+
+    def _normalize(self, product, array, nodata):
+        missing = ~np.isfinite(array) if array.dtype.kind == 'f' else np.zeros(array.shape, dtype=bool)
+        if nodata is not None:
+            missing |= array == nodata
+
+        if product == 'filled_dem':
+            return array.astype(np.float32), nodata
+        if product == 'pointer':
+            return np.where(missing, POINTER_NODATA, array).astype(np.uint8), POINTER_NODATA
+        if product == 'accumulation':
+            return np.where(missing, ACCUM_NODATA, array).astype(np.float32), ACCUM_NODATA
+        if product == 'basin':
+            return ((array > 0) & ~missing).astype(np.int32), 0
+        # label rasters: 0 is "none"
+        return np.where(missing | (array < 0), 0, array).astype(np.int32), 0
+
+
+class NumpyBackend(DelineationBackend):
+    # hydro_numpy in-process, no external tools
+    name = 'numpy'
+
+    def _conditioned(self, dem):
+        elevation, geotransform, projection, nodata = hydro_numpy.read_raster(dem)
+        filled = hydro_numpy.priority_flood_fill(elevation, nodata)
+        pointer = hydro_numpy.d8_pointer(filled, geotransform, nodata)
+        accumulation = hydro_numpy.d8_accumulation(pointer)
+        raw = {
+            'filled_dem': hydro_numpy.write_raster(self.raw_path('filled_dem'), filled, geotransform, projection, nodata),
+            'pointer': hydro_numpy.write_raster(self.raw_path('pointer'), pointer, geotransform, projection, POINTER_NODATA),
+            'accumulation': hydro_numpy.write_raster(self.raw_path('accumulation'), accumulation, geotransform, projection, ACCUM_NODATA),
+        }
+        return raw, pointer, accumulation, geotransform, projection
+
+    def _condition(self, dem):
+        return self._conditioned(dem)[0]
+
+    def _delineate(self, dem, x, y, threshold, snap_dist):
+        raw, pointer, accumulation, geotransform, projection = self._conditioned(dem)
+        links = hydro_numpy.stream_links(pointer, accumulation >= threshold)
+        raw['streams'] = hydro_numpy.write_raster(self.raw_path('streams'), links, geotransform, projection, 0)
+        outlet = self.snap(raw['streams'], x, y, snap_dist)
+        row, col = hydro_numpy.xy_to_cell(outlet[0], outlet[1], geotransform)
+        basin = hydro_numpy.label_watersheds(pointer, [row * pointer.shape[1] + col], [1])[0]
+        raw['basin'] = hydro_numpy.write_raster(self.raw_path('basin'), basin, geotransform, projection, 0)
+        raw['subbasins'] = hydro_numpy.write_raster(
+            self.raw_path('subbasins'), hydro_numpy.link_subbasins(pointer, links), geotransform, projection, 0
+        )
+        return raw, outlet
+
+
+class WbtBackend(DelineationBackend):
+    # WhiteboxTools through the QGIS processing provider
+    name = 'wbt'
+
+    def _condition(self, dem):
+        raw = {}
+        raw['filled_dem'] = self.run('wbt:FillDepressionsWangAndLiu', {
+            'dem': dem, 'fix_flats': True, 'flat_increment': None, 'output': self.raw_path('filled_dem')})['output']
+        raw['pointer'] = self.run('wbt:D8Pointer', {
+            'dem': raw['filled_dem'], 'esri_pntr': False, 'output': self.raw_path('pointer')})['output']
+        raw['accumulation'] = self.run('wbt:D8FlowAccumulation', {
+            'input': raw['pointer'], 'out_type': 0, 'log': False, 'clip': False, 'pntr': True, 'esri_pntr': False,
+            'output': self.raw_path('accumulation')})['output']
+        return raw
+
+    def _delineate(self, dem, x, y, threshold, snap_dist):
+        raw = self._condition(dem)
+        extracted = self.run('wbt:ExtractStreams', {
+            'flow_accum': raw['accumulation'], 'threshold': threshold, 'zero_background': False,
+            'output': os.path.join(self.folder, 'wbt_extracted_streams.tif')})['output']
+        raw['streams'] = self.run('wbt:StreamLinkIdentifier', {
+            'd8_pntr': raw['pointer'], 'streams': extracted, 'esri_pntr': False, 'zero_background': False,
+            'output': os.path.join(self.folder, 'wbt_links.tif')})['output']
+
+        outlet = self.snap(raw['streams'], x, y, snap_dist)
+        _, geotransform, projection, _ = hydro_numpy.read_raster(raw['pointer'])
+        pour_point = os.path.join(self.folder, 'wbt_outlet.shp')
+        write_points(pour_point, {'x': [outlet[0]], 'y': [outlet[1]], 'distance': [0.0], 'status': ['snapped']}, projection)
+
+        raw['basin'] = self.run('wbt:Watershed', {
+            'd8_pntr': raw['pointer'], 'pour_pts': pour_point, 'esri_pntr': False,
+            'output': os.path.join(self.folder, 'wbt_watershed.tif')})['output']
+        raw['subbasins'] = self.run('wbt:Subbasins', {
+            'd8_pntr': raw['pointer'], 'streams': extracted, 'esri_pntr': False,
+            'output': os.path.join(self.folder, 'wbt_subbasins.tif')})['output']
+        return raw, outlet
+
+
+class GrassBackend(DelineationBackend):
+    # GRASS r.fill.dir / r.watershed / r.water.outlet through the QGIS processing provider
+    name = 'grass'
+
+    def __init__(self, folder, context=None, feedback=None, memory_mb=300, swap=False):
+        super().__init__(folder, context, feedback)
+        self.memory_mb = memory_mb
+        self.swap = swap  # r.watershed -m (segmented disk mode)
+
+    def _grass_params(self):
+        return {'GRASS_REGION_CELLSIZE_PARAMETER': 0, 'GRASS_REGION_PARAMETER': None,
+                'GRASS_RASTER_FORMAT_META': None, 'GRASS_RASTER_FORMAT_OPT': raster_output.grass_options()}
+
+    def _watershed(self, dem, threshold=None):
+        # r.fill.dir then r.watershed; streams and subbasins only with a threshold.
+        # r.watershed keeps its default multiple flow direction (MFD) accumulation,
+        # as the GRASS model always has; its drainage output is D8 regardless.
+        grass = self._grass_params()
+        filled = self.run('grass:r.fill.dir', dict(grass, **{
+            '-f': False, 'format': 0, 'input': dem,
+            'areas': 'TEMPORARY_OUTPUT', 'direction': 'TEMPORARY_OUTPUT',
+            'output': os.path.join(self.folder, 'grass_filled.tif')}))['output']
+        streams = threshold is not None
+        watershed = self.run('grass:r.watershed', dict(grass, **{
+            '-4': False, '-a': False, '-b': False, '-m': self.swap, '-s': False,
+            'blocking': None, 'convergence': 5, 'depression': None, 'disturbed_land': None,
+            'elevation': filled, 'flow': None, 'max_slope_length': None,
+            'memory': self.memory_mb, 'threshold': threshold,
+            'accumulation': os.path.join(self.folder, 'grass_accumulation.tif'),
+            'drainage': os.path.join(self.folder, 'grass_drainage.tif'),
+            'stream': os.path.join(self.folder, 'grass_stream.tif') if streams else None,
+            'basin': os.path.join(self.folder, 'grass_subbasins.tif') if streams else None}))
+        return filled, watershed
+
+    def _to_wbt(self, watershed):
+        # r.watershed drainage -> WBT pointer; negative values flow off the region
+        drainage, geotransform, projection, _ = hydro_numpy.read_raster(watershed['drainage'])
+        pointer = np.full(drainage.shape, POINTER_NODATA, dtype=np.uint8)
+        pointer[drainage == 0] = 0
+        for grass_code, wbt_code in GRASS_TO_WBT.items():
+            pointer[np.abs(drainage) == grass_code] = wbt_code
+        accumulation, _, _, acc_nodata = hydro_numpy.read_raster(watershed['accumulation'])
+        missing = ~np.isfinite(accumulation)
+        if acc_nodata is not None:
+            missing |= accumulation == acc_nodata
+        # negative where inflow comes from outside the region
+        accumulation = np.where(missing, ACCUM_NODATA, np.abs(accumulation))
+        return {
+            'pointer': hydro_numpy.write_raster(self.raw_path('pointer'), pointer, geotransform, projection, POINTER_NODATA),
+            'accumulation': hydro_numpy.write_raster(self.raw_path('accumulation'), accumulation, geotransform, projection, ACCUM_NODATA),
+        }
+
+    def _condition(self, dem):
+        filled, watershed = self._watershed(dem)
+        return dict(self._to_wbt(watershed), filled_dem=filled)
+
+    def _delineate(self, dem, x, y, threshold, snap_dist):
+        filled, watershed = self._watershed(dem, threshold)
+        raw = dict(self._to_wbt(watershed), filled_dem=filled, streams=watershed['stream'], subbasins=watershed['basin'])
+        outlet = self.snap(raw['streams'], x, y, snap_dist)
+        raw['basin'] = self.run('grass:r.water.outlet', dict(self._grass_params(), **{
+            'coordinates': f'{outlet[0]}, {outlet[1]}', 'input': watershed['drainage'],
+            'output': os.path.join(self.folder, 'grass_basin.tif')}))['output']
+        return raw, outlet
+
+
+BACKENDS = {'wbt': WbtBackend, 'grass': GrassBackend, 'numpy': NumpyBackend}
+
+
+def get_backend(name, folder, context=None, feedback=None, **options):
+    # options go to the backend class, e.g. memory_mb/swap for GRASS
+    return BACKENDS[name](folder, context, feedback, **options)
+
+
+def _descendants():
+    # {pid: parent pid} of every process, then the ones below this process
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name may hold spaces; the parent pid follows its ')'
+                parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            pass
+    ours = {os.getpid()}
+    found = True
+    while found:
+        children = {pid for pid, parent in parents.items() if parent in ours} - ours
+        ours |= children
+        found = bool(children)
+    return ours - {os.getpid()}
+
+
+def _proc_peak_rss(pid):
+    # VmHWM: the peak resident set of the process so far, in kB
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _child_memory_reader():
+    """
+    A function returning {pid: resident bytes} of every process below this
+    one, or None where that can't be read. Uses psutil when installed (the
+    current RSS of each child), otherwise /proc on Linux (the peak RSS).
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        me = psutil.Process()
+
+        def read():
+            sizes = {}
+            for child in me.children(recursive=True):
+                try:
+                    sizes[child.pid] = child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return sizes
+        return read
+
+    if os.path.exists(f'/proc/{os.getpid()}/status'):
+        def read():
+            sizes = {pid: _proc_peak_rss(pid) for pid in _descendants()}
+            return {pid: size for pid, size in sizes.items() if size is not None}
+        return read
+    return None
+
+
+class ChildMemory:
+    """
+    Peak memory of each child process started while the block runs (WBT and
+    GRASS run as processes), polled every `interval` seconds from a
+    background thread. `peak_mb` is the largest single child, 0 when no
+    child ran, None where the OS doesn't report it.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peaks = {}
+        self._read = _child_memory_reader()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self._read is not None:
+            self._before = set(self._read())  # children already running aren't ours
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        return False
+
+    def _poll(self):
+        while True:
+            for pid, size in self._read().items():
+                if pid not in self._before:
+                    self.peaks[pid] = max(size, self.peaks.get(pid, 0))
+            if self._stop.wait(self.interval):
+                return
+
+    @property
+    def peak_mb(self):
+        if self._read is None:
+            return None
+        return max(self.peaks.values(), default=0) / 1024 / 1024
+
+
+def agreement(reference, other):
+    """
+    How closely two sets of products agree: share of equal pointer cells,
+    share of accumulation cells within 1%, and the intersection over union
+    of the stream and basin cells.
+    """
+    read = lambda products, name: hydro_numpy.read_raster(products[name])[0]
+    a, b = read(reference, 'pointer'), read(other, 'pointer')
+    valid = (a != POINTER_NODATA) & (b != POINTER_NODATA)
+    pointer = np.mean(a[valid] == b[valid]) if valid.any() else np.nan
+
+    a, b = read(reference, 'accumulation'), read(other, 'accumulation')
+    valid = (a != ACCUM_NODATA) & (b != ACCUM_NODATA)
+    accumulation = np.mean(np.abs(a[valid] - b[valid]) <= 0.01 * np.maximum(a[valid], 1)) if valid.any() else np.nan
+
+    def iou(name):
+        a, b = read(reference, name) > 0, read(other, name) > 0
+        union = np.sum(a | b)
+        return np.sum(a & b) / union if union else 1.0
+
+    return {'pointer': pointer, 'accumulation': accumulation, 'streams': iou('streams'), 'basin': iou('basin')}
+
+
+def _memory_pass(backend, dem, x, y, threshold, snap_dist):
+    # an untimed second run: Python heap under tracemalloc, children polled
+    tracemalloc.start()
+    try:
+        with ChildMemory() as children:
+            backend.delineate(dem, x, y, threshold, snap_dist)
+        heap = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+    return heap, children.peak_mb
+
+
+def benchmark(dem, x, y, threshold, folder=None, backends=('wbt', 'grass', 'numpy'), snap_dist=50, context=None, feedback=None,
+              memory=True):
+    """
+    Run each backend on the same DEM and outfall and report runtime, peak
+    memory and the agreement of its products with the first backend's.
+    The runtime is of a plain run; with `memory` each backend is run a second
+    time for the Python heap of the in-process work (tracemalloc, which would
+    slow the timed run) and the peak of its largest child process.
+    """
+    folder = folder or tempfile.mkdtemp(prefix='delineation_')
+    runs = {}
+    lines = [f"{'backend':<8}{'seconds':>9}{'heap MB':>9}{'child MB':>10}{'subbasins':>11}"
+             f"{'pointer':>9}{'accum':>8}{'streams':>9}{'basin':>8}"]
+    for name in backends:
+        backend = get_backend(name, os.path.join(folder, name), context, feedback)
+        start = time.perf_counter()
+        try:
+            products = backend.delineate(dem, x, y, threshold, snap_dist)
+        except Exception as error:  # a missing provider shouldn't stop the other backends
+            lines.append(f"{name:<8} failed: {error}")
+            continue
+        seconds = time.perf_counter() - start
+        heap, child = _memory_pass(backend, dem, x, y, threshold, snap_dist) if memory else (None, None)
+
+        runs[name] = products
+        reference = next(iter(runs.values()))
+        agree = agreement(reference, products)
+        subbasins = np.unique(hydro_numpy.read_raster(products['subbasins'])[0]).size - 1
+        heap = f"{heap:>9.0f}" if heap is not None else f"{'n/a':>9}"
+        child = f"{child:>10.0f}" if child is not None else f"{'n/a':>10}"
+        lines.append(f"{name:<8}{seconds:>9.2f}{heap}{child}{subbasins:>11}"
+                     f"{agree['pointer']:>9.1%}{agree['accumulation']:>8.1%}{agree['streams']:>9.1%}{agree['basin']:>8.1%}")
+
+    lines.append(f"agreement is against '{next(iter(runs), '-')}'; outputs in {folder}")
+    return lines
+
+
+if __name__ == '__main__':
+    # python delineation_backends.py <dem.tif> <outfall x> <outfall y> <threshold cells> [backend ...]
+    # WBT and GRASS need the QGIS processing providers; run from the QGIS Python
+    # console (or an initialised standalone QGIS) to include them.
+    if len(sys.argv) < 5:
+        sys.exit('usage: python delineation_backends.py <dem.tif> <x> <y> <threshold> [wbt grass numpy]')
+    names = sys.argv[5:] or ['numpy']
+    print('\n'.join(benchmark(sys.argv[1], float(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]), backends=names)))
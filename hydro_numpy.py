@@ -0,0 +1,468 @@
+import os
+import sys
+import time
+import heapq
+import tempfile
+import subprocess
+from collections import deque
+import numpy as np
+
+import raster_output
+
+
+# WhiteboxTools D8 pointer encoding (esri_pntr=False):
+#   64 128   1
+#   32   0   2
+#   16   8   4
+# code: (row offset, col offset) of the receiving cell
+WBT_D8 = {
+    1: (-1, 1),
+    2: (0, 1),
+    4: (1, 1),
+    8: (1, 0),
+    16: (1, -1),
+    32: (0, -1),
+    64: (-1, -1),
+    128: (-1, 0),
+}
+
+
+def read_raster(path):
+    """
+    Read band 1 of `path` with GDAL.
+    Returns (array, geotransform, projection wkt, nodata).
+    """
+    from osgeo import gdal
+    ds = gdal.Open(path)
+    band = ds.GetRasterBand(1)
+    array = band.ReadAsArray()
+    info = (ds.GetGeoTransform(), ds.GetProjection(), band.GetNoDataValue())
+    ds = None
+    return (array,) + info
+
+
+def write_raster(path, array, geotransform, projection, nodata=None, kind=None, options=None):
+    """
+    Write `array` as a single band GeoTIFF (or any GDAL path, e.g. /vsimem/).
+    With `kind` (see raster_output.KINDS) the array is cast to that kind's
+    dtype; the creation options follow the output policy of the kind, or of
+    the array's dtype, unless `options` is given.
+    """
+    from osgeo import gdal, gdal_array
+    if kind is not None:
+        array, nodata = raster_output.cast(array, kind, nodata)
+    if options is None:
+        options = raster_output.creation_options(kind or raster_output.kind_for_dtype(array.dtype))
+    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+    ds = gdal.GetDriverByName('GTiff').Create(
+        path, array.shape[1], array.shape[0], 1, gdal_type, options=list(options)
+    )
+    ds.SetGeoTransform(geotransform)
+    ds.SetProjection(projection)
+    band = ds.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(array)
+    ds.FlushCache()
+    ds = None
+    return path
+
+
+# nodata written by the in-process steps; pointers are stored as uint8
+POINTER_NODATA = 255
+ACCUM_NODATA = -32768.0
+
+
+def xy_to_cell(x, y, geotransform):
+    """
+    Map coordinates to (row, col) of a north-up raster. Works on arrays.
+    """
+    x0, dx, _, y0, _, dy = geotransform
+    col = np.floor((np.asarray(x) - x0) / dx).astype(np.int64)
+    row = np.floor((np.asarray(y) - y0) / dy).astype(np.int64)
+    return row, col
+
+
+def downstream_index(pointer):
+    """
+    Flat index of the cell each cell drains to, or -1 where the pointer is
+    0/nodata or points off the raster.
+    """
+    rows, cols = pointer.shape
+    r, c = np.indices(pointer.shape)
+    down = np.full(pointer.size, -1, dtype=np.int64)
+    codes = pointer.ravel()
+
+    for code, (dr, dc) in WBT_D8.items():
+        sel = np.flatnonzero(codes == code)
+        if not sel.size:
+            continue
+        rr = r.ravel()[sel] + dr
+        cc = c.ravel()[sel] + dc
+        inside = (rr >= 0) & (rr < rows) & (cc >= 0) & (cc < cols)
+        down[sel[inside]] = rr[inside] * cols + cc[inside]
+    return down
+
+
+def propagate_labels(nxt, labels):
+    """
+    Give every unlabeled cell (label 0) the label of the first labeled cell
+    along its `nxt` path (flat next-cell index, -1 where the path ends).
+    Works in place on the flat `labels`; `nxt` is used as scratch space.
+
+    Uses pointer jumping: each round a cell looks twice as far ahead, so
+    O(log path length) vectorized rounds label everything.
+    """
+    active = np.flatnonzero((nxt >= 0) & (labels == 0))
+
+    # a valid D8 pointer has no loops, so log2(cells) rounds are enough;
+    # the cap only guards against a corrupt pointer
+    for _ in range(64):
+        if not active.size:
+            break
+        target = nxt[active]
+        found = labels[target]
+        hit = found != 0
+        labels[active[hit]] = found[hit]
+
+        jump = nxt[target]
+        keep = ~hit & (jump >= 0)
+        nxt[active[keep]] = jump[keep]
+        active = active[keep]
+    return labels
+
+
+def label_watersheds(pointer, outlet_cells, outlet_ids):
+    """
+    Label every cell with the id of the first outlet it drains to (0 if none),
+    in one pass over the D8 pointer.
+
+    Instead of walking upstream from each outlet, every cell follows its
+    pointer with pointer jumping (see propagate_labels). Outlets stop the jumps, which is what separates nested outlets:
+    the upstream outlet keeps its own area and the downstream one gets the rest.
+
+    Returns (labels, downstream_outlet) where downstream_outlet maps each
+    outlet id to the id of the next outlet below it (0 for the most
+    downstream outlets).
+    """
+    outlet_cells = np.asarray(outlet_cells, dtype=np.int64)
+    outlet_ids = np.asarray(outlet_ids, dtype=np.int32)
+    down = downstream_index(pointer)
+
+    labels = np.zeros(pointer.size, dtype=np.int32)
+    labels[outlet_cells] = outlet_ids
+
+    nxt = down.copy()
+    nxt[outlet_cells] = -1
+    propagate_labels(nxt, labels)
+
+    downstream_outlet = {}
+    for cell, oid in zip(outlet_cells, outlet_ids):
+        d = down[cell]
+        downstream_outlet[int(oid)] = int(labels[d]) if d >= 0 else 0
+
+    return labels.reshape(pointer.shape), downstream_outlet
+
+
+def stream_links(pointer, streams):
+    """
+    Number the links of a stream network (1.., 0 off the streams), like
+    wbt:StreamLinkIdentifier. A link starts at a channel head or just below
+    a junction and runs down to the next junction.
+    """
+    down = downstream_index(pointer)
+    on_stream = streams.ravel() > 0
+    cells = np.flatnonzero(on_stream)
+    receiver = down[cells]
+    joins = receiver >= 0
+    joins[joins] = on_stream[receiver[joins]]
+    upstream_count = np.bincount(receiver[joins], minlength=pointer.size)
+
+    labels = np.zeros(pointer.size, dtype=np.int32)
+    heads = cells[upstream_count[cells] != 1]
+    labels[heads] = np.arange(1, heads.size + 1)
+
+    # inside a link every cell has exactly one upstream stream cell: follow
+    # those back up to the link's first cell
+    up = np.full(pointer.size, -1, dtype=np.int64)
+    src, dst = cells[joins], receiver[joins]
+    single = upstream_count[dst] == 1
+    up[dst[single]] = src[single]
+    return propagate_labels(up, labels).reshape(pointer.shape)
+
+
+def link_subbasins(pointer, links):
+    """
+    Area draining directly to each stream link, labeled with the link id,
+    like wbt:Subbasins.
+    """
+    down = downstream_index(pointer)
+    flat = links.ravel()
+    cells = np.flatnonzero(flat)
+    receiver = down[cells]
+    # a link's outlet is its last cell before another link (or the edge)
+    last = np.ones(cells.size, dtype=bool)
+    last[receiver >= 0] = flat[receiver[receiver >= 0]] != flat[cells[receiver >= 0]]
+    return label_watersheds(pointer, cells[last], flat[cells[last]])[0]
+
+
+def nested_outlets(downstream_outlet):
+    """
+    For each outlet, the ids of every outlet whose area drains through it
+    (itself included). Union the labels of these ids for the full watershed.
+    """
+    upstream = {oid: [] for oid in downstream_outlet}
+    for oid, down in downstream_outlet.items():
+        if down:
+            upstream[down].append(oid)
+
+    members = {}
+    for oid in downstream_outlet:
+        stack, seen = [oid], []
+        while stack:
+            current = stack.pop()
+            seen.append(current)
+            stack.extend(upstream[current])
+        members[oid] = sorted(seen)
+    return members
+
+
+def _valid_mask(dem, nodata):
+    valid = np.isfinite(dem)
+    if nodata is not None:
+        valid &= dem != nodata
+    return valid
+
+
+def priority_flood_fill(dem, nodata=None, epsilon=True):
+    """
+    Fill depressions with Priority-Flood (Barnes et al. 2014).
+
+    Cells on the raster edge or next to nodata seed a min-heap; the lowest open
+    cell is expanded and any neighbour at or below it is raised and expanded
+    through a plain queue (pit cells never touch the heap). With `epsilon`,
+    a raised cell is set just above its spill cell so filled flats keep a
+    gradient to their outlet and D8 can route across them. `epsilon=True`
+    uses the next representable value of the DEM's float type; a number is
+    used as a fixed increment instead.
+
+    Returns a float32 array, with nodata cells left as they were.
+    """
+    rows, cols = dem.shape
+    valid = _valid_mask(dem, nodata)
+
+    # pad with a ring of closed cells so neighbours never fall off the grid
+    width = cols + 2
+    z = np.zeros((rows + 2, cols + 2), dtype=np.float32)
+    z[1:-1, 1:-1] = np.where(valid, dem, 0)
+    open_cells = np.zeros((rows + 2, cols + 2), dtype=bool)
+    open_cells[1:-1, 1:-1] = valid
+
+    # seeds: valid cells with at least one closed neighbour
+    edge = np.zeros_like(open_cells)
+    for dr, dc in WBT_D8.values():
+        edge[1:-1, 1:-1] |= ~open_cells[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]
+    edge &= open_cells
+
+    if epsilon is True:
+        step = lambda v: float(np.nextafter(np.float32(v), np.float32(np.inf)))
+    elif epsilon:
+        step = lambda v: float(np.float32(v + epsilon))
+    else:
+        step = lambda v: v
+
+    offsets = [dr * width + dc for dr, dc in WBT_D8.values()]
+    zf = z.ravel().tolist()  # plain lists index much faster than numpy scalars
+    is_open = open_cells.ravel().tolist()
+
+    heap = []
+    for cell in np.flatnonzero(edge.ravel()).tolist():
+        heap.append((zf[cell], cell))
+        is_open[cell] = False
+    heapq.heapify(heap)
+    pit = deque()
+
+    while heap or pit:
+        if pit:
+            cell = pit.popleft()
+            zc = zf[cell]
+        else:
+            zc, cell = heapq.heappop(heap)
+        spill = step(zc)
+        for off in offsets:
+            n = cell + off
+            if not is_open[n]:
+                continue
+            is_open[n] = False
+            if zf[n] <= zc or (epsilon and zf[n] < spill):
+                zf[n] = spill
+                pit.append(n)
+            else:
+                heapq.heappush(heap, (zf[n], n))
+
+    filled = np.array(zf, dtype=np.float32).reshape(rows + 2, cols + 2)[1:-1, 1:-1]
+    filled[~valid] = dem[~valid] if nodata is None else nodata
+    return filled
+
+
+def d8_pointer(dem, geotransform, nodata=None):
+    """
+    D8 flow directions in the WhiteboxTools encoding (see WBT_D8): each cell
+    points to its steepest downslope neighbour, 0 where none is lower.
+    Ties go to the first direction in WBT's scan order, like wbt:D8Pointer.
+    """
+    rows, cols = dem.shape
+    valid = _valid_mask(dem, nodata)
+    z = np.full((rows + 2, cols + 2), np.nan)
+    z[1:-1, 1:-1] = np.where(valid, dem, np.nan)
+    dx, dy = abs(geotransform[1]), abs(geotransform[5])
+    diag = np.hypot(dx, dy)
+
+    pointer = np.zeros((rows, cols), dtype=np.uint8)
+    best = np.zeros((rows, cols))
+    centre = z[1:-1, 1:-1]
+    for code, (dr, dc) in WBT_D8.items():
+        length = diag if dr and dc else (dx if dc else dy)
+        with np.errstate(invalid='ignore'):
+            slope = (centre - z[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]) / length
+            steeper = slope > best  # NaN neighbours compare False
+        pointer[steeper] = code
+        best[steeper] = slope[steeper]
+
+    pointer[~valid] = POINTER_NODATA
+    return pointer
+
+
+def accumulate(down, weight):
+    """
+    Sum `weight` down the flow graph `down` (flat receiver index per cell,
+    -1 for none): each cell ends up with its own weight plus the weight of
+    everything upstream. Returns a float64 copy.
+
+    Uses Kahn's topological order in frontier waves: the cells with no
+    remaining upstream inflow pass their totals down all at once, so each
+    wave is one vectorized step.
+    """
+    acc = np.asarray(weight, dtype=np.float64).copy()
+    has_down = np.flatnonzero(down >= 0)
+    indegree = np.bincount(down[has_down], minlength=down.size)
+    frontier = np.flatnonzero(indegree == 0)
+
+    while frontier.size:
+        frontier = frontier[down[frontier] >= 0]
+        receivers = down[frontier]
+        np.add.at(acc, receivers, acc[frontier])
+        np.subtract.at(indegree, receivers, 1)
+        receivers = np.unique(receivers)
+        frontier = receivers[indegree[receivers] == 0]
+    return acc
+
+
+def d8_accumulation(pointer, nodata=POINTER_NODATA):
+    """
+    Number of cells draining through each cell (itself included), like
+    wbt:D8FlowAccumulation with out_type 'cells'.
+    """
+    valid = pointer.ravel() != nodata
+    acc = accumulate(downstream_index(pointer), valid)
+    acc[~valid] = ACCUM_NODATA
+    # float32 holds cell counts exactly up to 2**24
+    dtype = np.float32 if pointer.size < 2 ** 24 else np.float64
+    return acc.reshape(pointer.shape).astype(dtype)
+
+
+# In-process versions of the WBT conditioning steps. They take the same
+# alg_params as the processing algorithm and return the same outputs dict.
+
+def _fill_step(params):
+    dem, geotransform, projection, nodata = read_raster(params['dem'])
+    epsilon = (params.get('flat_increment') or True) if params.get('fix_flats', True) else False
+    filled = priority_flood_fill(dem, nodata, epsilon)
+    write_raster(params['output'], filled, geotransform, projection, nodata, kind='elevation')
+    return {'output': params['output']}
+
+
+def _pointer_step(params):
+    dem, geotransform, projection, nodata = read_raster(params['dem'])
+    if params.get('esri_pntr'):
+        raise ValueError('The NumPy backend only writes WhiteboxTools pointers (esri_pntr=False)')
+    write_raster(params['output'], d8_pointer(dem, geotransform, nodata), geotransform, projection, POINTER_NODATA, kind='pointer')
+    return {'output': params['output']}
+
+
+def _accumulation_step(params):
+    if params.get('out_type', 0) not in (0, 'cells') or params.get('log') or params.get('esri_pntr'):
+        raise ValueError('The NumPy backend only computes cell counts from a WhiteboxTools pointer or a DEM')
+    grid, geotransform, projection, nodata = read_raster(params['input'])
+    if params.get('pntr'):
+        accumulation = d8_accumulation(grid, nodata)
+    else:
+        accumulation = d8_accumulation(d8_pointer(grid, geotransform, nodata))
+    write_raster(params['output'], accumulation, geotransform, projection, ACCUM_NODATA, kind='accumulation')
+    return {'output': params['output']}
+
+
+NUMPY_STEPS = {
+    'wbt:FillDepressionsWangAndLiu': _fill_step,
+    'wbt:D8Pointer': _pointer_step,
+    'wbt:D8FlowAccumulation': _accumulation_step,
+}
+
+
+def run_step(alg_id, params):
+    """
+    Run `alg_id` in-process. Only the algorithms in NUMPY_STEPS are supported.
+    """
+    return NUMPY_STEPS[alg_id](params)
+
+
+def benchmark(dem_path, wbt_exe=None):
+    """
+    Time the NumPy fill, pointer and accumulation on `dem_path` and, when the
+    whitebox_tools executable is given, the same WBT tools on the same DEM.
+    Returns report lines with the runtimes and how closely the outputs agree.
+    """
+    folder = tempfile.mkdtemp(prefix='hydro_numpy_')
+    numpy_out = {name: os.path.join(folder, f'numpy_{name}.tif') for name in ('fill', 'pointer', 'accum')}
+    wbt_out = {name: os.path.join(folder, f'wbt_{name}.tif') for name in ('fill', 'pointer', 'accum')}
+
+    steps = [
+        ('fill', 'wbt:FillDepressionsWangAndLiu', {'dem': dem_path, 'fix_flats': True, 'output': numpy_out['fill']},
+         ['FillDepressionsWangAndLiu', f'--dem={dem_path}', '--fix_flats', f"--output={wbt_out['fill']}"]),
+        ('pointer', 'wbt:D8Pointer', {'dem': numpy_out['fill'], 'output': numpy_out['pointer']},
+         ['D8Pointer', f"--dem={wbt_out['fill']}", f"--output={wbt_out['pointer']}"]),
+        ('accum', 'wbt:D8FlowAccumulation', {'input': numpy_out['pointer'], 'pntr': True, 'output': numpy_out['accum']},
+         ['D8FlowAccumulation', f"--input={wbt_out['pointer']}", '--pntr', '--out_type=cells', f"--output={wbt_out['accum']}"]),
+    ]
+
+    lines = [f"{'step':<10}{'numpy (s)':>12}{'wbt (s)':>10}  agreement"]
+    for name, alg_id, params, wbt_args in steps:
+        start = time.perf_counter()
+        run_step(alg_id, params)
+        numpy_time = time.perf_counter() - start
+
+        if not wbt_exe:
+            lines.append(f"{name:<10}{numpy_time:>12.2f}{'-':>10}")
+            continue
+
+        start = time.perf_counter()
+        subprocess.run([wbt_exe, '-r=' + wbt_args[0], '-v=false'] + wbt_args[1:], check=True, capture_output=True)
+        wbt_time = time.perf_counter() - start
+
+        ours, theirs = read_raster(numpy_out[name])[0], read_raster(wbt_out[name])[0]
+        if name == 'fill':
+            # flat increments differ between the two, so compare elevations
+            agreement = f"max |dz| {np.nanmax(np.abs(ours.astype(np.float64) - theirs)):.4f}"
+        else:
+            agreement = f"{np.mean(ours == theirs):.2%} of cells equal"
+        lines.append(f"{name:<10}{numpy_time:>12.2f}{wbt_time:>10.2f}  {agreement}")
+
+    lines.append(f"outputs in {folder}")
+    return lines
+
+
+if __name__ == '__main__':
+    # benchmark: python hydro_numpy.py <dem.tif> [path to whitebox_tools]
+    if len(sys.argv) not in (2, 3):
+        sys.exit('usage: python hydro_numpy.py <dem.tif> [whitebox_tools executable]')
+    print('\n'.join(benchmark(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None)))
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+# Vector line helpers shared by the DEM burning (stream_burning) and the RAS
+# mesh sampling (ras_mesh); lines are (N, 2) vertex arrays.
+
+
+def sample_lines(lines, spacing):
+    """
+    Points every `spacing` (or closer) along all lines at once.
+    Returns (line index, x, y, distance from the line start) arrays.
+    """
+    starts = np.concatenate([line[:-1] for line in lines])
+    ends = np.concatenate([line[1:] for line in lines])
+    seg_line = np.repeat(np.arange(len(lines)), [len(line) - 1 for line in lines])
+    seg_len = np.hypot(*(ends - starts).T)
+
+    # distance of each segment start from its line start
+    cum = np.cumsum(seg_len)
+    line_first = np.searchsorted(seg_line, np.arange(len(lines)))
+    seg_s0 = cum - seg_len - (cum - seg_len)[line_first][seg_line]
+
+    # n samples per segment at t = 0, 1/n, .. (n-1)/n, plus each line's last vertex
+    n = np.maximum(np.ceil(seg_len / spacing).astype(np.int64), 1)
+    seg = np.repeat(np.arange(seg_len.size), n)
+    t = (np.arange(seg.size) - np.repeat(np.cumsum(n) - n, n)) / n[seg]
+    xy = starts[seg] + (ends[seg] - starts[seg]) * t[:, None]
+    s = seg_s0[seg] + seg_len[seg] * t
+
+    last = np.array([line[-1] for line in lines])
+    line_len = np.bincount(seg_line, weights=seg_len, minlength=len(lines))
+    return (np.concatenate([seg_line[seg], np.arange(len(lines))]),
+            np.concatenate([xy[:, 0], last[:, 0]]),
+            np.concatenate([xy[:, 1], last[:, 1]]),
+            np.concatenate([s, line_len]))
@@ -0,0 +1,101 @@
+import sys
+import numpy as np
+import pandas as pd
+
+from stream_topology import StreamTopology, topological_order
+
+
+# flow velocity in the channels, used for the travel time along each link
+CHANNEL_VELOCITY = 1.0  # m/s
+
+
+def route(topology, basin_df, reg_df, velocity=CHANNEL_VELOCITY):
+    """
+    Rational method peak at the outlet of every subbasin (the junction where
+    its link meets the next one), for every return period at once.
+
+    `basin_df` is the per-subbasin basin summary (subbasin, rp, area_has,
+    runoff-c, tc in minutes) and `reg_df` the IDF regression table (rp, a, d,
+    b). Walking the links of `topology` from the headwaters down, each
+    junction gets:
+
+    - area: its own subbasin plus everything upstream
+    - runoff-c: the area-weighted C of that area
+    - tc: the longest travel time to the junction, i.e. the larger of the
+      subbasin's own tc and the tc of each upstream junction plus the travel
+      time along this link (length / `velocity`)
+
+    and from these the intensity a (tc + d)^b and Q = 0.278 C i A. One pass,
+    O(links x return periods). Returns a DataFrame, one row per junction and
+    return period.
+    """
+    links = topology['link']
+    n = len(links)
+    rps = list(reg_df['rp'])
+    a = reg_df['a'].to_numpy(dtype=float)
+    d = reg_df['d'].to_numpy(dtype=float)
+    b = reg_df['b'].to_numpy(dtype=float)
+
+    # (link, rp) arrays of the subbasins' own values; links missing from the
+    # basin summary pass flow through without adding any
+    area = np.zeros((n, len(rps)))
+    runoff_c = np.zeros((n, len(rps)))
+    tc = np.zeros((n, len(rps)))
+    known = basin_df[basin_df['subbasin'].isin(links) & basin_df['rp'].isin(rps)]
+    rows = np.array([topology.row(link) for link in known['subbasin']], dtype=np.int64)
+    cols = np.array([rps.index(rp) for rp in known['rp']], dtype=np.int64)
+    if rows.size:
+        area[rows, cols] = known['area_has'].to_numpy(dtype=float)
+        runoff_c[rows, cols] = known['runoff-c'].to_numpy(dtype=float)
+        tc[rows, cols] = known['tc'].to_numpy(dtype=float)
+
+    travel = topology['length'] / velocity / 60.0  # minutes along each link
+    down = np.array([topology.row(link) if link else -1 for link in topology['downstream']], dtype=np.int64)
+
+    cum_area = area.copy()
+    cum_ca = runoff_c * area
+    cum_tc = tc.copy()
+    upstream_count = np.zeros(n, dtype=np.int64)
+    for i in topological_order(down):
+        j = down[i]
+        if j < 0:
+            continue
+        cum_area[j] += cum_area[i]
+        cum_ca[j] += cum_ca[i]
+        cum_tc[j] = np.maximum(cum_tc[j], cum_tc[i] + travel[j])
+        upstream_count[j] += 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c = np.where(cum_area > 0, cum_ca / cum_area, np.nan)
+    intensity = a * (cum_tc + d) ** b
+    discharge = 0.278 * c * intensity * cum_area * 0.01
+
+    return pd.DataFrame({
+        'junction': np.repeat(links, len(rps)),
+        'downstream': np.repeat(topology['downstream'], len(rps)),
+        'strahler': np.repeat(topology['strahler'], len(rps)),
+        'upstream_links': np.repeat(upstream_count, len(rps)),
+        'rp': np.tile(rps, n),
+        'area_has': cum_area.ravel(),
+        'runoff-c': c.ravel(),
+        'tc': cum_tc.ravel(),
+        'intensity': intensity.ravel(),
+        'discharge': discharge.ravel(),
+    })
+
+
+def route_files(topology_csv, basin_csv, reg_csv, output, velocity=CHANNEL_VELOCITY):
+    """
+    route() on the CSVs written by wbt_catchment; writes junction_summary.csv.
+    """
+    junction_df = route(StreamTopology.read(topology_csv), pd.read_csv(basin_csv), pd.read_csv(reg_csv), velocity)
+    junction_df.to_csv(output, index=False)
+    return output
+
+
+if __name__ == '__main__':
+    # python network_routing.py <stream_topology.csv> <basin_summary.csv> <regression.csv> <output.csv> [velocity m/s]
+    if len(sys.argv) not in (5, 6):
+        sys.exit('usage: python network_routing.py <stream_topology.csv> <basin_summary.csv> <regression.csv> <output.csv> [velocity m/s]')
+    velocity = float(sys.argv[5]) if len(sys.argv) == 6 else CHANNEL_VELOCITY
+    print(route_files(*sys.argv[1:5], velocity=velocity))
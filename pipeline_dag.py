@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class PipelineDAG:
+    """
+    A processing chain declared as a dependency graph.
+
+    Each node is a function of the outputs of the nodes it depends on:
+    `func(inputs)` where `inputs` maps dependency names to their results.
+    `run` starts every node whose dependencies are done, so independent
+    branches (e.g. the vector reprojections next to the DEM chain) run
+    side by side. A node's `slots` is how much of the worker budget it takes;
+    give a step that is multi-threaded itself (WBT, GRASS) more than one.
+    """
+
+    def __init__(self):
+        self.nodes = {}  # name: (func, deps, slots), in insertion order
+        self.timings = {}  # name: (start, end) in seconds from the start of the run
+
+    def add(self, name, func, deps=(), slots=1):
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError(f"'{name}' depends on unknown step '{dep}'")
+        self.nodes[name] = (func, tuple(deps), slots)
+        return name
+
+    def run(self, feedback=None, max_workers=None, on_cancel=None, on_done=None):
+        """
+        Run every node within `max_workers` slots (default: half the CPUs).
+        `feedback.isCanceled()` is polled while nodes run; on cancel no new
+        node is started, `on_cancel()` is called so running nodes can stop,
+        and None is returned. `on_done(name, result)` is called from this
+        thread as each node finishes. Returns {name: result}.
+        """
+        max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        results = {}
+        remaining = dict(self.nodes)
+        running = {}  # future: name
+        used = 0
+        start = time.perf_counter()
+        lock = threading.Lock()
+
+        def timed(name, func, inputs):
+            begin = time.perf_counter() - start
+            try:
+                return func(inputs)
+            finally:
+                with lock:
+                    self.timings[name] = (begin, time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while remaining or running:
+                if feedback is not None and feedback.isCanceled():
+                    if on_cancel is not None:
+                        on_cancel()
+                    for future in running:
+                        future.cancel()
+                    return None
+
+                # start ready nodes in declaration order while the budget allows;
+                # a node bigger than the budget still runs, just on its own
+                for name, (func, deps, slots) in list(remaining.items()):
+                    if not all(dep in results for dep in deps):
+                        continue
+                    slots = min(slots, max_workers)
+                    if used + slots > max_workers:
+                        break
+                    inputs = {dep: results[dep] for dep in deps}
+                    running[pool.submit(timed, name, func, inputs)] = name
+                    used += slots
+                    del remaining[name]
+
+                done, _ = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    used -= min(self.nodes[name][2], max_workers)
+                    results[name] = future.result()
+                    if on_done is not None:
+                        on_done(name, results[name])
+        return results
+
+    def report(self):
+        """
+        One line per node: start, end and duration in seconds, by start time.
+        """
+        lines = [f"{'step':<22}{'start':>8}{'end':>8}{'seconds':>9}"]
+        for name, (begin, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            lines.append(f"{name:<22}{begin:>8.1f}{end:>8.1f}{end - begin:>9.1f}")
+        return lines
@@ -0,0 +1,188 @@
+import os
+import csv
+import numpy as np
+from scipy.spatial import cKDTree
+
+import hydro_numpy
+
+
+# Snap results
+SNAPPED = 'snapped'
+AMBIGUOUS = 'ambiguous'    # snapped, but a different stream was nearly as good
+NOT_SNAPPED = 'not_snapped'  # no stream cell within the snap distance; left in place
+
+
+class PourPointSnapper:
+    """
+    Snaps outfalls onto stream cells with a KD-tree over the stream cell centers.
+
+    The tree is built once from the streams raster, then every outfall is
+    snapped in one ball query; only the stream cells within the snap
+    distance are ranked. By default an outfall goes to the nearest
+    stream cell; with an `accumulation` raster it goes to the candidate with
+    the largest flow accumulation, like JensonSnapPourPoints.
+
+    Ties are broken by row-major cell order, so the same inputs always give
+    the same snapped points.
+    """
+
+    def __init__(self, streams, geotransform, accumulation=None, nodata=None):
+        valid = streams > 0
+        if nodata is not None:
+            valid &= streams != nodata
+        self.cells = np.flatnonzero(valid)  # row-major, so the tree is built in a fixed order
+        self.shape = streams.shape
+        self.geotransform = geotransform
+        self.cellsize = abs(geotransform[1])
+
+        rows, cols = np.divmod(self.cells, self.shape[1])
+        x0, dx, _, y0, _, dy = geotransform
+        self.xy = np.column_stack((x0 + (cols + 0.5) * dx, y0 + (rows + 0.5) * dy))
+        # GRASS marks cells with inflow from outside the region with negative accumulation
+        self.weight = None if accumulation is None else np.abs(accumulation.ravel()[self.cells].astype(np.float64))
+        self.tree = cKDTree(self.xy) if self.cells.size else None
+
+    def snap(self, x, y, max_dist, tolerance=0.1):
+        """
+        Snap the points (x, y) to stream cells no further than `max_dist`.
+
+        A snap is reported as ambiguous when a candidate that is not a
+        neighbour of the chosen cell scores within `tolerance` of it: within
+        `tolerance` cell sizes of the distance, or within `tolerance` (a
+        fraction) of the accumulation when snapping by accumulation.
+
+        Returns a dict of arrays: x, y, row, col (-1 when not snapped),
+        distance, status.
+        """
+        pts = np.column_stack((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
+        n = len(pts)
+        result = {
+            'x': pts[:, 0].copy(), 'y': pts[:, 1].copy(),
+            'row': np.full(n, -1), 'col': np.full(n, -1),
+            'distance': np.full(n, np.nan),
+            'status': np.full(n, NOT_SNAPPED, dtype=object),
+        }
+        if not n or self.tree is None:
+            return result
+
+        # only the stream cells actually inside the snap distance, flattened:
+        # candidate i belongs to outfall owner[i]
+        found = self.tree.query_ball_point(pts, r=max_dist)
+        counts = np.fromiter((len(c) for c in found), dtype=np.int64, count=n)
+        if not counts.any():
+            return result
+        idx = np.fromiter((i for c in found for i in c), dtype=np.int64, count=counts.sum())
+        owner = np.repeat(np.arange(n), counts)
+        dist = np.hypot(*(self.xy[idx] - pts[owner]).T)
+        cell = self.cells[idx]
+
+        # rank candidates per outfall: best score first, then row-major cell order
+        if self.weight is None:
+            score = dist
+            close = lambda best: score - best <= tolerance * self.cellsize
+        else:
+            score = -self.weight[idx]
+            close = lambda best: score - best <= tolerance * np.abs(best)
+        order = np.lexsort((cell, score, owner))
+        idx, owner, dist, cell, score = idx[order], owner[order], dist[order], cell[order], score[order]
+        first = np.concatenate(([0], np.cumsum(counts)[:-1]))[counts > 0]
+        snapped = owner[first]
+
+        # a rival is a candidate off the chosen cell's 3x3 block that scores about as well
+        best = np.empty(n, dtype=np.int64)
+        best[snapped] = first
+        r0, c0 = np.divmod(cell[best[owner]], self.shape[1])
+        rr, cc = np.divmod(cell, self.shape[1])
+        apart = np.maximum(np.abs(rr - r0), np.abs(cc - c0)) > 1
+        rival = np.zeros(n, dtype=bool)
+        rival[owner[apart & close(score[best[owner]])]] = True
+
+        result['x'][snapped] = self.xy[idx[first], 0]
+        result['y'][snapped] = self.xy[idx[first], 1]
+        result['row'][snapped], result['col'][snapped] = np.divmod(cell[first], self.shape[1])
+        result['distance'][snapped] = dist[first]
+        result['status'][snapped] = SNAPPED
+        result['status'][snapped[rival[snapped]]] = AMBIGUOUS
+        return result
+
+
+def write_points(path, result, projection, driver='ESRI Shapefile'):
+    """
+    Write the snapped points with an `outfall` id (1.. in input order),
+    the snap distance and the snap status.
+    """
+    from osgeo import ogr, osr
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(projection)
+
+    drv = ogr.GetDriverByName(driver)
+    if os.path.exists(path):
+        drv.DeleteDataSource(path)
+    ds = drv.CreateDataSource(path)
+    layer = ds.CreateLayer('snapped_outfall', srs, ogr.wkbPoint)
+    layer.CreateField(ogr.FieldDefn('outfall', ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn('snap_dist', ogr.OFTReal))
+    status_field = ogr.FieldDefn('status', ogr.OFTString)
+    status_field.SetWidth(12)
+    layer.CreateField(status_field)
+
+    for i in range(len(result['x'])):
+        feat = ogr.Feature(layer.GetLayerDefn())
+        feat.SetField('outfall', i + 1)
+        if np.isfinite(result['distance'][i]):
+            feat.SetField('snap_dist', float(result['distance'][i]))
+        feat.SetField('status', result['status'][i])
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(float(result['x'][i]), float(result['y'][i]))
+        feat.SetGeometry(point)
+        layer.CreateFeature(feat)
+        feat = None
+    ds = None
+    return path
+
+
+def report_lines(result, x, y):
+    """
+    Rows for a snap report: outfall id, original and snapped coordinates,
+    snap distance and status.
+    """
+    rows = [['outfall', 'x', 'y', 'snapped_x', 'snapped_y', 'snap_dist', 'status']]
+    for i in range(len(result['x'])):
+        rows.append([i + 1, x[i], y[i], result['x'][i], result['y'][i], result['distance'][i], result['status'][i]])
+    return rows
+
+
+def write_report(path, result, x, y):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(report_lines(result, x, y))
+    return path
+
+
+def summary(result):
+    """
+    One line with the snap counts and the largest snap distance.
+    """
+    status = result['status']
+    dist = result['distance']
+    largest = np.nanmax(dist) if np.isfinite(dist).any() else 0.0
+    return (f"Snapped {np.sum(status == SNAPPED)} outfalls, "
+            f"{np.sum(status == AMBIGUOUS)} ambiguous, "
+            f"{np.sum(status == NOT_SNAPPED)} not snapped; "
+            f"largest snap distance {largest:.2f}")
+
+
+def snap_outfalls(streams_path, x, y, max_dist, accumulation_path=None, output=None, report=None):
+    """
+    Snap the outfalls (x, y) to the stream cells of the raster at `streams_path`,
+    preferring high flow accumulation when `accumulation_path` is given.
+    Optionally writes the snapped points to `output` and the snap report CSV
+    to `report`. Returns the snap result (see PourPointSnapper.snap).
+    """
+    streams, geotransform, projection, nodata = hydro_numpy.read_raster(streams_path)
+    accumulation = hydro_numpy.read_raster(accumulation_path)[0] if accumulation_path else None
+    result = PourPointSnapper(streams, geotransform, accumulation, nodata).snap(x, y, max_dist)
+    if output:
+        write_points(output, result, projection)
+    if report:
+        write_report(report, result, x, y)
+    return result
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+
+import ras_hdf
+
+
+# the catalog is kept next to the plans it describes, unless a catalog
+# folder is given (catalog_dir, or the RAS_CATALOG_DIR environment variable):
+# a SQLite file inside a synced (OneDrive, Dropbox) or network project folder
+# gets uploaded mid-write, locked and duplicated as conflicted copies
+CATALOG_NAME = 'ras_catalog.sqlite'
+CATALOG_DIR = os.environ.get('RAS_CATALOG_DIR') or None
+
+FIELDS = ['short_id', 'flow_title', 'stations', 'flow_shape', 'wse_shape', 'has_results', 'error']
+JSON_FIELDS = {'stations', 'flow_shape', 'wse_shape'}
+
+
+class PlanCatalog:
+    """
+    Metadata of every plan HDF in a RAS folder (see ras_hdf.read_plan_info),
+    kept in a small SQLite file keyed by path, mtime and size. A plan is only
+    opened when it is new or has changed since the last scan, so reopening a
+    project costs one stat per plan.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS plans ('
+            'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+            'short_id TEXT, flow_title TEXT, stations TEXT, flow_shape TEXT, '
+            'wse_shape TEXT, has_results INTEGER, error TEXT)'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _row_to_info(self, path, row):
+        info = {'path': path}
+        for name, value in zip(FIELDS, row):
+            info[name] = json.loads(value) if name in JSON_FIELDS and value is not None else value
+        info['has_results'] = bool(info['has_results'])
+        return info
+
+    def _cached(self, path, stat):
+        row = self.db.execute(
+            f'SELECT {", ".join(FIELDS)} FROM plans WHERE path = ? AND mtime_ns = ? AND size = ?',
+            (path, stat.st_mtime_ns, stat.st_size)
+        ).fetchone()
+        return None if row is None else self._row_to_info(path, row)
+
+    def _store(self, path, stat, info):
+        info['path'] = path
+        if info['error'] is not None:
+            # unreadable is usually transient (RAS still writing or holding
+            # the file), so it is tried again next time rather than cached
+            return info
+        self.db.execute(
+            f'INSERT OR REPLACE INTO plans VALUES (?, ?, ?, {", ".join("?" * len(FIELDS))})',
+            [path, stat.st_mtime_ns, stat.st_size]
+            + [json.dumps(info[name]) if name in JSON_FIELDS and info[name] is not None else info[name]
+               for name in FIELDS]
+        )
+        return info
+
+    def plan(self, path, stat=None):
+        """
+        Metadata of one plan, read from the HDF only if the cached entry is
+        missing or stale.
+        """
+        path = os.path.abspath(path)
+        stat = stat or os.stat(path)
+        info = self._cached(path, stat)
+        return info if info is not None else self._store(path, stat, ras_hdf.read_plan_info(path))
+
+    def scan(self, folder, pool=None):
+        """
+        Metadata of every `*.p*.hdf` plan in `folder`, in plan file order.
+        New and changed plans are opened on `pool` (an executor) when given;
+        the catalog itself is only touched from the calling thread. Entries
+        of plans no longer in the folder are dropped.
+        """
+        entries = [(os.path.abspath(entry.path), entry.stat()) for entry in ras_hdf.plan_entries(folder)]
+        infos = [self._cached(path, stat) for path, stat in entries]
+        missing = [i for i, info in enumerate(infos) if info is None]
+        paths = [entries[i][0] for i in missing]
+        read = pool.map(ras_hdf.read_plan_info, paths) if pool is not None else map(ras_hdf.read_plan_info, paths)
+        for i, info in zip(missing, read):
+            infos[i] = self._store(*entries[i], info)
+        present = {info['path'] for info in infos}
+        prefix = os.path.join(os.path.abspath(folder), '')
+        stale = [path for (path,) in self.db.execute('SELECT path FROM plans')
+                 if path.startswith(prefix) and path not in present]
+        self.db.executemany('DELETE FROM plans WHERE path = ?', [(path,) for path in stale])
+        self.db.commit()
+        return infos
+
+
+def _writable(catalog):
+    # rewrite the header with its own value: fails at once on a read-only
+    # file or folder, and after the busy timeout on a catalog locked elsewhere
+    version = catalog.db.execute('PRAGMA user_version').fetchone()[0]
+    catalog.db.execute(f'PRAGMA user_version = {int(version)}')
+
+
+def catalog_path(folder, catalog_dir=None):
+    """
+    Catalog file of a RAS folder: next to its plans, or in `catalog_dir`
+    (default CATALOG_DIR) under a name derived from the folder path.
+    """
+    catalog_dir = catalog_dir or CATALOG_DIR
+    if catalog_dir is None:
+        return os.path.join(folder, CATALOG_NAME)
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(folder)).encode('utf-8')).hexdigest()[:16]
+    os.makedirs(catalog_dir, exist_ok=True)
+    return os.path.join(catalog_dir, f'ras_catalog_{key}.sqlite')
+
+
+def open_catalog(folder, catalog_dir=None):
+    """
+    The catalog of a RAS folder (see catalog_path), or an in-memory one if
+    the catalog folder or an existing catalog file can't be written to, or
+    the catalog is locked.
+    """
+    catalog = None
+    try:
+        catalog = PlanCatalog(catalog_path(folder, catalog_dir))
+        _writable(catalog)
+        return catalog
+    except (OSError, sqlite3.Error):
+        if catalog is not None:
+            catalog.close()
+        return PlanCatalog()
+
+
+def scan(folder, catalog_dir=None, pool=None):
+    """
+    Plan metadata of a RAS folder through its catalog, the changed plans
+    opened on `pool` if given (see PlanCatalog.scan). A catalog that stops
+    taking writes mid-scan (locked by another process, disk full) is dropped
+    and the folder scanned with an in-memory one.
+    """
+    try:
+        with open_catalog(folder, catalog_dir) as catalog:
+            return catalog.scan(folder, pool)
+    except sqlite3.Error:
+        with PlanCatalog() as catalog:
+            return catalog.scan(folder, pool)
+
+
+if __name__ == '__main__':
+    # python ras_catalog.py <ras folder>   (RAS_CATALOG_DIR moves the catalog out of it)
+    if len(sys.argv) != 2:
+        sys.exit('usage: python ras_catalog.py <ras folder>')
+    for info in scan(sys.argv[1]):
+        status = 'ok' if info['has_results'] else (info['error'] or 'no reference line results')
+        print(f"{os.path.basename(info['path'])}\t{info['short_id']}\t{info['flow_title']}\t"
+              f"{len(info['stations'])} lines\t{status}")
@@ -0,0 +1,115 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+import ras_hdf
+import ras_catalog
+
+
+# reference line series written per plan, by column name
+SERIES = {'flow': ras_hdf.FLOW_PATH, 'velocity': ras_hdf.VELOCITY_PATH, 'wse': ras_hdf.WSE_PATH}
+
+# rows per Parquet row group; a group holds whole stations, so a query on a
+# few stations only reads their groups
+ROW_GROUP_ROWS = 1_000_000
+COMPRESSION = 'zstd'
+
+
+def hydrograph_blocks(f, stations, rows=ROW_GROUP_ROWS):
+    """
+    The reference line series of an open plan HDF in long form (station,
+    time, flow, velocity, wse), a block of whole stations at a time, sorted
+    by station then time. Series missing from the plan are left out. Yields
+    dicts of column arrays.
+    """
+    times = ras_hdf.read_time_stamps(f)
+    series = {name: f[path] for name, path in SERIES.items() if path in f}
+    step = max(rows // max(len(times), 1), 1)
+    names = np.asarray(stations, dtype=object)
+    for c0 in range(0, len(stations), step):
+        c1 = min(c0 + step, len(stations))
+        block = {
+            'station': np.repeat(names[c0:c1], len(times)),
+            'time': np.tile(times, c1 - c0),
+        }
+        for name, dataset in series.items():
+            # (time, station) -> station-major
+            block[name] = np.asarray(dataset[:, c0:c1], dtype=np.float32).T.ravel()
+        yield block
+
+
+def export_plan(plan_file, store, compression=COMPRESSION):
+    """
+    Write the hydrographs of one plan to `store`/plan=<ShortID>/<file>.parquet
+    (hive partitioned by plan). Returns the path written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    info = ras_hdf.read_plan_info(plan_file)
+    folder = os.path.join(store, f"plan={info['short_id']}")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, os.path.basename(plan_file) + '.parquet')
+
+    writer = None
+    with h5py.File(plan_file, 'r') as f:
+        for block in hydrograph_blocks(f, info['stations']):
+            table = pa.table({
+                'station': pa.array(block.pop('station')).dictionary_encode(),
+                'time': pa.array(block.pop('time')),
+                'flow_title': pa.array([info['flow_title']] * len(block['flow'])).dictionary_encode(),
+                **block,
+            })
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=compression)
+            writer.write_table(table, row_group_size=len(table))
+    if writer is not None:
+        writer.close()
+    return path
+
+
+def export_folder(folder, store, max_workers=None, compression=COMPRESSION):
+    """
+    Export every plan with reference line results in a RAS folder, one
+    process per plan. Returns the paths written, in plan order.
+    """
+    plans = [info['path'] for info in ras_catalog.scan(folder) if info['has_results']]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(export_plan, plans, [store] * len(plans), [compression] * len(plans)))
+
+
+def read_hydrographs(store, plans=None, stations=None, start=None, end=None, columns=None):
+    """
+    Query an exported store into a DataFrame. Only the partitions of
+    `plans` and the row groups holding `stations` are read; `start`/`end`
+    bound the time.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([('plan', pa.string())]), flavor='hive')
+    dataset = ds.dataset(store, format='parquet', partitioning=partitioning)
+    conditions = []
+    if plans is not None:
+        conditions.append(ds.field('plan').isin(list(plans)))
+    if stations is not None:
+        conditions.append(ds.field('station').isin(list(stations)))
+    if start is not None:
+        conditions.append(ds.field('time') >= pa.scalar(np.datetime64(start, 'ns')))
+    if end is not None:
+        conditions.append(ds.field('time') <= pa.scalar(np.datetime64(end, 'ns')))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+if __name__ == '__main__':
+    # python ras_export.py <ras folder> <output store>
+    if len(sys.argv) != 3:
+        sys.exit('usage: python ras_export.py <ras folder> <output store>')
+    for path in export_folder(sys.argv[1], sys.argv[2]):
+        print(path)
@@ -0,0 +1,369 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import tkinter as tk
+from tkinter import filedialog, ttk, messagebox
+
+import ras_hdf
+
+
+# The Tk window of ras_flow_extract_2. Kept out of the launcher so the plan
+# worker processes, which re-import the launcher, don't import Tk, pandas
+# or geopandas; those are imported where they are used.
+logger = logging.getLogger(__name__)
+
+# plans are read by this many worker processes; each holds one plan's
+# reference line series in memory at a time
+PLAN_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+POLL_MS = 100  # how often the Tk loop checks on the workers
+
+class ExtractFlowApp(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("Extract Flow")
+
+        # ——— State ———
+        self.selected_folder = None
+        self.selected_ref_lineshp_file = None
+        self.selected_terrain_file = None
+        self.selected_field = None
+
+        # ——— UI ———
+        # RAS Folder
+        frame = tk.Frame(self); frame.pack(fill="x", padx=10, pady=5)
+        self.folder_label = tk.Label(frame, text="Select RAS Folder:")
+        self.folder_label.pack(side="left")
+        tk.Button(frame, text="...", width=3, command=self.select_ras_folder)\
+          .pack(side="left", padx=(5,0))
+        
+        # Terrain
+        frame = tk.Frame(self); frame.pack(fill="x", padx=10, pady=5)
+        self.terrain_label = tk.Label(frame, text="Select Terrain:")
+        self.terrain_label.pack(side="left")
+        tk.Button(frame, text="...", width=3, command=self.select_terrain_file)\
+          .pack(side="left", padx=(5,0))
+
+        # Profile Line
+        frame = tk.Frame(self); frame.pack(fill="x", padx=10, pady=5)
+        self.ref_label = tk.Label(frame, text="Select Profile Line:")
+        self.ref_label.pack(side="left")
+        tk.Button(frame, text="...", width=3, command=self.select_ref_lineshp_file)\
+          .pack(side="left", padx=(5,0))
+        
+        # Combobox
+        frame = tk.Frame(self); frame.pack(fill="x", padx=10, pady=5)
+        tk.Label(frame, text="Select Field Column:").pack(side="left")
+        self.combobox = ttk.Combobox(frame, state="readonly")
+        self.combobox.pack(side="left", fill="x", expand=True, padx=(5,0))
+        self.combobox.bind("<<ComboboxSelected>>", self.on_combobox_change)      
+
+        # Design values for the hours-above columns (optional)
+        frame = tk.Frame(self); frame.pack(fill="x", padx=10, pady=5)
+        tk.Label(frame, text="Design Discharge:").pack(side="left")
+        self.design_flow_entry = tk.Entry(frame, width=10)
+        self.design_flow_entry.pack(side="left", padx=(5,10))
+        tk.Label(frame, text="Design WSE:").pack(side="left")
+        self.design_wse_entry = tk.Entry(frame, width=10)
+        self.design_wse_entry.pack(side="left", padx=(5,0))
+
+        # Compute & Progress
+        self.compute_button = tk.Button(self, text="Compute", command=self.output_flow)
+        self.compute_button.pack(pady=(10,0))
+        self.progress_bar = ttk.Progressbar(self, orient="horizontal",
+                                            length=300, mode="determinate")
+        self.progress_bar.pack_forget()
+
+        # Exit
+        self.exit_button = tk.Button(self, text="Exit", command=self.exit_app)
+        self.exit_button.pack(pady=(5,10))
+
+
+    # ——— File dialogs ———
+    def select_ras_folder(self):
+        folder = filedialog.askdirectory(title="Select RAS Folder")
+        if not folder:
+            return
+
+        self.selected_folder = folder
+        self.folder_label.config(text=f"Selected RAS Folder: {folder}")
+
+        # — configure logging into that folder —
+        log_path = os.path.join(folder, 'log_file.txt')
+
+        # remove any old FileHandlers so we don't double‐log
+        for h in list(logger.handlers):
+            if isinstance(h, logging.FileHandler):
+                logger.removeHandler(h)
+
+        # add a new FileHandler
+        fh = logging.FileHandler(log_path, mode='a')
+        fh.setLevel(logging.INFO)
+        fh.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s'
+        ))
+        logger.addHandler(fh)
+        logger.info("Logging initialized in %s", log_path)
+
+
+    def select_ref_lineshp_file(self):
+        shp = filedialog.askopenfilename(
+            title="Select Profile Line",
+            filetypes=[("Shapefiles", "*.shp")]
+        )
+        if not shp:
+            return
+
+        self.selected_ref_lineshp_file = shp
+        self.ref_label.config(text=os.path.basename(shp))
+
+        # load & cache GDF in both CRS’s
+        import geopandas as gpd
+        self._gdf_orig  = gpd.read_file(shp)
+
+        # populate combobox from the in-memory GDF
+        fields = list(self._gdf_orig.columns)
+        self.combobox['values'] = fields
+        if fields:
+            self.combobox.current(0)
+            self.selected_field = fields[0]
+
+    def select_terrain_file(self):
+        raster = filedialog.askopenfilename(
+            title="Select Terrain",
+            filetypes=[("Rasters", "*.vrt *.tiff *.tif")]
+        )
+        if raster:
+            self.selected_terrain_file = raster
+            self.terrain_label.config(text=os.path.basename(raster))
+
+    # ——— Combobox ———
+    def populate_combobox(self):
+        fields = list(self._gdf_orig.columns)
+        self.combobox['values'] = fields
+        if fields:
+            self.combobox.current(0)
+            self.selected_field = fields[0]
+
+    def on_combobox_change(self, event):
+        self.selected_field = self.combobox.get()
+
+    # ——— Flow Extraction ———
+    def get_values(self, station, plan_shortID):
+        """
+        Returns (min_terrain, max_velocity, max_froude) along the reference
+        line; see ras_lines.LineSampler.
+        """
+        return self._sampler.get_values(station, plan_shortID)
+
+    def flow_extract(self, plan_file):
+        """
+        Read just the discharge and water‐surface series from the HDF
+        and return a small DataFrame of per‐station maxima.
+        If the Reference Lines path is missing, returns None.
+        """
+        _, df, reason = ras_hdf.extract_plan(plan_file)
+        if df is None:
+            logger.warning("Skipping %s: %s", os.path.basename(plan_file), reason)
+        return df
+
+
+    def _reset_ui(self):
+        self.progress_bar.pack_forget()
+        self.compute_button.pack()
+
+    def _design_value(self, entry):
+        # blank → None (no hours-above column)
+        text = entry.get().strip()
+        return float(text) if text else None
+
+    def output_flow(self):
+        # hide button, show progress
+        self.compute_button.pack_forget()
+        self.progress_bar.pack()
+        self.progress_bar['value'] = 0
+        self.update_idletasks()
+
+        if not self.selected_folder:
+            messagebox.showwarning("No Folder", "Please select a RAS folder first.")
+            self._reset_ui()
+            return
+        if not (self.selected_ref_lineshp_file and self.selected_terrain_file):
+            messagebox.showwarning("Missing Inputs", "Please select a profile line and a terrain first.")
+            self._reset_ui()
+            return
+
+        # — Ask user where/how to save —
+        save_csv = filedialog.asksaveasfilename(
+            title="Save summary CSV as…",
+            initialdir=self.selected_folder,
+            defaultextension=".csv",
+            filetypes=[("CSV files","*.csv")]
+        )
+        if not save_csv:
+            # user cancelled
+            self._reset_ui()
+            return
+        self._save_csv = save_csv
+
+        try:
+            design_flow = self._design_value(self.design_flow_entry)
+            design_wse = self._design_value(self.design_wse_entry)
+        except ValueError:
+            messagebox.showwarning("Design Values", "Design Discharge and WSE must be numbers.")
+            self._reset_ui()
+            return
+
+        self.progress_bar['value'] = 5
+        self.update_idletasks()
+
+        # the folder's catalog and the line sampler are read on a thread: a
+        # first scan opens every plan, and the window has to stay responsive
+        self._design = (design_flow, design_wse)
+        self._scan_result = None
+        threading.Thread(target=self._scan_plans, daemon=True).start()
+        self.after(POLL_MS, self._poll_scan)
+
+    def _scan_plans(self):
+        # worker thread: no Tk calls in here
+        # gather plans from the folder's catalog, which only opens plans that
+        # are new or changed; plans without reference line results are
+        # skipped without being read again
+        import ras_catalog
+        import ras_lines
+        try:
+            plans = ras_catalog.scan(self.selected_folder)
+            plan_paths = {info['short_id']: info['path'] for info in plans if info['has_results']}
+            sampler = ras_lines.LineSampler(self.selected_folder, self._gdf_orig, self.selected_field,
+                                            self.selected_terrain_file, plan_paths)
+            self._scan_result = (plans, sampler)
+        except Exception as e:
+            logger.exception("Error scanning %s", self.selected_folder)
+            self._scan_result = e
+
+    def _poll_scan(self):
+        if self._scan_result is None:
+            self.after(POLL_MS, self._poll_scan)
+            return
+        if isinstance(self._scan_result, Exception):
+            messagebox.showerror("Error", f"Scanning the RAS folder failed: {self._scan_result}")
+            self._reset_ui()
+            return
+        self._plans, self._sampler = self._scan_result
+        self._queued = [info['path'] for info in self._plans if info['has_results']]
+        self._skip_records = []
+        for info in self._plans:
+            if not info['has_results']:
+                logger.warning("Skipping %s: %s", os.path.basename(info['path']),
+                               info['error'] or "no Reference Lines results")
+                self._skip_records.append((info['short_id'] or 'Unknown', os.path.basename(info['path'])))
+
+        # each plan is read by a worker process and the results are polled
+        # from the Tk loop, so the window stays responsive
+        design_flow, design_wse = self._design
+        self._executor = ProcessPoolExecutor(max_workers=min(PLAN_WORKERS, max(len(self._queued), 1)))
+        self._futures = [self._executor.submit(ras_hdf.extract_plan, plan, design_flow, design_wse)
+                         for plan in self._queued]
+        self.after(POLL_MS, self._poll_plans)
+
+    def _poll_plans(self):
+        done = sum(future.done() for future in self._futures)
+        self.progress_bar['value'] = 5 + 50 * done / max(len(self._futures), 1)
+        if done < len(self._futures):
+            self.after(POLL_MS, self._poll_plans)
+            return
+        self._executor.shutdown()
+
+        # merge in plan order, whatever order the workers finished in
+        dfs = []
+        skip_records = self._skip_records
+        for plan, future in zip(self._queued, self._futures):
+            try:
+                plan_shortID, df, reason = future.result()
+            except Exception:
+                logger.exception("Error extracting %s", plan)
+                plan_shortID, df, reason = 'Unknown', None, 'worker failed'
+            if df is None:
+                logger.warning("Skipping %s: %s", os.path.basename(plan), reason)
+                skip_records.append((plan_shortID, os.path.basename(plan)))
+                continue
+            dfs.append(df)
+
+        if not dfs:
+            messagebox.showinfo(
+                "Nothing to do",
+                "No valid HDF files found with Reference Lines."
+            )
+            self._reset_ui()
+            return
+
+        # terrain / velocity / froude sampling runs on a thread for the same reason
+        self._processed = len(dfs)
+        self._metrics_done = 0
+        self._metrics_total = 1
+        self._metrics_result = None
+        threading.Thread(target=self._compute_metrics, args=(dfs,), daemon=True).start()
+        self.after(POLL_MS, self._poll_metrics)
+
+    def _compute_metrics(self, dfs):
+        # worker thread: no Tk calls in here
+        import pandas as pd
+        import ras_postprocess
+        try:
+            df_all = pd.concat(dfs, ignore_index=True)
+            self._metrics_total = max(len(df_all[['Plan ShortID','Station']].drop_duplicates()), 1)
+
+            def progress():
+                self._metrics_done += 1
+
+            self._metrics_result = ras_postprocess.line_metrics(df_all, self.get_values, progress)
+        except Exception as e:
+            logger.exception("Error computing line metrics")
+            self._metrics_result = e
+
+    def _poll_metrics(self):
+        self.progress_bar['value'] = 55 + 40 * self._metrics_done / self._metrics_total
+        if self._metrics_result is None:
+            self.after(POLL_MS, self._poll_metrics)
+            return
+        if isinstance(self._metrics_result, Exception):
+            messagebox.showerror("Error", f"Computing the line metrics failed: {self._metrics_result}")
+            self._reset_ui()
+            return
+        self._finish(self._metrics_result)
+
+    def _finish(self, df_merged):
+        save_csv = self._save_csv
+        save_html = os.path.splitext(save_csv)[0] + ".html"
+        total_plans = len(self._plans)
+        processed = self._processed
+        skip_records = self._skip_records
+        skipped = len(skip_records)
+
+        # Flow Area, EGL, rounding and natural station order
+        import ras_postprocess
+        df_merged = ras_postprocess.postprocess(df_merged)
+
+        df_merged.to_csv(save_csv, index=False)
+        df_merged.to_html(save_html, index=False)
+
+        # finish UI
+        self.progress_bar['value'] = 100
+        self.update_idletasks()
+        self._reset_ui()
+
+        # — Final summary with skipped details —
+        summary = (f"Processed {processed} of {total_plans} plans "
+                f"(skipped {skipped}).\n\n")
+        if skip_records:
+            summary += "Skipped Plans (ShortID – file):\n"
+            summary += "\n".join(f"• {pid}  –  {fname}"
+                                for pid, fname in skip_records)
+
+        messagebox.showinfo("Done!", summary)
+
+    # ——— Exit ———
+    def exit_app(self):
+        # properly destroy the window and end mainloop
+        self.destroy()
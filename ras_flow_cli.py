@@ -0,0 +1,174 @@
+"""
+Headless RAS flow extraction: the same summary as ras_flow_extract_2, run
+from arguments or a JSON config file.
+
+    python ras_flow_cli.py <ras folder> -o summary.csv [--lines lines.shp
+        --field NAME --terrain terrain.tif] [--design-flow Q] [--design-wse Z]
+        [--html] [--workers N] [--export-hydrographs STORE]
+        [--incremental | --watch [--interval S]] [--catalog-dir DIR]
+    python ras_flow_cli.py --config job.json
+
+Config keys are the long option names with underscores (ras_folder,
+output, lines, field, terrain, design_flow, design_wse, html, workers,
+export_hydrographs, incremental, watch, interval, catalog_dir); options
+given on the command line win. Only argparse and json are imported up
+front; h5py, pandas, geopandas and rasterio are imported by the steps that
+need them.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+
+logger = logging.getLogger('ras_flow_cli')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Extract peak flows per reference line from HEC-RAS plan HDFs.')
+    parser.add_argument('ras_folder', nargs='?', help='folder with the *.p##.hdf plans')
+    parser.add_argument('-o', '--output', help='summary CSV to write')
+    parser.add_argument('-c', '--config', help='JSON file with any of the options below')
+    parser.add_argument('--lines', help='reference line vector file, for thalweg / velocity / Froude')
+    parser.add_argument('--field', help='field of --lines with the station names')
+    parser.add_argument('--terrain', help='terrain raster sampled along the lines')
+    parser.add_argument('--design-flow', type=float, help='design discharge for the hours-above column')
+    parser.add_argument('--design-wse', type=float, help='design WSE for the hours-above column')
+    parser.add_argument('--html', action='store_true', default=None, help='also write an HTML table next to the CSV')
+    parser.add_argument('--workers', type=int, help='plan extraction processes')
+    parser.add_argument('--export-hydrographs', metavar='STORE', help='also write the full hydrographs to a Parquet store')
+    parser.add_argument('--incremental', action='store_true', default=None,
+                        help='only extract plans that are new or changed since the last run into --output')
+    parser.add_argument('--watch', action='store_true', default=None,
+                        help='keep polling the folder and add each plan once it has finished computing')
+    parser.add_argument('--interval', type=float, help='seconds between polls in --watch mode (default 30)')
+    parser.add_argument('--catalog-dir', help='keep the plan catalog here instead of in the RAS folder '
+                                              '(for synced or network folders; default $RAS_CATALOG_DIR)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only log warnings')
+    args = parser.parse_args(argv)
+
+    # fill what the command line left out from the config file
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = set(config) - set(vars(args))
+        if unknown:
+            parser.error(f"unknown config keys: {', '.join(sorted(unknown))}")
+        for key, value in config.items():
+            if getattr(args, key) is None:
+                setattr(args, key, value)
+
+    if not args.ras_folder or not args.output:
+        parser.error('a RAS folder and --output are required (on the command line or in --config)')
+    if args.lines and not (args.field and args.terrain):
+        parser.error('--lines needs --field and --terrain')
+    return args
+
+
+def extract_plans(args, plans):
+    """
+    Extract catalog `plans` (infos with results) for parsed `args`; returns
+    (DataFrame with line metrics if --lines, or None, [(plan ShortID,
+    file, reason) skipped]). Rows are not post-processed yet.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import pandas as pd
+    import ras_hdf
+    import ras_postprocess
+
+    dfs = []
+    skipped = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        paths = [info['path'] for info in plans]
+        results = pool.map(ras_hdf.extract_plan, paths,
+                           [args.design_flow] * len(paths), [args.design_wse] * len(paths))
+        # map keeps plan order, so the merge is deterministic
+        for path, (plan_shortID, df, reason) in zip(paths, results):
+            if df is None:
+                skipped.append((plan_shortID, os.path.basename(path), reason))
+                continue
+            logger.info('Extracted %s (%s)', os.path.basename(path), plan_shortID)
+            dfs.append(df)
+    if not dfs:
+        return None, skipped
+
+    df = pd.concat(dfs, ignore_index=True)
+    if args.lines:
+        import ras_lines
+        plan_paths = {info['short_id']: info['path'] for info in plans}
+        sampler = ras_lines.LineSampler(args.ras_folder, args.lines, args.field, args.terrain, plan_paths)
+        df = ras_postprocess.line_metrics(df, sampler.get_values)
+    return df, skipped
+
+
+def extract(args):
+    """
+    Run the extraction for parsed `args` over every plan; returns (summary
+    DataFrame or None, [(plan ShortID, file, reason) skipped]).
+    """
+    import ras_catalog
+    import ras_postprocess
+
+    plans = ras_catalog.scan(args.ras_folder, args.catalog_dir)
+    queued = [info for info in plans if info['has_results']]
+    skipped = [(info['short_id'] or 'Unknown', os.path.basename(info['path']),
+                info['error'] or 'no Reference Lines results')
+               for info in plans if not info['has_results']]
+    logger.info('%d plans, %d with reference line results', len(plans), len(queued))
+
+    df, failed = extract_plans(args, queued)
+    skipped.extend(failed)
+    return (ras_postprocess.postprocess(df) if df is not None else None), skipped
+
+
+def incremental_summary(args):
+    # the summary CSV updated plan by plan (--incremental, --watch)
+    import ras_watch
+    import ras_postprocess
+    return ras_watch.IncrementalSummary(args.output, lambda plans: extract_plans(args, plans),
+                                        ras_postprocess.postprocess, bool(args.html))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    if args.watch:
+        import ras_watch
+        ras_watch.watch(args.ras_folder, incremental_summary(args), args.interval or ras_watch.WATCH_INTERVAL,
+                        catalog_dir=args.catalog_dir)
+        return 0
+
+    if args.incremental:
+        import ras_catalog
+        summary = incremental_summary(args)
+        pending = summary.pending(ras_catalog.scan(args.ras_folder, args.catalog_dir))
+        logger.info('%d new or changed plans', len(pending))
+        skipped = summary.update(pending) if pending else []
+        for plan_shortID, name, reason in skipped:
+            logger.warning('Skipped %s (%s): %s', name, plan_shortID, reason)
+        return 0
+
+    summary, skipped = extract(args)
+    for plan_shortID, name, reason in skipped:
+        logger.warning('Skipped %s (%s): %s', name, plan_shortID, reason)
+    if summary is None:
+        logger.error('No valid HDF files found with Reference Lines in %s', args.ras_folder)
+        return 1
+
+    summary.to_csv(args.output, index=False)
+    if args.html:
+        summary.to_html(os.path.splitext(args.output)[0] + '.html', index=False)
+    logger.info('Wrote %d rows to %s', len(summary), args.output)
+
+    if args.export_hydrographs:
+        import ras_export
+        written = ras_export.export_folder(args.ras_folder, args.export_hydrographs, args.workers)
+        logger.info('Exported %d plan hydrographs to %s', len(written), args.export_hydrographs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
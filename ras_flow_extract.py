@@ -10,6 +10,8 @@ from glob import glob
 from shapely.geometry import LineString, Point
 from rasterio.sample import sample_gen
 
+import ras_hdf
+
 
 # Import PyQt5 Modules
 from PyQt5.QtWidgets import (
@@ -266,32 +268,32 @@ class Form(QDialog):
             ref_col_names = [x[0].decode('utf-8') for x in ref_names]
 
             # Get the max discharge per reference lines
+            # Each series is streamed chunk by chunk (ras_hdf.column_peaks),
+            # so no full-length array or temporary is held in memory
             ref_line_path = r'/Results/Unsteady/Output/Output Blocks/DSS Hydrograph Output/Unsteady Time Series/Reference Lines'
             ref_flow_array = f[ref_line_path]['Flow']
-            flow_max_values = np.max(ref_flow_array, axis=0)
-            ref_flow = flow_max_values.tolist()
+            ref_flow = ras_hdf.column_peaks(ref_flow_array)['max'].tolist()
 
             # Get the Max Velocity per Reference Lines
             ref_vel_array = f[ref_line_path]['Velocity']
-            vel_max_values = np.max(ref_vel_array, axis=0)
-            ref_velocity = vel_max_values.tolist()
+            vel_peaks = ras_hdf.column_peaks(ref_vel_array)
+            ref_velocity = vel_peaks['max'].tolist()
 
             # Compute the Max Flow Area
             # Given by the Eq. Q = A * V; A = Q / V
             with np.errstate(divide='ignore', invalid='ignore'):
-                ref_max_flow_area_array = np.divide(ref_flow_array, ref_vel_array)
-                ref_max_flow_area = np.nanmax(ref_max_flow_area_array, axis=0).tolist()
+                ref_max_flow_area = ras_hdf.column_peaks(
+                    ref_flow_array, ref_vel_array, combine=np.divide)['max'].tolist()
 
             # Get the Max WSE
             ref_wse_array = f[ref_line_path]['Water Surface']
-            ref_wse = np.max(ref_wse_array, axis=0).tolist()
+            ref_wse = ras_hdf.column_peaks(ref_wse_array)['max'].tolist()
 
             # Compute the EGL
-            # Given by the equation: EGL = WSE + V^2 / 2g (g=9.81 m/s^2)
-            g = 9.81 * 2 
-            vel_head = np.power(ref_vel_array, 2) / g
-            egl_array = ref_wse + vel_head
-            ref_egl = np.max(egl_array, axis=0).tolist()
+            # Given by the equation: EGL = WSE + V^2 / 2g (g=9.81 m/s^2),
+            # the peak over time of WSE and V taken at the same step
+            ref_egl = ras_hdf.column_peaks(
+                ref_wse_array, ref_vel_array, combine=lambda w, v: w + v * v / (2 * 9.81))['max'].tolist()
 
             # Create a DataFrame
             df = pd.DataFrame({
@@ -0,0 +1,269 @@
+import os
+from fnmatch import fnmatch
+import h5py
+import numpy as np
+import pandas as pd
+
+
+# HEC-RAS plan HDF paths read by the flow extraction
+PLAN_INFO_PATH = '/Plan Data/Plan Information'
+REF_ATTR_PATH = '/Geometry/Reference Lines/Attributes'
+REF_SERIES_PATH = ('/Results/Unsteady/Output/Output Blocks/'
+                   'DSS Hydrograph Output/Unsteady Time Series/Reference Lines')
+FLOW_PATH = REF_SERIES_PATH + '/Flow'
+WSE_PATH = REF_SERIES_PATH + '/Water Surface'
+VELOCITY_PATH = REF_SERIES_PATH + '/Velocity'
+TIME_STAMP_PATH = REF_SERIES_PATH.rsplit('/', 1)[0] + '/Time Date Stamp'
+
+# blocks read at a time are sized to about this, in whole HDF5 chunks
+BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def plan_short_id(plan_file):
+    """
+    Plan ShortID of a plan HDF, or 'Unknown' if it can't be read.
+    """
+    try:
+        with h5py.File(plan_file, 'r') as f:
+            return f[PLAN_INFO_PATH].attrs['Plan ShortID'].decode('utf-8')
+    except Exception:
+        return 'Unknown'
+
+
+def read_plan_info(plan_file):
+    """
+    Metadata of a plan HDF from a single open: ShortID, Flow Title,
+    reference line names, the shapes of the reference line Flow and Water
+    Surface series and whether those results are present. A file that
+    can't be read gets its error recorded instead of raising.
+    """
+    info = {'short_id': None, 'flow_title': None, 'stations': [],
+            'flow_shape': None, 'wse_shape': None, 'has_results': False, 'error': None}
+    try:
+        with h5py.File(plan_file, 'r') as f:
+            attrs = f[PLAN_INFO_PATH].attrs
+            info['short_id'] = attrs['Plan ShortID'].decode('utf-8')
+            info['flow_title'] = attrs['Flow Title'].decode('utf-8')
+            if REF_ATTR_PATH in f:
+                info['stations'] = [x[0].decode('utf-8') for x in np.array(f[REF_ATTR_PATH])]
+            if FLOW_PATH in f:
+                info['flow_shape'] = list(f[FLOW_PATH].shape)
+            if WSE_PATH in f:
+                info['wse_shape'] = list(f[WSE_PATH].shape)
+    except (KeyError, OSError) as e:
+        info['error'] = str(e)
+    info['has_results'] = bool(info['stations'] and info['flow_shape'] and info['wse_shape'])
+    return info
+
+
+def read_time_stamps(f):
+    """
+    Time of every output step of an open plan HDF as datetime64. RAS
+    writes midnight as 24:00:00 of the day before.
+    """
+    raw = np.char.decode(np.asarray(f[TIME_STAMP_PATH]).ravel(), 'utf-8')
+    midnight = np.char.find(raw, ' 24:') >= 0
+    stamps = pd.to_datetime(np.char.replace(raw, ' 24:', ' 00:'), format='%d%b%Y %H:%M:%S').to_numpy().copy()
+    stamps[midnight] += np.timedelta64(1, 'D')
+    return stamps
+
+
+def blocks(dataset):
+    """
+    (rows, columns) slices covering a (time, column) dataset in whole HDF5
+    chunks, so every chunk is read and decompressed once, and about
+    BLOCK_BYTES per block whatever the chunk layout: a tile of columns is
+    swept from the first time step to the last before the next tile. With
+    time-major chunks (all steps of a few columns) a tile is only as many
+    columns as fit; a contiguous dataset is read a band of rows at a time.
+    """
+    rows, cols = dataset.shape
+    itemsize = dataset.dtype.itemsize
+    chunk_rows, chunk_cols = dataset.chunks or (1, cols)
+    chunk_cols = max(min(chunk_cols, cols), 1)
+    tile = min(max(BLOCK_BYTES // (chunk_rows * itemsize) // chunk_cols, 1) * chunk_cols, cols)
+    step = max(BLOCK_BYTES // (max(tile, 1) * itemsize) // chunk_rows, 1) * chunk_rows
+    for c0 in range(0, cols, tile or 1):
+        for r0 in range(0, rows, step):
+            yield slice(r0, min(r0 + step, rows)), slice(c0, min(c0 + tile, cols))
+
+
+class ColumnPeaks:
+    """
+    Running max, min and argmax (time step of the max) of every column,
+    fed one block (rows of a tile of columns) at a time. NaNs are ignored; a column that is all
+    NaN gets NaN and argmax -1. Ties keep the first time step, as np.argmax
+    on the whole series would.
+    """
+
+    def __init__(self, columns):
+        self.max = np.full(columns, -np.inf)
+        self.min = np.full(columns, np.inf)
+        self.argmax = np.full(columns, -1, dtype=np.int64)
+
+    def update(self, start, block, cols=slice(None)):
+        nan = np.isnan(block)
+        high = np.where(nan, -np.inf, block)
+        row = high.argmax(axis=0)
+        block_max = high[row, np.arange(block.shape[1])]
+        peak, argmax, low = self.max[cols], self.argmax[cols], self.min[cols]  # views
+        better = (block_max > peak) | ((argmax < 0) & ~nan.all(axis=0))
+        argmax[better] = start + row[better]
+        peak[better] = block_max[better]
+        np.minimum(low, np.where(nan, np.inf, block).min(axis=0), out=low)
+
+    def result(self):
+        empty = self.argmax < 0
+        return {'max': np.where(empty, np.nan, self.max),
+                'min': np.where(empty, np.nan, self.min),
+                'argmax': self.argmax}
+
+
+class ColumnIntegral:
+    """
+    Trapezoidal integral over time of every column, and the time each
+    column spends at or above `threshold` (scalar or one per column), fed
+    one block at a time, each tile of columns from its first row down.
+    `seconds` is the time of every row; the last row of a block is carried
+    into the next block of the tile so no interval is lost.
+    NaNs count as 0 and below the threshold.
+    """
+
+    def __init__(self, seconds, columns, threshold=None):
+        self.seconds = seconds
+        self.threshold = threshold
+        self.total = np.zeros(columns)
+        self.above = np.zeros(columns)
+        self.last = None
+
+    def update(self, start, block, cols=slice(None)):
+        block = np.nan_to_num(block)
+        stop = start + len(block)
+        if start > 0 and self.last is not None:
+            block = np.vstack([self.last, block])
+            start -= 1
+        self.last = block[-1:]
+        dt = np.diff(self.seconds[start:stop])[:, None]
+        self.total[cols] += ((block[1:] + block[:-1]) / 2 * dt).sum(axis=0)
+        if self.threshold is not None:
+            threshold = self.threshold[cols] if np.ndim(self.threshold) else self.threshold
+            at = (block >= threshold).astype(np.float64)
+            self.above[cols] += ((at[1:] + at[:-1]) / 2 * dt).sum(axis=0)
+
+    def result(self):
+        return {'total': self.total, 'above': self.above if self.threshold is not None else np.full_like(self.total, np.nan)}
+
+
+def reduce_columns(datasets, reducers, combine=None):
+    """
+    One pass over (time, column) datasets of the same shape, block by block
+    with blocks() so peak memory is one block rather than the whole
+    series. Every block, or `combine(*parts)` when given, is fed to each
+    of `reducers`.
+    """
+    for rows, cols in blocks(datasets[0]):
+        parts = [d[rows, cols] for d in datasets]
+        block = combine(*parts) if combine is not None else parts[0]
+        block = np.asarray(block, dtype=np.float64)
+        for reducer in reducers:
+            reducer.update(rows.start, block, cols)
+    return [reducer.result() for reducer in reducers]
+
+
+def column_peaks(*datasets, combine=None):
+    """
+    ColumnPeaks of one or more datasets read in step, e.g. np.divide of
+    flow and velocity for flow area. Returns {'max', 'min', 'argmax'}.
+    """
+    return reduce_columns(datasets, [ColumnPeaks(datasets[0].shape[1])], combine)[0]
+
+
+def hydrograph_metrics(f, stations, design_flow=None, design_wse=None):
+    """
+    Per reference line metrics of an open plan HDF from one chunked pass
+    over each of Flow and Water Surface, with the time stamps decoded once:
+    peak discharge (of |Q|) and its time, hydrograph volume (m3), hours at
+    or above `design_flow`, peak WSE and its time and hours at or above
+    `design_wse`. The design values are scalars or one per station; without
+    them the hours are NaN, as are the times when the plan has no time
+    stamps.
+    """
+    columns = len(stations)
+    if TIME_STAMP_PATH in f:
+        times = read_time_stamps(f)
+        seconds = (times - times[0]) / np.timedelta64(1, 's')
+    else:
+        times = None
+        seconds = np.arange(f[FLOW_PATH].shape[0], dtype=np.float64) * np.nan
+
+    flow_peaks, flow_sum = reduce_columns(
+        [f[FLOW_PATH]], [ColumnPeaks(columns), ColumnIntegral(seconds, columns, design_flow)], np.abs)
+    wse_peaks, wse_sum = reduce_columns(
+        [f[WSE_PATH]], [ColumnPeaks(columns), ColumnIntegral(seconds, columns, design_wse)])
+
+    def time_of(argmax):
+        if times is None:
+            return np.full(columns, np.datetime64('NaT', 's'))
+        return np.where(argmax >= 0, times[np.maximum(argmax, 0)], np.datetime64('NaT', 's'))
+
+    return pd.DataFrame({
+        'Station':                 stations,
+        'Discharge':               flow_peaks['max'],
+        'Time of Peak Discharge':  time_of(flow_peaks['argmax']),
+        'Volume':                  flow_sum['total'],
+        'Hours Above Design Q':    flow_sum['above'] / 3600.0,
+        'WSE':                     wse_peaks['max'],
+        'Time of Peak WSE':        time_of(wse_peaks['argmax']),
+        'Hours Above Design WSE':  wse_sum['above'] / 3600.0,
+    })
+
+
+def extract_plan(plan_file, design_flow=None, design_wse=None):
+    """
+    Per-station maxima of one plan: discharge and water surface at every
+    reference line, with the hydrograph metrics of hydrograph_metrics. Runs
+    in a worker process, so it only takes and returns plain, picklable data.
+
+    Returns (plan ShortID, DataFrame or None, reason the plan was skipped).
+    """
+    try:
+        with h5py.File(plan_file, 'r') as f:
+            # no reference lines -> skip
+            if REF_ATTR_PATH not in f:
+                raise KeyError(f"Missing HDF group {REF_ATTR_PATH!r}")
+
+            # plan metadata
+            info = f[PLAN_INFO_PATH]
+            plan_shortID = info.attrs['Plan ShortID'].decode('utf-8')
+            flow_id = info.attrs['Flow Title'].decode('utf-8')
+
+            # reference line station names
+            attrs = np.array(f[REF_ATTR_PATH])
+            stations = [x[0].decode('utf-8') for x in attrs]
+
+            # maxima and hydrograph metrics, streamed chunk by chunk
+            metrics = hydrograph_metrics(f, stations, design_flow, design_wse)
+
+    except (KeyError, OSError) as e:
+        return plan_short_id(plan_file), None, str(e)
+
+    metrics.insert(0, 'Plan ShortID', plan_shortID)
+    metrics.insert(2, 'Flow Scenario', flow_id)
+    return plan_shortID, metrics, None
+
+
+def plan_entries(folder):
+    """
+    os.DirEntry of every `*.p*.hdf` plan in a RAS folder, in a stable
+    order. One directory listing; on Windows the entries carry their stat
+    results, so no further call per file is needed.
+    """
+    with os.scandir(folder) as entries:
+        plans = [entry for entry in entries
+                 if not entry.name.startswith('.') and fnmatch(entry.name, '*.p*.hdf') and entry.is_file()]
+    return sorted(plans, key=lambda entry: entry.path)
+
+
+def plan_files(folder):
+    # plan HDFs of a RAS project folder, in a stable order
+    return [entry.path for entry in plan_entries(folder)]
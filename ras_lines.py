@@ -0,0 +1,115 @@
+import os
+import logging
+from glob import glob
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# reference lines are matched and sampled in this CRS
+LINE_CRS = 'EPSG:32651'
+
+
+def sample_along_line(raster_path, line, reducer, default=0.0):
+    """
+    Open `raster_path`, rasterize the `line` into it, then return
+    reducer(masked_array). On any error, return `default`.
+    `reducer` is a function like np.nanmin or np.nanmax.
+    """
+    import rasterio
+    from rasterio.features import rasterize
+    from rasterio.warp import transform_geom
+    from shapely.geometry import mapping
+    try:
+        with rasterio.open(raster_path) as src:
+            # reproject your line into the raster’s CRS
+            geom = transform_geom(LINE_CRS, src.crs, mapping(line))
+            mask = rasterize(
+                [(geom, 1)],
+                out_shape=(src.height, src.width),
+                transform=src.transform
+            )
+            data = src.read(1)
+            arr = np.where(mask == 1, data, np.nan)
+            return float(reducer(arr))
+    except Exception:
+        logger.exception("Error sampling raster %s for line %s", raster_path, line)
+        return default
+
+
+class LineSampler:
+    """
+    Terrain, velocity and Froude along the reference lines of a RAS folder:
+    the values get_values adds to the flow summary. `lines` is a vector
+    file or GeoDataFrame whose `field` holds the station names and
+    `plan_paths` maps Plan ShortID to plan HDF. geopandas and rasterio are
+    only imported once a sampler is made.
+    """
+
+    def __init__(self, folder, lines, field, terrain, plan_paths):
+        import geopandas as gpd
+        gdf = gpd.read_file(lines) if isinstance(lines, str) else lines
+        self.folder = folder
+        self.names = gdf[field]
+        self.lines = gdf.to_crs(LINE_CRS)
+        self.terrain = terrain
+        self.plan_paths = plan_paths
+        self.meshes = {}
+
+    def get_values(self, station, plan_shortID):
+        """
+        Returns (min_terrain, max_velocity, max_froude) along the reference line.
+        If the corresponding VRTs are missing, velocity and froude come from
+        the 2D cell maxima in the plan HDF (0 if the plan has none).
+        """
+        plan_folder = os.path.join(self.folder, plan_shortID)
+        row = self.lines[self.names == station]
+        if row.empty:
+            raise ValueError(f"Station {station!r} not found in shapefile.")
+        line = row.geometry.iloc[0]
+
+        # ——— Terrain (always expected) ———
+        min_terrain = sample_along_line(self.terrain, line, reducer=np.nanmin, default=np.nan)
+
+        # ——— Max Velocity ———
+        vel_paths = glob(os.path.join(plan_folder, 'Velocity (Max).vrt'))
+        fr_paths  = glob(os.path.join(plan_folder, 'Froude (Max).vrt'))
+        # without the RAS Mapper exports, read the 2D cell maxima from the plan
+        mesh_values = (self.mesh_values(line, plan_shortID)
+                       if not (vel_paths and fr_paths) else None)
+
+        max_velocity = (
+            sample_along_line(vel_paths[0], line, reducer=np.nanmax)
+            if vel_paths else mesh_values['max_velocity']
+        )
+
+        # ——— Max Froude ———
+        max_froude = (
+            sample_along_line(fr_paths[0], line, reducer=np.nanmax)
+            if fr_paths else mesh_values['max_froude']
+        )
+
+        return min_terrain, max_velocity, max_froude
+
+    def mesh_values(self, line, plan_shortID):
+        """
+        Line values from the plan's 2D mesh maxima (ras_mesh), loading each
+        plan's mesh once. Lines off the mesh, or plans without one, give 0.
+        """
+        import geopandas as gpd
+        import ras_mesh
+        if plan_shortID not in self.meshes:
+            plan_file = self.plan_paths.get(plan_shortID)
+            try:
+                self.meshes[plan_shortID] = ras_mesh.MeshMaxima.read(plan_file) if plan_file else None
+            except (KeyError, OSError):
+                logger.exception("Error reading 2D results from %s", plan_file)
+                self.meshes[plan_shortID] = None
+        mesh = self.meshes[plan_shortID]
+        if mesh is None or not len(mesh):
+            return {'max_velocity': 0.0, 'max_froude': 0.0}
+
+        if mesh.projection:
+            line = gpd.GeoSeries([line], crs=LINE_CRS).to_crs(mesh.projection).iloc[0]
+        values = mesh.line_values(np.asarray(line.coords)[:, :2])
+        return {key: (0.0 if np.isnan(value) else value) for key, value in values.items()}
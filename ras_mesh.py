@@ -0,0 +1,150 @@
+import sys
+import h5py
+import numpy as np
+from scipy.spatial import cKDTree
+
+from line_geometry import sample_lines
+
+
+# HEC-RAS plan HDF paths of the 2D flow area geometry and max results
+GEOMETRY_2D_PATH = '/Geometry/2D Flow Areas'
+SUMMARY_2D_PATH = '/Results/Unsteady/Output/Output Blocks/Base Output/Summary Output/2D Flow Areas'
+GRAVITY = 9.81
+
+
+def read_array(dataset):
+    """
+    The whole of an HDF5 dataset. Contiguous, unfiltered datasets are
+    memory-mapped straight from the file, so only the pages touched are
+    read; anything else (chunked, compressed) is read normally.
+    """
+    offset = dataset.id.get_offset() if dataset.chunks is None and not dataset.compression else None
+    if offset is None:
+        return dataset[()]
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+
+def _max_row(dataset):
+    # summary datasets are (value, time of max) x cells; older plans store just the values.
+    # Kept in the file's dtype: a float64 copy of a memory map reads all of it
+    values = read_array(dataset)
+    return values[0] if values.ndim == 2 else values
+
+
+class MeshMaxima:
+    """
+    Cell maxima of every 2D flow area of a plan, read straight from the plan
+    HDF instead of the RAS Mapper VRTs: cell centers, bed (cell minimum)
+    elevation, max WSE, max depth, max velocity and max Froude.
+
+    Cell velocity is the largest face velocity around the cell, and Froude
+    is max velocity over sqrt(g * max depth); both maxima need not happen at
+    the same time, so Froude is an upper bound. Cells are found with a k-d
+    tree of their centers, i.e. every point belongs to the cell with the
+    nearest center.
+    """
+
+    def __init__(self, centers, bed, wse, velocity, projection=None):
+        self.centers = centers
+        self.bed = bed
+        self.wse = wse
+        self.depth = np.maximum(wse - bed, 0.0)
+        self.velocity = velocity
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.froude = np.where(self.depth > 0, velocity / np.sqrt(GRAVITY * self.depth), 0.0)
+        self.projection = projection
+        self.tree = cKDTree(centers) if len(centers) else None
+        if len(centers) > 1:
+            # typical cell size: distance to the nearest other center
+            self.cell_size = float(np.median(self.tree.query(centers, k=2)[0][:, 1]))
+        else:
+            self.cell_size = 0.0
+
+    def __len__(self):
+        return len(self.centers)
+
+    @classmethod
+    def read(cls, plan_file):
+        """
+        MeshMaxima of every 2D flow area in a plan HDF. Ghost cells (no
+        elevation) are left out; a plan without 2D areas or results gives an
+        empty mesh.
+        """
+        centers, bed, wse, velocity = [], [], [], []
+        with h5py.File(plan_file, 'r') as f:
+            projection = f.attrs.get('Projection')
+            if isinstance(projection, bytes):
+                projection = projection.decode('utf-8')
+            areas = f.get(GEOMETRY_2D_PATH)
+            summary = f.get(SUMMARY_2D_PATH)
+            for name in (areas or {}):
+                geom = areas[name]
+                if not isinstance(geom, h5py.Group) or 'Cells Center Coordinate' not in geom:
+                    continue
+                if summary is None or name not in summary:
+                    continue
+                results = summary[name]
+                # native dtypes (float32 in RAS) throughout; only the real cells are copied
+                area_centers = read_array(geom['Cells Center Coordinate'])
+                area_bed = read_array(geom['Cells Minimum Elevation'])
+                area_wse = _max_row(results['Maximum Water Surface'])
+
+                # cell velocity: largest |face velocity| of the faces around it
+                area_velocity = np.zeros(len(area_centers), dtype=area_wse.dtype)
+                if 'Maximum Face Velocity' in results and 'Faces Cell Indexes' in geom:
+                    face_velocity = np.abs(_max_row(results['Maximum Face Velocity']))
+                    face_cells = read_array(geom['Faces Cell Indexes'])
+                    for side in range(face_cells.shape[1]):
+                        valid = face_cells[:, side] >= 0
+                        np.maximum.at(area_velocity, face_cells[valid, side], face_velocity[valid])
+
+                real = np.isfinite(area_bed)
+                centers.append(area_centers[real])
+                bed.append(area_bed[real])
+                wse.append(area_wse[:len(area_bed)][real])
+                velocity.append(area_velocity[real])
+
+        if not centers:
+            empty = np.zeros(0)
+            return cls(np.zeros((0, 2)), empty, empty, empty, projection)
+        return cls(np.concatenate(centers), np.concatenate(bed), np.concatenate(wse),
+                   np.concatenate(velocity), projection)
+
+    def cells_along(self, line):
+        """
+        Indices of the cells a line ((N, 2) vertices, mesh coordinates)
+        passes through, sampled at a quarter of the cell size. Parts of the
+        line off the mesh are ignored.
+        """
+        if self.tree is None or len(line) < 2:
+            return np.zeros(0, dtype=np.int64)
+        spacing = self.cell_size / 4 or 1.0
+        _, x, y, _ = sample_lines([np.asarray(line, dtype=np.float64)], spacing)
+        distance, cell = self.tree.query(np.column_stack([x, y]))
+        return np.unique(cell[distance <= max(self.cell_size, spacing)])
+
+    def line_values(self, line):
+        """
+        {'thalweg', 'max_wse', 'max_depth', 'max_velocity', 'max_froude'}
+        over the cells along a line; NaN when the line misses the mesh.
+        """
+        cells = self.cells_along(line)
+        if not cells.size:
+            return dict.fromkeys(['thalweg', 'max_wse', 'max_depth', 'max_velocity', 'max_froude'], np.nan)
+        return {
+            'thalweg': float(np.nanmin(self.bed[cells])),
+            'max_wse': float(np.nanmax(self.wse[cells])),
+            'max_depth': float(np.nanmax(self.depth[cells])),
+            'max_velocity': float(np.nanmax(self.velocity[cells])),
+            'max_froude': float(np.nanmax(self.froude[cells])),
+        }
+
+
+if __name__ == '__main__':
+    # python ras_mesh.py <plan.hdf> x1,y1 x2,y2 [...]
+    if len(sys.argv) < 4:
+        sys.exit('usage: python ras_mesh.py <plan.hdf> x1,y1 x2,y2 [...]')
+    mesh = MeshMaxima.read(sys.argv[1])
+    line = [tuple(float(v) for v in point.split(',')) for point in sys.argv[2:]]
+    for key, value in mesh.line_values(line).items():
+        print(f'{key}\t{value:.3f}')
@@ -0,0 +1,135 @@
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+
+GRAVITY = 9.81
+# station names like "Station-1+50" or "Station-0"
+STATION_PATTERN = r'^Station-(\d+)(?:\+(\d+))?'
+METRIC_COLUMNS = ['Thalweg', 'MaxVelocity', 'MaxFroude']
+
+
+def station_keys(stations):
+    """
+    (base, offset) sort keys of a column of station names, from one
+    str.extract over the distinct names. Names that don't match sort last
+    (base inf, offset 0).
+    """
+    codes, names = pd.factorize(pd.Series(stations).astype(str))
+    parts = pd.Series(names).str.extract(STATION_PATTERN)
+    base = pd.to_numeric(parts[0]).fillna(np.inf).to_numpy(dtype=np.float64)
+    offset = pd.to_numeric(parts[1]).fillna(0).to_numpy(dtype=np.float64)
+    return base[codes], offset[codes]
+
+
+def sort_stations(df, by=('Station', 'Flow Scenario')):
+    """
+    `df` in natural station order: rows sorted on the station keys of each
+    column in `by` in turn, ties kept in their original order.
+    """
+    keys = []
+    for column in by:
+        keys.extend(station_keys(df[column]))
+    # np.lexsort sorts on the last key first
+    return df.iloc[np.lexsort(keys[::-1])]
+
+
+def line_metrics(df, get_values, progress=None):
+    """
+    `df` with Thalweg, MaxVelocity and MaxFroude from
+    `get_values(station, plan ShortID)`, called once per plan and station.
+    `progress()` is called after each.
+    """
+    uniq = df[['Plan ShortID', 'Station']].drop_duplicates().reset_index(drop=True)
+    values = []
+    for plan, station in zip(uniq['Plan ShortID'], uniq['Station']):
+        values.append(get_values(station, plan))
+        if progress is not None:
+            progress()
+    metrics = pd.DataFrame(values, columns=METRIC_COLUMNS)
+    return df.merge(pd.concat([uniq, metrics], axis=1), on=['Plan ShortID', 'Station'], how='left')
+
+
+def postprocess(df):
+    """
+    Flow Area (Q / V, 0 where there is no velocity), EGL (WSE + V^2 / 2g),
+    floats rounded to 3 places and rows in natural station order, all as
+    column operations. Without line metrics (no MaxVelocity) only the
+    rounding and sort are done.
+    """
+    df = df.copy()
+    if 'MaxVelocity' in df:
+        discharge = df['Discharge'].to_numpy(dtype=np.float64)
+        velocity = df['MaxVelocity'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df['Flow Area'] = np.where(velocity > 0, discharge / velocity, 0.0)
+        df['EGL'] = df['WSE'] + df['MaxVelocity'] ** 2 / (2 * GRAVITY)
+
+    floats = df.select_dtypes('float').columns
+    df[floats] = df[floats].round(3)
+    return sort_stations(df)
+
+
+def _postprocess_rowwise(df):
+    # the per-row version postprocess replaced, kept for the benchmark
+    def station_sort_key(station_str):
+        m = re.match(r'Station-(\d+)(?:\+(\d+))?', station_str)
+        if m:
+            return (int(m.group(1)), int(m.group(2)) if m.group(2) else 0)
+        return (float('inf'), 0)
+
+    df = df.copy()
+    df['Flow Area'] = df.apply(
+        lambda r: r['Discharge'] / r['MaxVelocity'] if r['MaxVelocity'] > 0 else 0.0, axis=1)
+    df['EGL'] = df['WSE'] + df['MaxVelocity'] ** 2 / (2 * GRAVITY)
+    floats = df.select_dtypes('float').columns
+    df[floats] = df[floats].round(3)
+    return df.sort_values(by=['Station', 'Flow Scenario'], key=lambda col: col.map(station_sort_key))
+
+
+def sample_frame(rows=100_000, seed=0):
+    # merged results shaped like output_flow's, for the benchmark
+    rng = np.random.default_rng(seed)
+    stations = np.array([f'Station-{i // 20}+{i % 20 * 5:02d}' for i in range(max(rows // 10, 1))])
+    df = pd.DataFrame({
+        'Plan ShortID': rng.choice([f'P{i:02d}' for i in range(10)], rows),
+        'Station': rng.choice(stations, rows),
+        'Flow Scenario': rng.choice(['Q2', 'Q5', 'Q25', 'Q100'], rows),
+        'Discharge': rng.gamma(2.0, 50.0, rows),
+        'WSE': rng.normal(100.0, 5.0, rows),
+        'Thalweg': rng.normal(95.0, 5.0, rows),
+        'MaxVelocity': np.where(rng.random(rows) < 0.05, 0.0, rng.gamma(2.0, 1.0, rows)),
+        'MaxFroude': rng.random(rows),
+    })
+    df.loc[rng.random(rows) < 0.01, 'Station'] = 'Outlet'
+    return df
+
+
+def benchmark(rows=100_000, repeat=3):
+    """
+    Best-of-`repeat` seconds of postprocess and the per-row version on
+    `rows` station-plan rows; checks that both give the same table.
+    """
+    df = sample_frame(rows)
+    timings = {}
+    for name, func in (('vectorized', postprocess), ('rowwise', _postprocess_rowwise)):
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(df)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = (best, result)
+    vectorized, rowwise = timings['vectorized'][1], timings['rowwise'][1]
+    pd.testing.assert_frame_equal(vectorized, rowwise)
+    return {name: seconds for name, (seconds, _) in timings.items()}
+
+
+if __name__ == '__main__':
+    # python ras_postprocess.py [rows]
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    timings = benchmark(rows)
+    for name, seconds in timings.items():
+        print(f'{name:>10}  {seconds:8.3f} s')
+    print(f"{'speedup':>10}  {timings['rowwise'] / timings['vectorized']:8.1f} x")
@@ -0,0 +1,80 @@
+import os
+import sys
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import ras_catalog
+
+
+# one plan found by scan_projects; `reason` says why an invalid plan was skipped
+PlanEntry = namedtuple('PlanEntry', ['path', 'folder', 'short_id', 'flow_title', 'stations', 'valid', 'reason'])
+
+# folders are listed and their plans checked this many at a time; the work
+# is waiting on the file system (synced or network drives), not the CPU
+SCAN_WORKERS = 16
+
+
+def _reason(info):
+    if info['error']:
+        return info['error']
+    if not info['stations']:
+        return 'no Reference Lines'
+    return 'no Reference Lines results'
+
+
+def scan_folder(folder, catalog_dir=None, pool=None):
+    """
+    PlanEntry of every `*.p*.hdf` plan in one RAS folder, through the
+    folder's catalog (kept in `catalog_dir` if given, see
+    ras_catalog.catalog_path): one directory listing, and only new or
+    changed plans are opened, on `pool` when given. A folder whose catalog
+    can't be written is scanned with an in-memory one; a folder that can't
+    be listed gives one invalid entry.
+    """
+    try:
+        infos = ras_catalog.scan(folder, catalog_dir, pool)
+    except (OSError, sqlite3.Error) as e:
+        return (PlanEntry(os.path.abspath(folder), folder, None, None, (), False, str(e)),)
+    return tuple(
+        PlanEntry(info['path'], folder, info['short_id'], info['flow_title'], tuple(info['stations']),
+                  info['has_results'], None if info['has_results'] else _reason(info))
+        for info in infos
+    )
+
+
+def scan_projects(folders, max_workers=SCAN_WORKERS, catalog_dir=None):
+    """
+    Scan many RAS project folders concurrently, and the new or changed
+    plans of each folder concurrently too: one pool lists the folders,
+    another opens the plans (a folder task waits on its plans, so they
+    can't share one). Returns an immutable tuple of PlanEntry, in folder
+    order then plan file order, with every plan whether valid or not:
+    filter on `valid` for the plans to extract and read `reason` for the
+    rest. `catalog_dir` keeps the catalogs out of synced project folders.
+    """
+    folders = list(folders)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(folders)))) as folder_pool, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as plan_pool:
+        scanned = folder_pool.map(lambda folder: scan_folder(folder, catalog_dir, plan_pool), folders)
+        return tuple(entry for entries in scanned for entry in entries)
+
+
+def valid_plans(entries):
+    return tuple(entry for entry in entries if entry.valid)
+
+
+def skipped_plans(entries):
+    return tuple(entry for entry in entries if not entry.valid)
+
+
+if __name__ == '__main__':
+    # python ras_scanner.py <ras folder> [<ras folder> ...]
+    # (RAS_CATALOG_DIR keeps the catalogs out of the project folders)
+    if len(sys.argv) < 2:
+        sys.exit('usage: python ras_scanner.py <ras folder> [<ras folder> ...]')
+    entries = scan_projects(sys.argv[1:])
+    for entry in entries:
+        status = 'ok' if entry.valid else f'skipped: {entry.reason}'
+        print(f'{entry.path}\t{entry.short_id}\t{entry.flow_title}\t{status}')
+    print(f'{len(valid_plans(entries))} of {len(entries)} plans valid')
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import logging
+
+import ras_catalog
+
+
+logger = logging.getLogger(__name__)
+
+# the plans already in a summary are recorded next to it
+STATE_SUFFIX = '.plans.json'
+WATCH_INTERVAL = 30.0  # seconds between polls of the RAS folder
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class IncrementalSummary:
+    """
+    A summary CSV kept up to date plan by plan. The state file next to it
+    records the path, mtime, size and ShortID of every plan whose rows are
+    in it, so a rerun only extracts plans that are new or changed and
+    replaces just their rows (found by ShortID, which RAS keeps unique
+    within a project).
+
+    `extract_rows(plan infos)` returns (DataFrame or None, skipped) like
+    ras_flow_cli.extract_plans; `finish(df)` is applied to the merged
+    summary before it is written (sorting, rounding).
+    """
+
+    def __init__(self, output, extract_rows, finish=None, html=False):
+        self.output = output
+        self.extract_rows = extract_rows
+        self.finish = finish
+        self.html = html
+        self.state_path = output + STATE_SUFFIX
+        self.state = {}
+        if os.path.exists(self.state_path) and os.path.exists(output):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def pending(self, plans):
+        """
+        Plan infos (from the catalog) with results that aren't in the
+        summary as they are now on disk.
+        """
+        return [info for info in plans
+                if info['has_results'] and self.state.get(info['path'], [None])[:2] != _stat_key(info['path'])]
+
+    def update(self, plans):
+        """
+        Extract `plans` and merge their rows into the summary, replacing
+        rows of earlier versions of the same plans. Returns the skipped list.
+        """
+        import pandas as pd
+
+        df, skipped = self.extract_rows(plans)
+        failed = {name for _, name, _ in skipped}
+        extracted = [info for info in plans if os.path.basename(info['path']) not in failed]
+
+        frames = []
+        if os.path.exists(self.output) and self.state:
+            old = pd.read_csv(self.output)
+            replaced = {self.state[info['path']][2] for info in plans if info['path'] in self.state}
+            frames.append(old[~old['Plan ShortID'].isin(replaced)])
+        if df is not None:
+            frames.append(df)
+        if frames:
+            # plans in ShortID order, so the result doesn't depend on the
+            # order plans finished in
+            summary = pd.concat(frames, ignore_index=True).sort_values('Plan ShortID', kind='stable')
+            if self.finish is not None:
+                summary = self.finish(summary)
+            summary.to_csv(self.output, index=False)
+            if self.html:
+                summary.to_html(os.path.splitext(self.output)[0] + '.html', index=False)
+
+        for info in extracted:
+            self.state[info['path']] = _stat_key(info['path']) + [info['short_id']]
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        return skipped
+
+
+def ready_plans(folder, last_seen, catalog_dir=None):
+    """
+    Catalog infos of the plans in `folder` that look complete: size and
+    mtime unchanged since the previous poll (`last_seen`, updated in place)
+    and the reference line results present. `catalog_dir` is where the
+    folder's catalog is kept (see ras_catalog.catalog_path).
+    """
+    import ras_hdf
+    now = {}
+    for path in ras_hdf.plan_files(folder):
+        try:
+            now[os.path.abspath(path)] = _stat_key(path)
+        except OSError:
+            continue
+    stable = [path for path, key in now.items() if last_seen.get(path) == key]
+    last_seen.clear()
+    last_seen.update(now)
+
+    with ras_catalog.open_catalog(folder, catalog_dir) as catalog:
+        infos = [catalog.plan(path) for path in stable]
+        catalog.db.commit()  # close() alone would roll the new entries back
+    return [info for info in infos if info['has_results']]
+
+
+def watch(folder, summary, interval=WATCH_INTERVAL, stop=None, catalog_dir=None):
+    """
+    Poll `folder` every `interval` seconds and add each plan to `summary`
+    (an IncrementalSummary) once it is complete, until `stop()` is true or
+    Ctrl+C.
+    """
+    last_seen = {}
+    logger.info('Watching %s every %.0f s (Ctrl+C to stop)', folder, interval)
+    try:
+        while stop is None or not stop():
+            pending = summary.pending(ready_plans(folder, last_seen, catalog_dir))
+            if pending:
+                skipped = summary.update(pending)
+                logger.info('Added %d plans to %s', len(pending) - len(skipped), summary.output)
+                for plan_shortID, name, reason in skipped:
+                    logger.warning('Skipped %s (%s): %s', name, plan_shortID, reason)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info('Stopped watching %s', folder)
@@ -0,0 +1,157 @@
+import os
+
+
+# How each kind of pipeline raster is stored:
+#   kind: (numpy dtype, GDAL PREDICTOR, overview resampling)
+# Accumulation keeps its dtype: float32 only holds cell counts exactly up
+# to 2**24, so hydro_numpy.d8_accumulation switches to float64 past that.
+# PREDICTOR 2 (horizontal differencing) suits integers that change little
+# between cells (labels), 3 (floating point) suits elevations and
+# accumulation; pointer codes change at random, so they get none.
+KINDS = {
+    'elevation': ('float32', 3, 'AVERAGE'),
+    'accumulation': (None, 3, 'NEAREST'),
+    'pointer': ('uint8', 1, 'NEAREST'),
+    'labels': ('int32', 2, 'MODE'),
+    'mask': ('uint8', 2, 'NEAREST'),
+}
+
+BLOCK_SIZE = 256
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]
+
+# output name fragments -> kind, for rasters written by external tools
+NAME_KINDS = [
+    ('pointer', 'pointer'),
+    ('flowaccum', 'accumulation'),
+    ('accumulation', 'accumulation'),
+    ('filled', 'elevation'),
+    ('dem', 'elevation'),
+    ('watershed', 'labels'),
+    ('subbasin', 'labels'),
+    ('basin', 'labels'),
+    ('stream', 'labels'),
+    ('links', 'labels'),
+]
+
+
+def creation_options(kind=None):
+    """
+    GeoTIFF creation options: internal tiles, DEFLATE with the predictor of
+    `kind` (none when the kind is unknown or mixed), and BigTIFF when the
+    file may pass 4 GB.
+    """
+    options = ['TILED=YES', f'BLOCKXSIZE={BLOCK_SIZE}', f'BLOCKYSIZE={BLOCK_SIZE}', 'COMPRESS=DEFLATE']
+    if kind is not None:
+        options.append(f'PREDICTOR={KINDS[kind][1]}')
+    return options + ['NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+
+
+def processing_options(kind=None):
+    # the same options for the OPTIONS parameter of the QGIS GDAL algorithms
+    return '|'.join(creation_options(kind))
+
+
+def grass_options(kind=None):
+    # ... and for GRASS_RASTER_FORMAT_OPT (r.out.gdal createopt) of the GRASS algorithms
+    return ','.join(creation_options(kind))
+
+
+def kind_for_dtype(dtype):
+    if dtype.kind == 'f':
+        return 'elevation'
+    if dtype.itemsize == 1:
+        return 'mask'
+    return 'labels'
+
+
+def kind_for_name(path):
+    """
+    Guess the kind of a pipeline raster from its file name, or None.
+    """
+    name = os.path.basename(path).lower()
+    for fragment, kind in NAME_KINDS:
+        if fragment in name:
+            return kind
+    return None
+
+
+def cast(array, kind, nodata=None):
+    """
+    Cast `array` to the dtype of `kind`, if it has one. Returns (array, nodata); a nodata
+    value that does not fit the new dtype (e.g. -32768 for a uint8 pointer)
+    is remapped to the dtype's maximum.
+    """
+    import numpy as np
+    if KINDS[kind][0] is None:
+        return array, nodata
+    dtype = np.dtype(KINDS[kind][0])
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        if nodata is not None and not info.min <= nodata <= info.max:
+            # NaN nodata (float rasters) never compares equal to itself
+            missing = np.isnan(array) if np.isnan(nodata) else array == nodata
+            # set after the cast: info.max may not survive a float32 round trip
+            array = np.where(missing, 0, array).astype(dtype)
+            array[missing] = info.max
+            return array, info.max
+    return array.astype(dtype, copy=False), nodata
+
+
+def build_overviews(path, kind):
+    from osgeo import gdal
+    ds = gdal.Open(path, gdal.GA_Update)
+    levels = [level for level in OVERVIEW_LEVELS if min(ds.RasterXSize, ds.RasterYSize) // level >= BLOCK_SIZE // 2]
+    if levels:
+        # for this thread and this call only, not the rest of the QGIS session
+        with gdal.config_option('COMPRESS_OVERVIEW', 'DEFLATE'):
+            ds.BuildOverviews(KINDS[kind][2], levels)
+    ds = None
+    return levels
+
+
+def finalize(path, kind=None, overviews=False):
+    """
+    Rewrite a raster written by another tool (WBT, GRASS, GDAL with default
+    options) with the output policy: the dtype of its kind, tiled and
+    compressed, and overviews if asked. The kind is guessed from the file
+    name when not given. The raster is cast and copied a strip of blocks at
+    a time, so it never has to fit in memory. Returns the kind used, or
+    None if the file was left as is.
+    """
+    from osgeo import gdal
+    from osgeo import gdal_array
+    import numpy as np
+    kind = kind or kind_for_name(path)
+    if kind is None or not os.path.exists(path):
+        return None
+
+    src = gdal.Open(path)
+    band = src.GetRasterBand(1)
+    width, height = src.RasterXSize, src.RasterYSize
+    src_nodata = band.GetNoDataValue()
+    # the output dtype and nodata don't depend on the values: cast an empty array
+    src_dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+    empty, nodata = cast(np.zeros(0, dtype=src_dtype), kind, src_nodata)
+
+    tmp = path + '.tmp.tif'
+    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(empty.dtype)
+    out = gdal.GetDriverByName('GTiff').Create(tmp, width, height, 1, gdal_type, options=creation_options(kind))
+    out.SetGeoTransform(src.GetGeoTransform())
+    out.SetProjection(src.GetProjection())
+    out_band = out.GetRasterBand(1)
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+
+    # full-width strips of whole output tiles, at least one source block high
+    rows = -(-band.GetBlockSize()[1] // BLOCK_SIZE) * BLOCK_SIZE
+    for row in range(0, height, rows):
+        count = min(rows, height - row)
+        block, _ = cast(band.ReadAsArray(0, row, width, count), kind, src_nodata)
+        out_band.WriteArray(block, 0, row)
+    out.FlushCache()
+    out = out_band = src = band = None
+    os.replace(tmp, path)
+
+    if overviews:
+        build_overviews(path, kind)
+    return kind
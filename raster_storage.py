@@ -0,0 +1,159 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import raster_output
+
+
+# Creation options for intermediates that do not fit in RAM and spill to disk
+SPILL_OPTIONS = raster_output.creation_options()
+
+
+def available_memory():
+    """
+    Return the available physical memory in bytes, or None if it can't be read.
+    Uses psutil when installed, otherwise falls back to /proc/meminfo (Linux)
+    or GlobalMemoryStatusEx (Windows).
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        stat = MEMORYSTATUSEX()
+        stat.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat)):
+            return stat.ullAvailPhys
+
+    return None
+
+
+def raster_nbytes(layer, bytes_per_cell=4):
+    """
+    Estimate the in-memory size of a single band raster with the same
+    dimensions as `layer` (a QgsRasterLayer). Defaults to float32 cells.
+    """
+    return layer.width() * layer.height() * bytes_per_cell
+
+
+class StoragePolicy:
+    """
+    Decides where each pipeline file is written.
+
+    Files listed in `keep` (or every file when `keep_all` is set) are products
+    the user asked for and go to `save_folder`. Everything else is an
+    intermediate and is placed, in order of preference:
+
+    1. /vsimem/  - GDAL virtual memory, only for files written and read in-process
+    2. /dev/shm  - shared memory, visible to WBT/GRASS child processes
+    3. a scratch folder on the local temp drive (never the synced save folder)
+
+    A RAM tier is only used while the running total of files placed there stays
+    under `ram_fraction` of the available memory. Rasters written by GDAL to
+    disk should use `gdal_options` so they follow the raster_output policy.
+    """
+
+    def __init__(self, save_folder, keep=(), keep_all=False, ram_fraction=0.25):
+        self.save_folder = save_folder
+        self.keep = set(keep)
+        self.keep_all = keep_all
+        self.log = []  # (name, tier, path) for the run log
+
+        # The scratch location is derived from the save folder so that a rerun
+        # on the same folder finds the same intermediates.
+        token = hashlib.sha1(os.path.abspath(save_folder).encode('utf-8')).hexdigest()[:10]
+        self.vsimem_dir = f'/vsimem/amh_{token}'
+        self.shm_dir = os.path.join('/dev/shm', f'amh_{token}') if os.path.isdir('/dev/shm') else None
+        self.scratch_dir = os.path.join(tempfile.gettempdir(), f'amh_{token}')
+
+        avail = available_memory()
+        self.ram_budget = int(avail * ram_fraction) if avail else 0
+        self.ram_used = 0
+        self._vsimem_files = []
+        self._lock = threading.Lock()  # paths may be requested from worker threads
+
+    def _fits(self, nbytes):
+        return nbytes is not None and self.ram_used + nbytes <= self.ram_budget
+
+    def path(self, name, nbytes=None, in_process=False):
+        """
+        Return the path `name` should be written to. `nbytes` is the expected
+        size of the file; leave it as None if unknown (the file then spills to
+        the scratch folder). Set `in_process` only when the file is both written
+        and read through GDAL in this Python process.
+        """
+        with self._lock:
+            return self._place(name, nbytes, in_process)
+
+    def _place(self, name, nbytes, in_process):
+        if self.keep_all or name in self.keep:
+            path, tier = os.path.join(self.save_folder, name), 'save folder'
+
+        elif in_process and self._fits(nbytes):
+            path, tier = f'{self.vsimem_dir}/{name}', 'vsimem'
+            self.ram_used += nbytes
+            self._vsimem_files.append(path)
+
+        elif self.shm_dir and self._fits(nbytes) and shutil.disk_usage('/dev/shm').free > nbytes:
+            os.makedirs(self.shm_dir, exist_ok=True)
+            path, tier = os.path.join(self.shm_dir, name), 'shared memory'
+            self.ram_used += nbytes
+
+        else:
+            os.makedirs(self.scratch_dir, exist_ok=True)
+            path, tier = os.path.join(self.scratch_dir, name), 'scratch disk'
+
+        self.log.append((name, tier, path))
+        return path
+
+    def gdal_options(self, path, kind='elevation'):
+        """
+        Creation options string for the `OPTIONS` parameter of the GDAL
+        processing algorithms. Files on disk (products and spilled
+        intermediates) are tiled and compressed for their `kind`; RAM tiers
+        are left uncompressed since they are read back right away.
+        """
+        if path.startswith(self.scratch_dir) or path.startswith(self.save_folder):
+            return raster_output.processing_options(kind)
+        return None
+
+    def cleanup(self, keep_scratch=False):
+        """
+        Remove every intermediate placed in RAM or on scratch disk.
+        With `keep_scratch`, only the RAM tiers are freed.
+        """
+        if self._vsimem_files:
+            from osgeo import gdal
+            for path in self._vsimem_files:
+                gdal.Unlink(path)
+            self._vsimem_files = []
+
+        folders = (self.shm_dir,) if keep_scratch else (self.shm_dir, self.scratch_dir)
+        for folder in folders:
+            if folder and os.path.isdir(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+        self.ram_used = 0
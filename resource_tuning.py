@@ -0,0 +1,225 @@
+import os
+import json
+from contextlib import contextmanager
+
+from raster_storage import available_memory
+
+
+MB = 1024 * 1024
+
+# approximate RAM per cell of r.watershed in all-in-memory mode
+R_WATERSHED_BYTES_PER_CELL = 31
+
+
+class ResourcePlan:
+    """
+    Picks thread counts and memory settings for the child algorithms from the
+    DEM size and the machine (CPUs, available RAM), and records each choice
+    with its reason for the run log.
+
+    `budget_mb` caps the memory any single step may take; by default half of
+    the available RAM. `concurrent` is how many heavy steps may run at once
+    (e.g. two WBT steps side by side in the pipeline graph); threads are
+    shared between them.
+    """
+
+    def __init__(self, width, height, budget_mb=None, cpus=None, concurrent=1):
+        self.cells = width * height
+        self.cpus = cpus or os.cpu_count() or 1
+        avail = available_memory()
+        self.available_mb = avail // MB if avail else None
+        if budget_mb is None:
+            budget_mb = self.available_mb // 2 if self.available_mb else 1024
+        self.budget_mb = int(budget_mb)
+        self.concurrent = max(1, concurrent)
+        self.log = []  # (setting, value, reason)
+
+        self.log.append(('machine', f'{self.cpus} CPUs, {self.available_mb or "unknown"} MB available',
+                         f'DEM {width} x {height} ({self.cells * 4 // MB} MB as float32), budget {self.budget_mb} MB'))
+
+    def _record(self, setting, value, reason):
+        self.log.append((setting, value, reason))
+        return value
+
+    def threads(self):
+        # threads for one step when `concurrent` steps share the CPUs
+        return max(1, self.cpus // self.concurrent)
+
+    def gdal_cache_mb(self):
+        # enough to hold the raster being warped, within a quarter of the budget
+        raster_mb = self.cells * 4 // MB + 1
+        return max(64, min(raster_mb, self.budget_mb // 4))
+
+    def warp(self, alg_params):
+        """
+        Tune the parameters of gdal:warpreproject / gdal:cliprasterbymasklayer.
+        """
+        threads = self.threads()
+        cache = self.gdal_cache_mb()
+        alg_params = dict(alg_params)
+        alg_params['MULTITHREADING'] = self._record(
+            'gdal MULTITHREADING', threads > 1, f'{threads} thread(s) per step')
+        extra = f'-wo NUM_THREADS={threads} -wm {cache} --config GDAL_CACHEMAX {cache}'
+        alg_params['EXTRA'] = self._record('gdal EXTRA', extra, 'warp memory and block cache sized to the DEM, capped at budget / 4')
+        return alg_params
+
+    def apply_gdal(self):
+        """
+        Set the GDAL block cache of this process (used by the in-process steps).
+        """
+        from osgeo import gdal
+        cache = self.gdal_cache_mb()
+        gdal.SetCacheMax(cache * MB)
+        self._record('gdal cache (in-process)', f'{cache} MB', 'block cache for the NumPy/tiled steps')
+
+    def grass_memory(self, bytes_per_cell=R_WATERSHED_BYTES_PER_CELL):
+        """
+        (memory MB, disk swap mode) for r.watershed / r.stream.extract.
+        """
+        need_mb = self.cells * bytes_per_cell // MB + 1
+        memory = max(64, min(need_mb, self.budget_mb))
+        swap = need_mb > self.budget_mb
+        reason = f'needs ~{need_mb} MB in memory' + (', over budget: segmented disk mode' if swap else '')
+        self._record('grass memory', memory, reason)
+        self._record('grass -m', swap, reason)
+        return memory, swap
+
+    def grass(self, alg_params):
+        """
+        Tune the memory parameters of a GRASS algorithm (r.watershed has -m).
+        """
+        memory, swap = self.grass_memory()
+        alg_params = dict(alg_params)
+        alg_params['memory'] = memory
+        if '-m' in alg_params:
+            alg_params['-m'] = swap
+        return alg_params
+
+    def wbt_max_procs(self):
+        return self._record('wbt max_procs', self.threads(), f'{self.cpus} CPUs shared by {self.concurrent} concurrent WBT step(s)')
+
+    def report(self):
+        """
+        One line per choice, for feedback.pushInfo.
+        """
+        return [f'{setting}: {value} ({reason})' for setting, value, reason in self.log]
+
+
+def wbt_executable():
+    """
+    Path of the whitebox_tools executable configured in the QGIS WBT provider, or None.
+    """
+    try:
+        from processing.core.ProcessingConfig import ProcessingConfig
+        return ProcessingConfig.getSetting('WBT_EXECUTABLE') or None
+    except ImportError:
+        return None
+
+
+def _pid_alive(pid):
+    # whether the run holding a settings lock is still going; when it can't be
+    # told (Windows without psutil) the lock is respected
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _restore(settings_path, original):
+    if original is None:
+        if os.path.exists(settings_path):
+            os.remove(settings_path)
+    else:
+        with open(settings_path, 'w') as f:
+            f.write(original)
+
+
+def _take_lock(lock_path, settings_path):
+    """
+    Create the lock next to settings.json, recording this process and the
+    settings to put back. A lock left by a run that died is recovered: its
+    settings are restored first. Returns (locked, original settings text or
+    None); not locked when another run holds it.
+    """
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_path) as f:
+                    held = json.load(f)
+            except (OSError, ValueError):
+                return False, None
+            if _pid_alive(held.get('pid', 0)):
+                return False, None
+            _restore(settings_path, held.get('original'))
+            os.remove(lock_path)
+            continue
+        original = None
+        if os.path.exists(settings_path):
+            with open(settings_path) as f:
+                original = f.read()
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'original': original}, f)
+        return True, original
+    return False, None
+
+
+@contextmanager
+def wbt_max_procs(max_procs, executable=None):
+    """
+    Run the enclosed WBT steps with `max_procs` threads. WhiteboxTools reads
+    max_procs from the settings.json next to its executable (the QGIS provider
+    has no per-call option), so the value is written there and the previous
+    file is restored afterwards.
+
+    settings.json is shared by every run on the machine: a lock file next to
+    it keeps a second run from rewriting it meanwhile (that run leaves WBT as
+    it is), and holds the original settings so a run that crashed is undone
+    by the next one. Yields False, changing nothing, when the executable
+    can't be found, the folder is read-only or another run holds the lock.
+    """
+    executable = executable or wbt_executable()
+    settings_path = os.path.join(os.path.dirname(executable), 'settings.json') if executable else None
+    if not settings_path or not os.path.isdir(os.path.dirname(settings_path)):
+        yield False
+        return
+    lock_path = settings_path + '.lock'
+
+    try:
+        locked, original = _take_lock(lock_path, settings_path)
+    except OSError:
+        locked = False
+    if not locked:
+        yield False
+        return
+
+    try:
+        settings = json.loads(original) if original else {}
+    except ValueError:
+        settings = {}
+    settings['max_procs'] = int(max_procs)
+    try:
+        with open(settings_path, 'w') as f:
+            json.dump(settings, f, indent=2)
+    except OSError:
+        # read-only install: leave WBT on its own default
+        os.remove(lock_path)
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        _restore(settings_path, original)
+        os.remove(lock_path)
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+
+
+# Sidecar files that are part of a shapefile's content
+SHP_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+class StepCache:
+    """
+    Content-addressed cache for the child algorithms of a processing chain.
+
+    Every step is keyed by a hash of its algorithm id, its parameters and the
+    *content* of the files it reads. The key and the step outputs are stored
+    in `step_manifest.json` inside `folder`. A rerun skips a step whose key is
+    unchanged and whose outputs still exist, so a failed run resumes from the
+    first step whose inputs or parameters changed.
+    """
+
+    def __init__(self, folder, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.RLock()  # steps may run from worker threads
+        self.manifest_path = os.path.join(folder, 'step_manifest.json')
+        self.manifest = {'steps': {}, 'fingerprints': {}}
+        if enabled and os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                # a half-written manifest from a crashed run: start over
+                pass
+
+    def _save(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def fingerprint(self, path):
+        """
+        Return a digest of the content of `path`. Digests are remembered per
+        (size, mtime) so an unchanged file is only hashed once.
+        """
+        base, ext = os.path.splitext(path)
+        files = [base + e for e in SHP_SIDECARS] if ext.lower() == '.shp' else [path]
+        files = [p for p in files if os.path.isfile(p)]
+        stamp = [[os.path.getsize(p), os.stat(p).st_mtime_ns] for p in files]
+
+        known = self.manifest['fingerprints'].get(path)
+        if known and known[0] == stamp:
+            return known[1]
+
+        digest = hashlib.blake2b(digest_size=16)
+        for p in files:
+            with open(p, 'rb') as f:
+                for block in iter(lambda: f.read(4 * 1024 * 1024), b''):
+                    digest.update(block)
+        digest = digest.hexdigest()
+        self.manifest['fingerprints'][path] = [stamp, digest]
+        return digest
+
+    def _value_key(self, value):
+        # layers are keyed by their source file
+        if hasattr(value, 'source'):
+            value = value.source()
+        if isinstance(value, str):
+            path = value.split('|')[0]
+            if os.path.isfile(path):
+                return 'file:' + self.fingerprint(path)
+            return value
+        if isinstance(value, (list, tuple)):
+            return [self._value_key(v) for v in value]
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return str(value)
+
+    def key(self, alg_id, params, output_names=()):
+        """
+        Hash of the algorithm id and its parameters. Parameters listed in
+        `output_names` are destinations, so only their path enters the key.
+        """
+        canonical = {
+            name: (str(value) if name in output_names else self._value_key(value))
+            for name, value in params.items()
+        }
+        blob = json.dumps([alg_id, canonical], sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+    def run(self, name, alg_id, params, run_func, output_names=('output', 'OUTPUT')):
+        """
+        Return the outputs of step `name`, calling `run_func()` only when the
+        cached outputs are missing or stale.
+        """
+        if not self.enabled:
+            return run_func()
+
+        with self._lock:
+            key = self.key(alg_id, params, output_names)
+            entry = self.manifest['steps'].setdefault(name, {'key': None, 'outputs': None, 'hits': 0, 'misses': 0})
+
+            if entry['key'] == key and entry['outputs'] is not None and self._outputs_exist(entry['outputs']):
+                entry['hits'] += 1
+                self._save()
+                return dict(entry['outputs'])
+
+        outputs = run_func()
+
+        with self._lock:
+            entry['misses'] += 1
+            # only file outputs (plain strings) can be restored on a rerun, and
+            # only a complete run is recorded: a canceled step returns None or
+            # leaves its outputs None
+            if self._complete(params, outputs, output_names):
+                entry['key'], entry['outputs'] = key, dict(outputs)
+            else:
+                entry['key'], entry['outputs'] = None, None
+            self._save()
+        return outputs
+
+    def _complete(self, params, outputs, output_names):
+        if not isinstance(outputs, dict):
+            return False
+        expected = [name for name in output_names if name in params]
+        if any(outputs.get(name) is None for name in expected):
+            return False
+        return all(isinstance(v, (str, int, float)) for v in outputs.values())
+
+    def _outputs_exist(self, outputs):
+        for value in outputs.values():
+            if value is None:
+                return False  # recorded by an older version from a canceled run
+            if isinstance(value, str) and os.path.splitext(value)[1] and not os.path.exists(value.split('|')[0]):
+                return False
+        return True
+
+    def report(self):
+        """
+        One line per step with its cache hits, misses and hit rate.
+        """
+        lines = [f"{'step':<28}{'hits':>6}{'misses':>8}{'hit rate':>10}"]
+        for name, entry in self.manifest['steps'].items():
+            total = entry['hits'] + entry['misses']
+            rate = entry['hits'] / total if total else 0.0
+            lines.append(f"{name:<28}{entry['hits']:>6}{entry['misses']:>8}{rate:>10.0%}")
+        return lines
+
+
+if __name__ == '__main__':
+    # cache report: python step_cache.py <save folder>
+    if len(sys.argv) != 2:
+        sys.exit('usage: python step_cache.py <save folder>')
+    cache = StepCache(sys.argv[1])
+    if not cache.manifest['steps']:
+        sys.exit(f'No step manifest found in {sys.argv[1]}')
+    print('\n'.join(cache.report()))
@@ -0,0 +1,135 @@
+import sys
+import numpy as np
+
+import hydro_numpy
+from line_geometry import sample_lines
+
+
+BURN = 'burn'      # lower each cell by the depth, then force a steady descent
+BREACH = 'breach'  # cut a straight grade from the upstream end to the lowest point
+MODES = [BURN, BREACH]
+
+
+def read_lines(path, depth_field=None):
+    """
+    Vertices of every line in a vector file, as a list of (N, 2) arrays,
+    and the burn depth of each line from `depth_field` (NaN when missing).
+    Multi-part lines are split into their parts.
+    """
+    from osgeo import ogr
+    ds = ogr.Open(path)
+    layer = ds.GetLayer(0)
+    has_field = depth_field and layer.GetLayerDefn().GetFieldIndex(depth_field) >= 0
+    lines, depths = [], []
+    for feat in layer:
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        depth = feat.GetField(depth_field) if has_field else None
+        parts = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())] or [geom]
+        for part in parts:
+            points = np.asarray(part.GetPoints() or [], dtype=np.float64)
+            if len(points) >= 2:
+                lines.append(points[:, :2])
+                depths.append(np.nan if depth is None else float(depth))
+    ds = None
+    return lines, np.asarray(depths, dtype=np.float64)
+
+
+def _grouped_cummin(values, group):
+    # running minimum that restarts at every group; `group` sorted, 0..k.
+    # Shifting each group below the previous one lets one accumulate do all.
+    big = np.ptp(values) + 1.0
+    return np.minimum.accumulate(values - group * big) + group * big
+
+
+def burn_lines(dem, geotransform, lines, depth=2.0, mode=BURN, nodata=None, depths=None):
+    """
+    Burn `lines` (known channels, culverts) into a copy of `dem`.
+
+    All lines are sampled and rasterized in one vectorized pass. Each line
+    runs downhill from whichever end is higher, and the cells under it are
+    lowered to:
+
+    - BURN: the running minimum of the DEM along the line, less `depth`, so
+      the line descends steadily through any bump (embankments, roads)
+    - BREACH: a straight grade from the upstream end to the lowest point on
+      the line, less `depth`
+
+    Cells are only ever lowered. `depths` gives a depth per line (NaN uses
+    `depth`).
+    """
+    out = np.array(dem, dtype=np.float32)
+    if not lines:
+        return out
+    rows, cols = out.shape
+    spacing = min(abs(geotransform[1]), abs(geotransform[5])) / 2
+    line, x, y, s = sample_lines(lines, spacing)
+
+    r, c = hydro_numpy.xy_to_cell(x, y, geotransform)
+    r, c = np.asarray(r, dtype=np.int64), np.asarray(c, dtype=np.int64)
+    keep = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+    line, s, cell = line[keep], s[keep], r[keep] * cols + c[keep]
+    z = out.ravel()[cell].astype(np.float64)
+    valid = np.isfinite(z) if nodata is None else np.isfinite(z) & (z != nodata)
+    line, s, cell, z = line[valid], s[valid], cell[valid], z[valid]
+    if not line.size:
+        return out
+
+    # orient every line downhill: compare the DEM at its two ends
+    order = np.lexsort((s, line))
+    line, s, cell, z = line[order], s[order], cell[order], z[order]
+    present, first = np.unique(line, return_index=True)
+    last = np.append(first[1:], line.size) - 1
+    reverse = np.zeros(len(lines), dtype=bool)
+    reverse[present] = z[last] > z[first]
+    length = np.zeros(len(lines))
+    length[present] = s[last]
+    s = np.where(reverse[line], length[line] - s, s)
+
+    order = np.lexsort((s, line))
+    line, s, cell, z = line[order], s[order], cell[order], z[order]
+    group = np.searchsorted(present, line)
+    lowest = _grouped_cummin(z, group)
+
+    depth_of = np.full(len(lines), float(depth))
+    if depths is not None:
+        depths = np.asarray(depths, dtype=np.float64)
+        depth_of = np.where(np.isnan(depths), depth_of, depths)
+
+    if mode == BURN:
+        target = lowest - depth_of[line]
+    elif mode == BREACH:
+        first = np.append(0, np.flatnonzero(np.diff(group)) + 1)
+        last = np.append(first[1:], group.size) - 1
+        z_top, z_low = z[first][group], lowest[last][group]
+        span = np.maximum(s[last][group] - s[first][group], 1e-9)
+        target = z_top + (z_low - z_top) * (s - s[first][group]) / span - depth_of[line]
+    else:
+        raise ValueError(f'mode must be one of {MODES}, got {mode!r}')
+
+    flat = out.ravel()
+    np.minimum.at(flat, cell, target.astype(np.float32))
+    return flat.reshape(out.shape)
+
+
+def run_step(params):
+    """
+    dem, lines (vector path), depth, mode, optional depth_field -> output DEM.
+    """
+    dem, geotransform, projection, nodata = hydro_numpy.read_raster(params['dem'])
+    lines, depths = read_lines(params['lines'], params.get('depth_field'))
+    burned = burn_lines(dem, geotransform, lines, params.get('depth', 2.0), params.get('mode', BURN), nodata, depths)
+    hydro_numpy.write_raster(params['output'], burned, geotransform, projection, nodata, kind='elevation')
+    return {'output': params['output']}
+
+
+if __name__ == '__main__':
+    # python stream_burning.py <dem.tif> <lines> <output.tif> [depth] [burn|breach]
+    if len(sys.argv) not in (4, 5, 6):
+        sys.exit('usage: python stream_burning.py <dem.tif> <lines> <output.tif> [depth] [burn|breach]')
+    print(run_step({
+        'dem': sys.argv[1], 'lines': sys.argv[2], 'output': sys.argv[3],
+        'depth': float(sys.argv[4]) if len(sys.argv) > 4 else 2.0,
+        'mode': sys.argv[5] if len(sys.argv) > 5 else BURN,
+    })['output'])
@@ -0,0 +1,224 @@
+import sys
+import csv
+import numpy as np
+
+import hydro_numpy
+from hydro_numpy import WBT_D8
+
+
+COLUMNS = ['link', 'downstream', 'strahler', 'shreve', 'cells', 'local_area', 'area', 'length', 'outlet_x', 'outlet_y']
+INT_COLUMNS = {'link', 'downstream', 'strahler', 'shreve', 'cells'}
+
+
+def topological_order(downstream):
+    """
+    Indices of a forest given as `downstream` (index of the next node, -1 at
+    an outlet) ordered so every node comes after all nodes upstream of it.
+    Kahn's algorithm, O(N).
+    """
+    downstream = np.asarray(downstream)
+    has_down = downstream >= 0
+    indegree = np.bincount(downstream[has_down], minlength=downstream.size)
+    stack = list(np.flatnonzero(indegree == 0))
+    order = []
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        d = downstream[node]
+        if d >= 0:
+            indegree[d] -= 1
+            if indegree[d] == 0:
+                stack.append(d)
+    return np.asarray(order, dtype=np.int64)
+
+
+class StreamTopology:
+    """
+    How the stream links (and with them the subbasins) connect, one row per
+    link: the link downstream (0 at an outlet), Strahler and Shreve order,
+    the cells and area draining directly to the link, the cumulative area
+    through its outlet, its channel length and outlet coordinates.
+
+    Built once per delineation from the D8 pointer and the stream raster
+    (see `build`) and stored as a CSV next to the outputs, so later stages can
+    route and aggregate subbasins without reading the rasters again.
+    """
+
+    def __init__(self, table):
+        self.table = {name: np.asarray(table[name]) for name in COLUMNS}
+        self._row = {int(link): i for i, link in enumerate(self.table['link'])}
+
+    def __len__(self):
+        return len(self.table['link'])
+
+    def __getitem__(self, name):
+        return self.table[name]
+
+    def row(self, link):
+        return self._row[int(link)]
+
+    @classmethod
+    def build(cls, pointer, streams, geotransform, subbasins=None, pointer_nodata=None):
+        """
+        `pointer` is a WBT D8 pointer, `streams` a stream raster (> 0 on the
+        channel). Without `subbasins` the streams are split into links with
+        hydro_numpy.stream_links and each link gets the area draining to it.
+        With a `subbasins` label raster (wbt:Subbasins, r.watershed basins)
+        the stream cells take the label of their subbasin, so the link ids
+        match the subbasin ids; cells outside the labels are ignored.
+        """
+        pointer = np.asarray(pointer)
+        if pointer_nodata is not None:
+            pointer = np.where(pointer == pointer_nodata, 0, pointer)
+        on_stream = np.asarray(streams) > 0
+        if subbasins is None:
+            links = hydro_numpy.stream_links(pointer, on_stream)
+            subbasins = hydro_numpy.link_subbasins(pointer, links)
+        else:
+            subbasins = np.where(np.asarray(subbasins) > 0, subbasins, 0).astype(np.int64)
+            links = np.where(on_stream, subbasins, 0)
+
+        flat_links = links.ravel().astype(np.int64)
+        ids = np.unique(flat_links[flat_links > 0])
+        index = np.zeros(int(ids.max()) + 1 if ids.size else 1, dtype=np.int64)
+        index[ids] = np.arange(ids.size)
+        n = ids.size
+
+        # the outlet of a link is its stream cell whose receiver is off the
+        # link; the link it drains into is the label of that receiver
+        down = hydro_numpy.downstream_index(pointer)
+        cells = np.flatnonzero(flat_links)
+        receiver = down[cells]
+        target = np.where(receiver >= 0, flat_links[np.maximum(receiver, 0)], 0)
+        leaves = target != flat_links[cells]
+        link_of = index[flat_links[cells]]
+
+        # a link with several exits (only with labels not made from these
+        # streams) keeps the first one
+        with_exit, first = np.unique(link_of[leaves], return_index=True)
+        exit_cells = np.flatnonzero(leaves)[first]
+        outlet = np.full(n, -1, dtype=np.int64)
+        outlet[with_exit] = cells[exit_cells]
+        downstream = np.full(n, -1, dtype=np.int64)
+        downstream[with_exit] = np.where(target[exit_cells] > 0, index[target[exit_cells]], -1)
+
+        # channel length: each stream cell's step to its receiver
+        dx, dy = abs(geotransform[1]), abs(geotransform[5])
+        codes = pointer.ravel()[cells]
+        step = np.where(np.isin(codes, [1, 4, 16, 64]), np.hypot(dx, dy), np.where(np.isin(codes, [2, 32]), dx, dy))
+        step[~np.isin(codes, list(WBT_D8))] = 0
+        length = np.bincount(link_of, weights=step, minlength=n)
+
+        cell_area = dx * dy
+        flat_sub = subbasins.ravel()
+        counted = np.isin(flat_sub, ids)
+        local_cells = np.bincount(index[flat_sub[counted]], minlength=n)
+
+        # orders and cumulative area in one topological pass
+        order = topological_order(downstream)
+        shreve = np.zeros(n, dtype=np.int64)
+        strahler = np.zeros(n, dtype=np.int64)
+        top = np.zeros(n, dtype=np.int64)  # highest Strahler order flowing in
+        top_count = np.zeros(n, dtype=np.int64)  # how many inflows have it
+        area = local_cells * cell_area
+        for i in order:
+            if shreve[i] == 0:
+                shreve[i] = 1
+            if top_count[i] == 0:
+                strahler[i] = 1
+            else:
+                strahler[i] = top[i] + 1 if top_count[i] > 1 else top[i]
+            d = downstream[i]
+            if d >= 0:
+                shreve[d] += shreve[i]
+                area[d] += area[i]
+                if strahler[i] > top[d]:
+                    top[d], top_count[d] = strahler[i], 1
+                elif strahler[i] == top[d]:
+                    top_count[d] += 1
+
+        orow, ocol = np.divmod(np.maximum(outlet, 0), pointer.shape[1])
+        x0, cw, _, y0, _, ch = geotransform
+        return cls({
+            'link': ids,
+            'downstream': np.where(downstream >= 0, ids[np.maximum(downstream, 0)], 0),
+            'strahler': strahler,
+            'shreve': shreve,
+            'cells': local_cells,
+            'local_area': local_cells * cell_area,
+            'area': area,
+            'length': length,
+            'outlet_x': np.where(outlet >= 0, x0 + (ocol + 0.5) * cw, np.nan),
+            'outlet_y': np.where(outlet >= 0, y0 + (orow + 0.5) * ch, np.nan),
+        })
+
+    def order(self):
+        """
+        Link ids from the headwaters down: every link after all links upstream of it.
+        """
+        down = np.array([self._row.get(int(d), -1) if d else -1 for d in self.table['downstream']], dtype=np.int64)
+        return self.table['link'][topological_order(down)]
+
+    def upstream(self):
+        """
+        {link: [links draining directly into it]}.
+        """
+        up = {int(link): [] for link in self.table['link']}
+        for link, down in zip(self.table['link'], self.table['downstream']):
+            if down:
+                up[int(down)].append(int(link))
+        return up
+
+    def outlets(self):
+        return self.table['link'][self.table['downstream'] == 0]
+
+    def write(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for i in range(len(self)):
+                writer.writerow([int(self.table[c][i]) if c in INT_COLUMNS else f'{self.table[c][i]:.10g}' for c in COLUMNS])
+        return path
+
+    @classmethod
+    def read(cls, path):
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        return cls({
+            c: np.array([int(r[c]) if c in INT_COLUMNS else float(r[c]) for r in rows],
+                        dtype=np.int64 if c in INT_COLUMNS else np.float64)
+            for c in COLUMNS
+        })
+
+
+def build_from_rasters(pointer_path, streams_path, subbasins_path=None, output=None):
+    """
+    StreamTopology of raster files, written to `output` (CSV) if given.
+    """
+    pointer, geotransform, _, pointer_nodata = hydro_numpy.read_raster(pointer_path)
+    streams, _, _, streams_nodata = hydro_numpy.read_raster(streams_path)
+    if streams_nodata is not None:
+        streams = np.where(streams == streams_nodata, 0, streams)
+    subbasins = None
+    if subbasins_path:
+        subbasins, _, _, sub_nodata = hydro_numpy.read_raster(subbasins_path)
+        if sub_nodata is not None:
+            subbasins = np.where(subbasins == sub_nodata, 0, subbasins)
+    topology = StreamTopology.build(pointer, streams, geotransform, subbasins, pointer_nodata)
+    if output:
+        topology.write(output)
+    return topology
+
+
+def run_step(params):
+    # pointer, streams, optional subbasins -> output CSV, as a cacheable step
+    build_from_rasters(params['pointer'], params['streams'], params.get('subbasins'), params['output'])
+    return {'output': params['output']}
+
+
+if __name__ == '__main__':
+    # python stream_topology.py <pointer.tif> <streams.tif> [subbasins.tif] <output.csv>
+    if len(sys.argv) not in (4, 5):
+        sys.exit('usage: python stream_topology.py <pointer.tif> <streams.tif> [subbasins.tif] <output.csv>')
+    build_from_rasters(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) == 5 else None, sys.argv[-1])
+    print(sys.argv[-1])
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import stat
+
+import h5py
+import numpy as np
+
+import ras_catalog
+import ras_hdf
+import ras_scanner
+
+
+def write_plan(path, short_id='P01', stations=('Station-0', 'Station-1+50')):
+    # the parts of a plan HDF that ras_hdf.read_plan_info reads
+    with h5py.File(path, 'w') as f:
+        info = f.create_group(ras_hdf.PLAN_INFO_PATH)
+        info.attrs['Plan ShortID'] = np.bytes_(short_id)
+        info.attrs['Flow Title'] = np.bytes_('Q100')
+        names = np.array([(name.encode('utf-8'),) for name in stations], dtype=[('Name', 'S32')])
+        f.create_dataset(ras_hdf.REF_ATTR_PATH, data=names)
+        f.create_dataset(ras_hdf.FLOW_PATH, data=np.zeros((4, len(stations))))
+        f.create_dataset(ras_hdf.WSE_PATH, data=np.zeros((4, len(stations))))
+
+
+def read_only_catalog(monkeypatch):
+    # root ignores file permissions, so the catalog is also opened read-only
+    # through SQLite itself: every write fails as it would on a read-only share
+    def open_catalog(folder, catalog_dir=None):
+        catalog = ras_catalog.PlanCatalog.__new__(ras_catalog.PlanCatalog)
+        catalog.path = os.path.join(folder, ras_catalog.CATALOG_NAME)
+        catalog.db = sqlite3.connect(f'file:{catalog.path}?mode=ro', uri=True)
+        return catalog
+    monkeypatch.setattr(ras_catalog, 'open_catalog', open_catalog)
+
+
+def test_scan_read_only_folder(tmp_path, monkeypatch):
+    write_plan(tmp_path / 'model.p01.hdf')
+    ras_catalog.PlanCatalog(str(tmp_path / ras_catalog.CATALOG_NAME)).close()  # empty catalog
+    read_only_catalog(monkeypatch)
+    os.chmod(tmp_path / ras_catalog.CATALOG_NAME, stat.S_IRUSR)
+    os.chmod(tmp_path, stat.S_IRUSR | stat.S_IXUSR)
+    try:
+        entries = ras_scanner.scan_folder(str(tmp_path))
+    finally:
+        os.chmod(tmp_path, stat.S_IRWXU)
+
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry.valid and entry.reason is None
+    assert entry.short_id == 'P01'
+    assert entry.stations == ('Station-0', 'Station-1+50')
+
+
+def test_scan_missing_folder(tmp_path):
+    folder = str(tmp_path / 'missing')
+    entries = ras_scanner.scan_projects([folder])
+    assert len(entries) == 1
+    assert not entries[0].valid
+    assert entries[0].reason
+
+
+def test_scan_projects_keeps_folder_order(tmp_path):
+    folders = []
+    for name in ('b', 'a'):
+        folder = tmp_path / name
+        folder.mkdir()
+        write_plan(folder / 'model.p01.hdf', short_id=name.upper())
+        write_plan(folder / 'model.p02.hdf', short_id=name.upper() + '2', stations=())
+        folders.append(str(folder))
+
+    entries = ras_scanner.scan_projects(folders)
+    assert [entry.short_id for entry in entries] == ['B', 'B2', 'A', 'A2']
+    assert [entry.short_id for entry in ras_scanner.valid_plans(entries)] == ['B', 'A']
+    assert [entry.reason for entry in ras_scanner.skipped_plans(entries)] == ['no Reference Lines'] * 2
+
+
+def test_scan_catalog_outside_folder(tmp_path):
+    project = tmp_path / 'synced'
+    project.mkdir()
+    write_plan(project / 'model.p01.hdf')
+    catalogs = tmp_path / 'catalogs'
+
+    for _ in range(2):  # the second scan reads the plan from the catalog
+        entries = ras_scanner.scan_projects([str(project)], catalog_dir=str(catalogs))
+        assert [entry.short_id for entry in entries] == ['P01']
+    assert os.listdir(project) == ['model.p01.hdf']
+    assert os.listdir(catalogs) == [os.path.basename(ras_catalog.catalog_path(str(project), str(catalogs)))]
@@ -0,0 +1,272 @@
+import os
+import sys
+import math
+import numpy as np
+
+import hydro_numpy
+from hydro_numpy import WBT_D8, POINTER_NODATA, ACCUM_NODATA
+import raster_output
+
+
+# Rough working memory per tile cell: pointer, receiver and terminal indices,
+# accumulation, in-degree and the row/col grids used to build the receivers.
+BYTES_PER_CELL = 80
+
+
+def tile_size(budget_mb, bytes_per_cell=BYTES_PER_CELL):
+    """
+    Side of a square tile whose working arrays fit in `budget_mb`.
+    """
+    side = int(math.sqrt(budget_mb * 1024 * 1024 / bytes_per_cell))
+    return max(side, 64)
+
+
+def tile_windows(rows, cols, tile):
+    """
+    (row offset, col offset, height, width) of every tile, row by row.
+    """
+    for r0 in range(0, rows, tile):
+        for c0 in range(0, cols, tile):
+            yield r0, c0, min(tile, rows - r0), min(tile, cols - c0)
+
+
+def _perimeter(h, w):
+    # local flat index of the border cells of an h x w tile
+    mask = np.zeros((h, w), dtype=bool)
+    mask[0, :] = mask[-1, :] = mask[:, 0] = mask[:, -1] = True
+    return np.flatnonzero(mask)
+
+
+def _terminal(down):
+    # cell where each cell's path ends inside the tile (pointer doubling)
+    term = np.where(down >= 0, down, np.arange(down.size))
+    while True:
+        nxt = term[term]
+        if np.array_equal(nxt, term):
+            return term
+        term = nxt
+
+
+def _global_receiver(code, row, col, rows, cols):
+    # global flat index of the cell a WBT code points to, -1 if none or off the raster
+    receiver = np.full(code.shape, -1, dtype=np.int64)
+    for c, (dr, dc) in WBT_D8.items():
+        sel = code == c
+        rr, cc = row[sel] + dr, col[sel] + dc
+        inside = (rr >= 0) & (rr < rows) & (cc >= 0) & (cc < cols)
+        receiver[np.flatnonzero(sel)[inside]] = rr[inside] * cols + cc[inside]
+    return receiver
+
+
+def accumulate_tiles(read_window, write_window, rows, cols, tile, nodata=POINTER_NODATA, feedback=None):
+    """
+    Exact D8 flow accumulation (cell counts) of a pointer raster, one tile at a time.
+
+    `read_window(r0, c0, h, w)` returns that window of the WBT pointer and
+    `write_window(r0, c0, array)` stores the accumulation for it. Only one tile
+    is in memory at a time, plus a small graph over the tile borders:
+
+    1. Each tile is accumulated on its own. Flow can only cross into another
+       tile through a border cell, so every border cell records the exit cell
+       its path leaves the tile through, and every exit its local total and
+       the (border) cell it drains into.
+    2. The exits form a flow graph of their own (exit -> the exit its receiver
+       drains to). Accumulating it gives the true total leaving each exit,
+       and with it the inflow each border cell gets from other tiles.
+    3. Each tile is accumulated again with those inflows added to its border
+       cells, which gives exactly the whole-raster result.
+    """
+    windows = list(tile_windows(rows, cols, tile))
+    steps = 2 * len(windows)
+
+    # pass 1: the tile graph
+    exits, exit_local, exit_receiver, border, border_exit = [], [], [], [], []
+    for i, (r0, c0, h, w) in enumerate(windows):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return False
+            feedback.setProgress(100 * i / steps)
+
+        pointer = read_window(r0, c0, h, w)
+        valid = (pointer != nodata).ravel()
+        down = hydro_numpy.downstream_index(pointer)
+        local = hydro_numpy.accumulate(down, valid)
+
+        perim = _perimeter(h, w)
+        prow, pcol = np.divmod(perim, w)
+        gid = (prow + r0) * cols + (pcol + c0)
+
+        # only border cells can leave the tile
+        receiver = _global_receiver(pointer.ravel()[perim], prow + r0, pcol + c0, rows, cols)
+        leaves = (down[perim] < 0) & (receiver >= 0)
+        exits.append(gid[leaves])
+        exit_local.append(local[perim][leaves])
+        exit_receiver.append(receiver[leaves])
+
+        # the exit each border cell's path leaves through, -1 if it ends in the tile
+        term = _terminal(down)[perim]
+        trow, tcol = np.divmod(term, w)
+        tgid = (trow + r0) * cols + (tcol + c0)
+        is_exit = np.isin(tgid, gid[leaves])
+        border.append(gid)
+        border_exit.append(np.where(is_exit, tgid, -1))
+
+    exits = np.concatenate(exits)
+    exit_local = np.concatenate(exit_local)
+    exit_receiver = np.concatenate(exit_receiver)
+    border = np.concatenate(border)
+    border_exit = np.concatenate(border_exit)
+
+    # pass 2: accumulate the exit graph
+    order = np.argsort(border)
+    border, border_exit = border[order], border_exit[order]
+    at = np.searchsorted(border, exit_receiver)
+    next_exit = border_exit[at]  # receivers are always border cells of the next tile
+
+    exit_order = np.argsort(exits)
+    exits_sorted = exits[exit_order]
+    next_index = np.full(exits.size, -1, dtype=np.int64)
+    has_next = next_exit >= 0
+    next_index[has_next] = exit_order[np.searchsorted(exits_sorted, next_exit[has_next])]
+    outflow = hydro_numpy.accumulate(next_index, exit_local)
+
+    inflow = np.zeros(border.size)
+    np.add.at(inflow, at, outflow)
+
+    # pass 3: accumulate each tile again with its inflow on the border
+    for i, (r0, c0, h, w) in enumerate(windows):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return False
+            feedback.setProgress(100 * (len(windows) + i) / steps)
+
+        pointer = read_window(r0, c0, h, w)
+        valid = (pointer != nodata).ravel()
+        weight = valid.astype(np.float64)
+
+        perim = _perimeter(h, w)
+        prow, pcol = np.divmod(perim, w)
+        gid = (prow + r0) * cols + (pcol + c0)
+        weight[perim] += inflow[np.searchsorted(border, gid)]
+
+        acc = hydro_numpy.accumulate(hydro_numpy.downstream_index(pointer), weight)
+        acc[~valid] = ACCUM_NODATA
+        write_window(r0, c0, acc.reshape(h, w))
+    return True
+
+
+def _open_output(path, template, dtype, kind):
+    from osgeo import gdal
+    if os.path.exists(path):
+        gdal.GetDriverByName('GTiff').Delete(path)
+    out = gdal.GetDriverByName('GTiff').Create(
+        path, template.RasterXSize, template.RasterYSize, 1, dtype, options=raster_output.creation_options(kind)
+    )
+    out.SetGeoTransform(template.GetGeoTransform())
+    out.SetProjection(template.GetProjection())
+    return out
+
+
+def tiled_d8_pointer(dem_path, output, budget_mb, feedback=None):
+    """
+    WBT-encoded D8 pointer of a (filled) DEM, computed per tile with a one
+    cell halo so the result matches hydro_numpy.d8_pointer on the whole DEM.
+    """
+    from osgeo import gdal
+    src = gdal.Open(dem_path)
+    band = src.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    rows, cols = src.RasterYSize, src.RasterXSize
+    geotransform = src.GetGeoTransform()
+    out = _open_output(output, src, gdal.GDT_Byte, 'pointer')
+    out_band = out.GetRasterBand(1)
+    out_band.SetNoDataValue(POINTER_NODATA)
+
+    windows = list(tile_windows(rows, cols, tile_size(budget_mb)))
+    for i, (r0, c0, h, w) in enumerate(windows):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(100 * i / len(windows))
+        # read the tile plus a one cell halo, padding with NaN past the raster edge
+        hr0, hc0 = max(r0 - 1, 0), max(c0 - 1, 0)
+        hr1, hc1 = min(r0 + h + 1, rows), min(c0 + w + 1, cols)
+        dem = np.full((h + 2, w + 2), np.nan)
+        block = band.ReadAsArray(hc0, hr0, hc1 - hc0, hr1 - hr0).astype(np.float64)
+        if nodata is not None:
+            block[block == nodata] = np.nan
+        dem[hr0 - r0 + 1:hr1 - r0 + 1, hc0 - c0 + 1:hc1 - c0 + 1] = block
+        out_band.WriteArray(hydro_numpy.d8_pointer(dem, geotransform)[1:-1, 1:-1], c0, r0)
+
+    out.FlushCache()
+    out = src = None
+    return output
+
+
+def tiled_d8_accumulation(pointer_path, output, budget_mb, feedback=None):
+    """
+    D8 flow accumulation (cells) of a WBT pointer raster within `budget_mb`
+    of working memory. See accumulate_tiles.
+    """
+    from osgeo import gdal
+    src = gdal.Open(pointer_path)
+    band = src.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    # float32 holds cell counts exactly up to 2**24 (as hydro_numpy.d8_accumulation)
+    large = src.RasterXSize * src.RasterYSize >= 2 ** 24
+    dtype, gdal_type = (np.float64, gdal.GDT_Float64) if large else (np.float32, gdal.GDT_Float32)
+    out = _open_output(output, src, gdal_type, 'accumulation')
+    out_band = out.GetRasterBand(1)
+    out_band.SetNoDataValue(ACCUM_NODATA)
+
+    done = accumulate_tiles(
+        lambda r0, c0, h, w: band.ReadAsArray(c0, r0, w, h),
+        lambda r0, c0, array: out_band.WriteArray(array.astype(dtype), c0, r0),
+        src.RasterYSize, src.RasterXSize, tile_size(budget_mb),
+        POINTER_NODATA if nodata is None else nodata, feedback
+    )
+    out.FlushCache()
+    out = src = None
+    return output if done else None
+
+
+# Tiled versions of the WBT steps, with the same alg_params and outputs as the
+# processing algorithms plus the working memory budget in MB.
+
+def _pointer_step(params, budget_mb, feedback=None):
+    if params.get('esri_pntr'):
+        raise ValueError('The tiled backend only writes WhiteboxTools pointers (esri_pntr=False)')
+    return {'output': tiled_d8_pointer(params['dem'], params['output'], budget_mb, feedback)}
+
+
+def _accumulation_step(params, budget_mb, feedback=None):
+    if params.get('out_type', 0) not in (0, 'cells') or params.get('log') or params.get('esri_pntr'):
+        raise ValueError('The tiled backend only computes cell counts from a WhiteboxTools pointer or a DEM')
+    source = params['input']
+    if not params.get('pntr'):
+        # accumulation from a DEM: derive the pointer first
+        source = tiled_d8_pointer(source, os.path.splitext(params['output'])[0] + '_pointer.tif', budget_mb, feedback)
+        if source is None:
+            return {'output': None}  # canceled
+    return {'output': tiled_d8_accumulation(source, params['output'], budget_mb, feedback)}
+
+
+TILED_STEPS = {
+    'wbt:D8Pointer': _pointer_step,
+    'wbt:D8FlowAccumulation': _accumulation_step,
+}
+
+
+def run_step(alg_id, params, budget_mb, feedback=None):
+    """
+    Run `alg_id` tile by tile. Only the algorithms in TILED_STEPS are supported.
+    """
+    return TILED_STEPS[alg_id](params, budget_mb, feedback)
+
+
+if __name__ == '__main__':
+    # python tiled_accumulation.py <pointer.tif> <output.tif> [budget MB]
+    if len(sys.argv) not in (3, 4):
+        sys.exit('usage: python tiled_accumulation.py <pointer.tif> <output.tif> [budget MB]')
+    budget = float(sys.argv[3]) if len(sys.argv) == 4 else 1024
+    print(tiled_d8_accumulation(sys.argv[1], sys.argv[2], budget))